@@ -0,0 +1,136 @@
+#!/usr/bin/env python2.7
+
+"""Measure event round-trips between two message exchanges over a loopback
+socket: the latency of one event at a time (p50/p99), and the throughput of
+many concurrent events. One exchange echoes the data of every event back in
+its reply.
+"""
+
+import sys
+import os.path
+dev_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, dev_path)
+
+import argparse
+import resource
+import time
+
+import gevent
+import gevent.socket
+
+import rpipe.protocol
+import rpipe.protocols
+import rpipe.message_exchange
+
+parser = argparse.ArgumentParser(description='Benchmark the message exchange.')
+
+parser.add_argument('-n', '--number',
+                    type=int, default=2000,
+                    help='Number of events to send, for each measurement')
+parser.add_argument('-c', '--concurrency',
+                    type=int, default=100,
+                    help='Number of events in flight for the throughput')
+parser.add_argument('-s', '--size',
+                    type=int, default=100,
+                    help='Number of bytes of event data')
+
+args = parser.parse_args()
+
+_ECHO_ADDRESS = ('echo', 1)
+_SENDER_ADDRESS = ('sender', 2)
+
+def _connect():
+    listener = gevent.socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+
+    s1 = gevent.socket.create_connection(listener.getsockname())
+    (s2, address) = listener.accept()
+
+    listener.close()
+
+    return (rpipe.protocol.SocketWrapper(s1, s1.makefile()),
+            rpipe.protocol.SocketWrapper(s2, s2.makefile()))
+
+def _echo():
+    while 1:
+        (message_info, message_obj) = rpipe.message_exchange.read(
+                                        _ECHO_ADDRESS)
+
+        reply_message_obj = rpipe.protocol.get_obj_from_type(
+                                rpipe.protocols.MT_EVENT_R)
+
+        reply_message_obj.version = 1
+        reply_message_obj.code = 0
+        reply_message_obj.data = message_obj.data
+
+        rpipe.message_exchange.send(
+            _ECHO_ADDRESS,
+            reply_message_obj,
+            reply_to_message_id=rpipe.protocol.get_message_id_from_info(
+                                    message_info),
+            expect_response=False)
+
+def _build_event():
+    message_obj = rpipe.protocol.get_obj_from_type(rpipe.protocols.MT_EVENT)
+    message_obj.version = 1
+    message_obj.verb = 'get'
+    message_obj.noun = 'echo'
+    message_obj.data = 'x' * args.size
+
+    return message_obj
+
+def _round_trip(message_obj):
+    rpipe.message_exchange.send_and_receive(_SENDER_ADDRESS, message_obj)
+
+def _measure_latency(message_obj):
+    timings = []
+    for i in range(args.number):
+        start_epoch = time.time()
+        _round_trip(message_obj)
+        timings.append(time.time() - start_epoch)
+
+    timings.sort()
+
+    return (timings[len(timings) // 2] * 1000.0,
+            timings[int(len(timings) * 0.99)] * 1000.0)
+
+def _measure_throughput(message_obj):
+    remaining = [args.number]
+
+    def sender():
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            _round_trip(message_obj)
+
+    start_epoch = time.time()
+    gevent.joinall([gevent.spawn(sender) for i in range(args.concurrency)])
+
+    return args.number / (time.time() - start_epoch)
+
+def _main():
+    (ws_sender, ws_echo) = _connect()
+
+    rpipe.message_exchange.start_exchange(ws_echo, _ECHO_ADDRESS)
+    rpipe.message_exchange.start_exchange(ws_sender, _SENDER_ADDRESS)
+
+    gevent.spawn(_echo)
+
+    message_obj = _build_event()
+
+    rss_before_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    (p50_ms, p99_ms) = _measure_latency(message_obj)
+    print("Latency (%d events of %d bytes): p50=%.3fms p99=%.3fms" %
+          (args.number, args.size, p50_ms, p99_ms))
+
+    events_per_s = _measure_throughput(message_obj)
+    print("Throughput (%d events, %d in flight): %.0f events/s" %
+          (args.number, args.concurrency, events_per_s))
+
+    rss_after_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print("Peak RSS: %d KB (+%d KB while measuring)" %
+          (rss_after_kb, rss_after_kb - rss_before_kb))
+
+if __name__ == '__main__':
+    _main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python2.7
+
+"""Measure the per-message cost of the protocol layer: looking up message
+classes and types, serializing and parsing an event, and reading a stream of 
+them from a socket.
+"""
+
+import sys
+import os.path
+dev_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, dev_path)
+
+import argparse
+import timeit
+import time
+import socket
+import threading
+
+import rpipe.config.exchange
+import rpipe.protocol
+import rpipe.protocols
+
+parser = argparse.ArgumentParser(description='Benchmark the protocol layer.')
+
+parser.add_argument('-n', '--number',
+                    type=int, default=100000,
+                    help='Number of messages to time')
+
+parser.add_argument('-d', '--data-bytes',
+                    type=int, default=100,
+                    help='Size of the event data')
+
+args = parser.parse_args()
+
+_HEADER_LENGTH = rpipe.protocol.get_standard_header_length()
+
+def _build_event():
+    message_obj = rpipe.protocol.get_obj_from_type(rpipe.protocols.MT_EVENT)
+    message_obj.version = 1
+    message_obj.verb = 'get'
+    message_obj.noun = 'time'
+    message_obj.data = 'x' * args.data_bytes
+
+    return message_obj
+
+_MESSAGE_OBJ = _build_event()
+(_SERIALIZED, _MESSAGE_ID) = rpipe.protocol.serialize_message_obj(
+                                _MESSAGE_OBJ, message_id=1)
+
+def look_up():
+    rpipe.protocol.get_obj_from_type(rpipe.protocols.MT_EVENT)
+    rpipe.protocols.get_type_from_obj(_MESSAGE_OBJ)
+
+def serialize():
+    rpipe.protocol.serialize_message_obj(_build_event(), message_id=1)
+
+def parse():
+    message_info = rpipe.protocol.get_message_info_from_header(
+                    _SERIALIZED[:_HEADER_LENGTH])
+
+    rpipe.protocol._unserialize(message_info, _SERIALIZED[_HEADER_LENGTH:])
+
+def read():
+    """Return the time taken to read the messages from a local socket, 
+    through the reader that the exchange uses. They're written from another 
+    thread.
+    """
+
+    (r, w) = socket.socketpair()
+
+    def write():
+        w.sendall(_SERIALIZED * args.number)
+        w.close()
+
+    t = threading.Thread(target=write)
+    t.start()
+
+    ws = rpipe.protocol.SocketWrapper(r, r.makefile('rb'))
+    reader = rpipe.protocol.FrameReader(
+                ws, 
+                rpipe.config.exchange.READ_BUFFER_BYTES,
+                rpipe.config.exchange.MAX_MESSAGE_BYTES,
+                rpipe.config.exchange.MAX_OPEN_FRAGMENTED_MESSAGES,
+                rpipe.config.exchange.MAX_OPEN_FRAGMENTED_BYTES)
+
+    start_at = time.time()
+
+    for i in xrange(args.number):
+        reader.read_message()
+
+    elapsed_s = time.time() - start_at
+
+    t.join()
+    r.close()
+
+    return elapsed_s
+
+def _main():
+    for f in (look_up, serialize, parse):
+        elapsed_s = timeit.timeit(f, number=args.number)
+        print("%-10s %.2fus per message" %
+              (f.__name__ + ':', elapsed_s / args.number * 1000000.0))
+
+    elapsed_s = read()
+    print("%-10s %.2fus per message" %
+          ('read:', elapsed_s / args.number * 1000000.0))
+
+if __name__ == '__main__':
+    _main()
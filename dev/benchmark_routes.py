@@ -0,0 +1,81 @@
+#!/usr/bin/env python2.7
+
+"""Measure the cost of routing an event to its handler, for an event-handler 
+with a few hundred routes, compared with building the handler name and 
+calling getattr() for every event.
+"""
+
+import sys
+import os.path
+dev_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, dev_path)
+
+import argparse
+import timeit
+
+import rpipe.config.statsd
+import rpipe.route
+
+parser = argparse.ArgumentParser(description='Benchmark event dispatch.')
+
+parser.add_argument('-r', '--routes', 
+                    type=int, default=300,
+                    help='Number of routes on the handler')
+parser.add_argument('-n', '--number', 
+                    type=int, default=200000,
+                    help='Number of dispatches to time')
+
+args = parser.parse_args()
+
+def _handler(self, ctx, post_data, *parameters):
+    pass
+
+methods = {}
+for i in range(args.routes):
+    methods['get_resource%d_item' % (i,)] = _handler
+    methods['post_resource%d_item' % (i,)] = _handler
+
+EventHandler = type('EventHandler', (object,), methods)
+eh = EventHandler()
+
+verb = 'get'
+noun = 'resource%d/item//abc/123' % (args.routes // 2,)
+
+def dispatch_by_getattr():
+    url_parts = noun.split('//')
+
+    noun_path = url_parts[0]
+    if len(url_parts) > 1:
+        parameters = url_parts[1].split('/')
+    else:
+        parameters = []
+
+    event_handler_name = '_'.join([verb.lower(), noun_path.replace('/', '_')])
+    handler = getattr(eh, event_handler_name)
+
+    rpipe.config.statsd.EVENT_HANDLER_TICK_TEMPLATE % \
+        { 'handler_name': event_handler_name }
+
+    rpipe.config.statsd.EVENT_HANDLER_TIMING_TEMPLATE % \
+        { 'handler_name': event_handler_name }
+
+    return (handler, parameters)
+
+table = rpipe.route.get_route_table(EventHandler)
+
+def dispatch_by_table():
+    (route, parameters) = table.lookup(verb, noun)
+
+    route.tick_name
+    route.timing_name
+
+    return (route, parameters)
+
+print("Routes: (%d)" % (len(table),))
+
+for (name, f) in (('getattr', dispatch_by_getattr), 
+                  ('table', dispatch_by_table)):
+    elapsed_s = min(timeit.repeat(f, number=args.number, repeat=3))
+
+    print("%-8s %.3f us/dispatch" % 
+          (name, elapsed_s / args.number * 1000000.0))
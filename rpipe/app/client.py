@@ -1,6 +1,5 @@
 import sys
 import logging
-import time
 import json
 
 import web
@@ -18,7 +17,9 @@ _logger = logging.getLogger(__name__)
 
 web.config.debug = rpipe.config.IS_DEBUG
 
-def connection_cycle():
+def connection_cycle(member_index):
+    """Keep one pipe of the pool connected."""
+
     state_change_event_cls = rpipe.utility.load_cls_from_string(
                                 rpipe.config.client.\
                                     CONNECTION_STATE_CHANGE_EVENT_CLASS)
@@ -31,7 +32,8 @@ def connection_cycle():
 
         # If we get disconnected, we'll continually reconnect.
         try:
-            _logger.info("Reattempting connection to server.")
+            _logger.info("Reattempting connection to server: MEMBER=(%d)", 
+                         member_index)
 
             # Establish a connection to the server.
             with rpipe.stats.time_and_post(
@@ -43,8 +45,8 @@ def connection_cycle():
                     fail_event=\
                         rpipe.config.statsd.\
                             EVENT_CONNECTION_CLIENT_HEARTBEAT_FAIL_TICK):
-                last_attempt = time.time()
-                c = rpipe.client.connection.get_connection()
+                c = rpipe.client.connection.get_client_manager().\
+                        connect(member_index)
 
             rpipe.stats.post_to_counter(
                 rpipe.config.statsd.EVENT_CONNECTION_CLIENT_CONNECTED_TICK)
@@ -56,38 +58,36 @@ def connection_cycle():
         except rpipe.exceptions.RpConnectionRetry:
             _logger.exception("Connection has broken and will be "
                               "reattempted.")
+        else:
+            _logger.warning("Connection has ended and will be reattempted.")
 
-            sce.connect_fail()
+        cm = rpipe.client.connection.get_client_manager()
+        cm.notify_broken(member_index)
 
-            rpipe.stats.post_to_counter(
-                rpipe.config.statsd.EVENT_CONNECTION_CLIENT_BROKEN_TICK)
+        sce.connect_fail()
+
+        rpipe.stats.post_to_counter(
+            rpipe.config.statsd.EVENT_CONNECTION_CLIENT_BROKEN_TICK)
 
-            time_since_attempt_s = (time.time() - last_attempt)
-            wait_time_s = \
-                rpipe.config.client.\
-                    MINIMAL_CONNECTION_FAIL_REATTEMPT_WAIT_TIME_S - \
-                time_since_attempt_s
+        wait_time_s = cm.members[member_index].reconnect_wait_s
 
-            _logger.debug("TIME_SINCE_ATTEMPT_S=(%d) MINIMAL_CONNECTION_FAIL_"
-                          "REATTEMPT_WAIT_TIME_S=(%d) WAIT_TIME_S=(%d)",
-                          time_since_attempt_s,
-                          rpipe.config.client.\
-                            MINIMAL_CONNECTION_FAIL_REATTEMPT_WAIT_TIME_S,
-                          wait_time_s)
+        _logger.info("Waiting for (%.2f) seconds before reconnect.", 
+                     wait_time_s)
 
-            if wait_time_s > 0:
-                _logger.info("Waiting for (%d) seconds before reconnect.", 
-                             wait_time_s)
+        rpipe.stats.post_timing(
+            rpipe.config.statsd.EVENT_CONNECTION_CLIENT_BACKOFF_TIMING,
+            wait_time_s * 1000.0)
 
-                gevent.sleep(wait_time_s)
+        gevent.sleep(wait_time_s)
 
 def client_socket_server_killed_cb(g):
 # TODO(dustin): We need to signal the web-server to die, here.
 #    gevent.kill(main)
     pass
 
-g = gevent.spawn(connection_cycle)
-g.link(client_socket_server_killed_cb)
+for i in range(len(rpipe.client.connection.get_client_manager())):
+    g = gevent.spawn(connection_cycle, i)
+    g.link(client_socket_server_killed_cb)
 
 # Establish the web-server object.
 app = web.application(
@@ -3,15 +3,21 @@
 import logging
 import os.path
 import time
+import random
+import collections
+import functools
 
 import gevent
+import gevent.event
 import gevent.socket
 import gevent.ssl
 
 import rpipe.config.client
+import rpipe.config.exchange
 import rpipe.config.statsd
 
 import rpipe.exceptions
+import rpipe.client.routing_policy
 import rpipe.protocol
 import rpipe.protocols
 import rpipe.connection
@@ -19,6 +25,8 @@ import rpipe.request_server
 import rpipe.message_loop
 import rpipe.message_exchange
 import rpipe.stats
+import rpipe.timer_wheel
+import rpipe.utility
 
 _logger = logging.getLogger(__name__)
 
@@ -37,20 +45,107 @@ class TestClientEventHandler(ClientEventHandler):
         return { 'result_from_client': str(x) + str(y) }
 
 
+class _RttEstimator(object):
+    """A smoothed round-trip time and the retransmission-style timeout derived 
+    from it (RFC 6298).
+    """
+
+    _ALPHA = 0.125
+    _BETA = 0.25
+
+    def __init__(self):
+        self.__srtt_s = None
+        self.__rttvar_s = None
+
+    def add_sample(self, rtt_s):
+        if self.__srtt_s is None:
+            self.__srtt_s = rtt_s
+            self.__rttvar_s = rtt_s / 2.0
+        else:
+            self.__rttvar_s = (1 - self._BETA) * self.__rttvar_s + \
+                              self._BETA * abs(self.__srtt_s - rtt_s)
+
+            self.__srtt_s = (1 - self._ALPHA) * self.__srtt_s + \
+                            self._ALPHA * rtt_s
+
+    @property
+    def srtt_s(self):
+        return self.__srtt_s
+
+    @property
+    def rto_s(self):
+        """None until there's been a sample."""
+
+        if self.__srtt_s is None:
+            return None
+
+        return self.__srtt_s + 4 * self.__rttvar_s
+
+
+_ssl_context = None
+
+def _get_ssl_context():
+    """Return a context that's shared by every connection, so that our 
+    certificate is only loaded once. Older versions of gevent don't have 
+    contexts, so we return None and wrap each socket from scratch.
+    """
+
+    global _ssl_context
+
+    if _ssl_context is None:
+        ssl_context_cls = getattr(gevent.ssl, 'SSLContext', None)
+        if ssl_context_cls is None:
+            return None
+
+        context = ssl_context_cls(gevent.ssl.PROTOCOL_SSLv23)
+
+        context.load_cert_chain(
+            rpipe.config.client.CRT_FILEPATH, 
+            keyfile=rpipe.config.client.KEY_FILEPATH)
+
+        _ssl_context = context
+
+    return _ssl_context
+
+def _wrap_socket(socket):
+    """Do the handshake on a connected socket. This is always a full 
+    handshake: the SSL module (on Python 2) can't offer a previous session to 
+    the server.
+    """
+
+    context = _get_ssl_context()
+    if context is None:
+        return gevent.ssl.wrap_socket(
+                socket,
+                keyfile=rpipe.config.client.KEY_FILEPATH,
+                certfile=rpipe.config.client.CRT_FILEPATH)
+
+    return context.wrap_socket(socket)
+
+
 class _ClientConnectionHandler(
         rpipe.connection.Connection, 
         rpipe.request_server.RequestServer):
-    def __init__(self):
+    def __init__(self, binding=None, pipe_index=0, ready_cb=None):
+        if binding is None:
+            binding = (rpipe.config.client.TARGET_HOSTNAME, 
+                       rpipe.config.client.TARGET_PORT)
+
+        self.__binding = binding
+        self.__pipe_index = pipe_index
+        self.__ready_cb = ready_cb
         self.__ws = None
         self.__connected = False
+        self.__heartbeat_timer = None
+        self.__rtt = _RttEstimator()
 
         self.__heartbeat_msg = rpipe.protocol.get_obj_from_type(
                                 rpipe.protocols.MT_HEARTBEAT)
 
         self.__heartbeat_msg.version = 1
 
-        self.__binding = (rpipe.config.client.TARGET_HOSTNAME, 
-                          rpipe.config.client.TARGET_PORT)
+        # Every pipe in the pool has its own exchange.
+        self.__exchange_key = self.__binding + (pipe_index,)
 
     def __del__(self):
         if self.__connected is True:
@@ -58,24 +153,36 @@ class _ClientConnectionHandler(
             self.close()
 
     def open(self):
-        _logger.info("Connecting to: %s", self.__binding)
+        _logger.info("Connecting to: %s PIPE=(%d)", 
+                     self.__binding, self.__pipe_index)
 
         if self.__connected is True:
             raise IOError("Client already connected.")
 
-        socket = gevent.socket.socket(
-                    gevent.socket.AF_INET, 
-                    gevent.socket.SOCK_STREAM)
+        if ':' in self.__binding[0]:
+            family = gevent.socket.AF_INET6
+        else:
+            family = gevent.socket.AF_INET
 
-        ss = gevent.ssl.wrap_socket(
-                socket,
-                keyfile=rpipe.config.client.KEY_FILEPATH,
-                certfile=rpipe.config.client.CRT_FILEPATH)
+        socket = gevent.socket.socket(family, gevent.socket.SOCK_STREAM)
 
         try:
-            ss.connect(self.__binding)
-        except gevent.socket.error:
-            raise rpipe.exceptions.RpConnectionFail(str(gevent.socket.error))
+            socket.connect(self.__binding)
+        except gevent.socket.error as e:
+            socket.close()
+            raise rpipe.exceptions.RpConnectionFail(str(e))
+
+        start_epoch = time.time()
+
+        try:
+            ss = _wrap_socket(socket)
+        except gevent.socket.error as e:
+            socket.close()
+            raise rpipe.exceptions.RpConnectionFail(str(e))
+
+        rpipe.stats.post_timing(
+            rpipe.config.statsd.EVENT_CONNECTION_CLIENT_HANDSHAKE_TIMING,
+            (time.time() - start_epoch) * 1000.0)
 
         self.__ws = rpipe.protocol.SocketWrapper(ss, ss.makefile())
         self.__connected = True
@@ -91,6 +198,9 @@ class _ClientConnectionHandler(
 
         self.__connected = False
 
+        if self.__heartbeat_timer is not None:
+            self.__heartbeat_timer.cancel()
+
         try:
             self.__ws.close()
         except:
@@ -104,13 +214,78 @@ class _ClientConnectionHandler(
         _logger.debug("Closing connection (__exit__).")
         self.close()
 
-    def __schedule_heartbeat(self):
-        _logger.debug("Scheduling heartbeat: (%d) seconds", 
-                      rpipe.config.client.HEARTBEAT_INTERVAL_S)
+    def __get_heartbeat_interval(self):
+        """Send early enough that the heartbeat arrives within the nominal 
+        interval (which the server's watchdog is based on).
+        """
 
-        g = gevent.spawn_later(
-                rpipe.config.client.HEARTBEAT_INTERVAL_S,
-                self.__send_heartbeat)
+        rto_s = self.__rtt.rto_s
+        if rto_s is None:
+            return rpipe.config.client.HEARTBEAT_INTERVAL_S
+
+        return max(rpipe.config.client.HEARTBEAT_MIN_INTERVAL_S,
+                   rpipe.config.client.HEARTBEAT_INTERVAL_S - rto_s)
+
+    def __get_heartbeat_timeout(self):
+        """Wait on the reply for a small multiple of the expected round-trip, 
+        but for at least the interval, so that only a connection that is 
+        really stuck is dropped.
+        """
+
+        rto_s = self.__rtt.rto_s
+        if rto_s is None:
+            return rpipe.config.client.HEARTBEAT_INTERVAL_S
+
+        timeout_s = rto_s * rpipe.config.client.HEARTBEAT_TIMEOUT_RTO_MULTIPLE
+
+        return min(rpipe.config.client.HEARTBEAT_MAX_TIMEOUT_S, 
+                   max(rpipe.config.client.HEARTBEAT_INTERVAL_S, timeout_s))
+
+    def __schedule_heartbeat(self, delay_s=None):
+        if delay_s is None:
+            delay_s = self.__get_heartbeat_interval()
+
+        _logger.debug("Scheduling heartbeat: (%.2f) seconds", delay_s)
+
+        self.__heartbeat_timer = rpipe.timer_wheel.get_timer_wheel().schedule(
+                                    delay_s,
+                                    self.__heartbeat_due)
+
+    def __heartbeat_due(self):
+        """Invoked from the timer wheel. Sending blocks on the reply, so it 
+        gets its own gthread. If traffic is already flowing in both 
+        directions, that suffices, and we check again later.
+        """
+
+        if self.__connected is False:
+            return
+
+        try:
+            exchange = rpipe.message_exchange.get_exchange(
+                        self.__exchange_key)
+        except KeyError:
+            pass
+        else:
+            if exchange.last_sent_epoch is not None and \
+               exchange.last_received_epoch is not None:
+                last_traffic_epoch = min(exchange.last_sent_epoch, 
+                                         exchange.last_received_epoch)
+
+                interval_s = self.__get_heartbeat_interval()
+                since_s = time.time() - last_traffic_epoch
+
+                if since_s < interval_s:
+                    _logger.debug("Connection is busy. Suppressing "
+                                  "heartbeat.")
+
+                    rpipe.stats.post_to_counter(
+                        rpipe.config.statsd.\
+                            EVENT_CONNECTION_CLIENT_HEARTBEAT_SUPPRESSED_TICK)
+
+                    self.__schedule_heartbeat(interval_s - since_s)
+                    return
+
+        g = gevent.spawn(self.__send_heartbeat)
 
         def heartbeat_die_cb(hb_g):
             _logger.error("The heartbeat gthread exceptioned-out. Killing "
@@ -123,11 +298,29 @@ class _ClientConnectionHandler(
     def __send_heartbeat(self):
         _logger.debug("Sending heartbeart.")
 
+        start_epoch = time.time()
+
         with rpipe.stats.time_and_post(
                 rpipe.config.statsd.EVENT_CONNECTION_CLIENT_HEARTBEAT_TIMING):
-            self.initiate_message(self.__heartbeat_msg)
+            self.initiate_message(
+                self.__heartbeat_msg, 
+                timeout=self.__get_heartbeat_timeout(),
+                priority=rpipe.config.exchange.PRIORITY_CONTROL)
+
+        rtt_s = time.time() - start_epoch
+        self.__rtt.add_sample(rtt_s)
 
-        _logger.debug("Heartbeat response received.")
+        _logger.debug("Heartbeat response received: RTT=(%.3f)ms "
+                      "RTO=(%.3f)ms", rtt_s * 1000.0, self.__rtt.rto_s * 1000.0)
+
+        # As a statsd timer, this is reported as a distribution.
+        rpipe.stats.post_timing(
+            rpipe.config.statsd.EVENT_CONNECTION_CLIENT_HEARTBEAT_RTT_TIMING,
+            rtt_s * 1000.0)
+
+        rpipe.stats.post_to_gauge(
+            rpipe.config.statsd.EVENT_CONNECTION_CLIENT_HEARTBEAT_RTO_GAUGE,
+            self.__rtt.rto_s * 1000.0)
 
         self.__schedule_heartbeat()
 
@@ -142,8 +335,10 @@ class _ClientConnectionHandler(
         with rpipe.stats.time_and_post(
                 rpipe.config.statsd.EVENT_CONNECTION_SEND_TIMING):
             return rpipe.message_exchange.send_and_receive(
-                    self.__binding, 
-                    message_obj)
+                    self.__exchange_key, 
+                    message_obj,
+                    timeout=kwargs.get('timeout'),
+                    priority=kwargs.get('priority'))
 
     def process_requests(self):
         assert self.__ws is not None
@@ -157,7 +352,14 @@ class _ClientConnectionHandler(
 
             eh = event_handler_cls()
             ctx = rpipe.message_loop.CONNECTION_CONTEXT_T(self.__binding)
-            cml = rpipe.message_loop.CommonMessageLoop(self.__ws, eh, ctx)
+            cml = rpipe.message_loop.CommonMessageLoop(
+                    self.__ws, 
+                    eh, 
+                    ctx, 
+                    identity=rpipe.config.client.IDENTITY, 
+                    initiate_hello=True,
+                    exchange_key=self.__exchange_key,
+                    ready_cb=self.__loop_ready)
 
             cml.handle()
         finally:
@@ -166,36 +368,361 @@ class _ClientConnectionHandler(
             # disqualifying it for reuse).
             self.close()
 
+    def __loop_ready(self):
+        if self.__ready_cb is not None:
+            self.__ready_cb(self)
+
     @property
     def connected(self):
         return self.__connected
 
+    @property
+    def binding(self):
+        return self.__binding
+
+    @property
+    def pipe_index(self):
+        return self.__pipe_index
+
+    @property
+    def srtt_s(self):
+        """The smoothed heartbeat round-trip, or None if not yet measured."""
+
+        return self.__rtt.srtt_s
+
+    @property
+    def is_ready(self):
+        """Whether we're connected, the message-loop is running, and the 
+        hello is settled (so that requests can be sent without being held).
+        """
+
+        if self.__connected is False:
+            return False
+
+        try:
+            return rpipe.message_exchange.is_alive(self.__exchange_key) and \
+                   rpipe.message_exchange.get_exchange(
+                    self.__exchange_key).hello_settled
+        except KeyError:
+            return False
+
+    @property
+    def in_flight_count(self):
+        """The number of replies that we're waiting on from the server."""
+
+        try:
+            exchange = rpipe.message_exchange.get_exchange(
+                        self.__exchange_key)
+        except KeyError:
+            return 0
+
+        return exchange.in_flight_count
+
+
+class _PoolMember(object):
+    """One pipe of the pool, and its health."""
+
+    def __init__(self, binding, pipe_index):
+        self.binding = binding
+        self.pipe_index = pipe_index
+        self.connection = None
+        self.consecutive_failures = 0
+        self.last_failure_epoch = None
+        self.last_connected_epoch = None
+
+    @property
+    def is_healthy(self):
+        return self.connection is not None and \
+               self.connection.is_ready is True
+
+    @property
+    def reconnect_wait_s(self):
+        """How long to back off before reconnecting (exponential, with 
+        jitter).
+        """
+
+        if self.consecutive_failures == 0:
+            return 0
+
+        # Cap the exponent, too, so that it can't overflow.
+        exponent = min(self.consecutive_failures - 1, 30)
+
+        backoff_s = min(rpipe.config.client.RECONNECT_BACKOFF_MAX_S,
+                        rpipe.config.client.RECONNECT_BACKOFF_INITIAL_S * 
+                            2 ** exponent)
+
+        return backoff_s / 2.0 + random.uniform(0, backoff_s / 2.0)
+
+
+class _Server(object):
+    """The pool of pipes to one server."""
+
+    def __init__(self, binding, members):
+        self.binding = binding
+        self.members = members
+
+    def __repr__(self):
+        return ('<Server %s:%d>' % self.binding)
+
+    @property
+    def healthy_members(self):
+        return [member 
+                for member 
+                in self.members 
+                if member.is_healthy is True]
+
+    @property
+    def is_available(self):
+        return any(member.is_healthy is True for member in self.members)
+
+    @property
+    def in_flight_count(self):
+        return sum(member.connection.in_flight_count
+                   for member
+                   in self.healthy_members)
+
+    @property
+    def srtt_s(self):
+        """The lowest smoothed round-trip among the healthy pipes, or None."""
+
+        measured = [member.connection.srtt_s 
+                    for member 
+                    in self.healthy_members 
+                    if member.connection.srtt_s is not None]
+
+        return min(measured) if measured else None
+
+    @property
+    def connection(self):
+        """The least-busy healthy pipe, or None."""
+
+        members = self.healthy_members
+
+        if not members:
+            return None
+        elif len(members) == 1:
+            return members[0].connection
+
+        member = min(members, 
+                     key=lambda member: member.connection.in_flight_count)
+
+        return member.connection
+
+
+def _get_targets():
+    if rpipe.config.client.TARGETS:
+        return rpipe.config.client.TARGETS
+
+    return [(rpipe.config.client.TARGET_HOSTNAME, 
+             rpipe.config.client.TARGET_PORT)]
+
 
 class _ClientManager(object):
-    """Establish a connection, and recall it from one invocation to the next. 
-    It will be reconnected as needed.
+    """Establish a pool of connections (pipes) to each server, and recall 
+    them from one invocation to the next. Each is reconnected as needed (by 
+    its own connection-cycle). Outbound events are sent to the server chosen 
+    by the routing policy (among those that have a healthy pipe), on its pipe 
+    with the fewest replies outstanding.
     """
 
-    def __init__(self):
-        self.__c = None
+    def __init__(self, targets, pool_size, routing_policy_cls):
+        assert targets
+        assert pool_size >= 1
 
-    def __del__(self):
-        if self.__c is not None:
-            del self.__c
+        self.__members = []
+        self.__servers = []
+
+        # Sends that are waiting for a server to become available, oldest 
+        # first, as (verb, noun, AsyncResult). Each is handed a pipe (in 
+        # order) once one is ready.
+        self.__waiters = collections.deque()
+
+        for binding in targets:
+            members = [_PoolMember(binding, i) for i in range(pool_size)]
+
+            self.__members.extend(members)
+            self.__servers.append(_Server(binding, members))
+
+        self.__policy = routing_policy_cls(self.__servers)
+
+    def __len__(self):
+        return len(self.__members)
+
+    def connect(self, member_index):
+        """Return the given pipe, connecting it if it's not connected."""
+
+        member = self.__members[member_index]
+
+        if member.connection is not None and \
+           member.connection.connected is True:
+            _logger.debug("Reusing connection: %s PIPE=(%d)", 
+                          member.binding, member.pipe_index)
+
+            return member.connection
+
+        _logger.info("Establishing new connection: %s PIPE=(%d)", 
+                     member.binding, member.pipe_index)
+
+        c = _ClientConnectionHandler(
+                member.binding, 
+                member.pipe_index, 
+                ready_cb=functools.partial(self.__connection_ready, member))
+
+        c.open()
+
+        # The failure count isn't reset until the hello settles, so that a 
+        # server that accepts connections and then drops them still gets 
+        # backed-off from.
+        member.connection = c
+        member.last_connected_epoch = time.time()
+
+        self.__post_connected_count()
+
+        return c
+
+    def __connection_ready(self, member, c):
+        """A pipe can now be used. Hand pipes to the buffered sends."""
+
+        if c.is_ready is False:
+            return
+
+        if member.connection is c:
+            member.consecutive_failures = 0
+
+        _logger.debug("Pipe (%d) to %s is ready: WAITING=(%d)", 
+                      c.pipe_index, c.binding, len(self.__waiters))
+
+        self.__hand_over()
+
+    def __hand_over(self):
+        """Hand a pipe to each waiting send that doesn't have one yet, oldest 
+        first. They're woken in the same order, so they go out in the order 
+        that they arrived.
+        """
+
+        for (verb, noun, waiter) in self.__waiters:
+            if waiter.ready() is True:
+                continue
+
+            c = self.__select(verb, noun)
+            if c is None:
+                break
+
+            waiter.set(c)
+
+    def notify_broken(self, member_index):
+        """The pipe failed to connect, or its connection has dropped."""
+
+        member = self.__members[member_index]
+        member.consecutive_failures += 1
+        member.last_failure_epoch = time.time()
+
+        _logger.warning("Pipe (%d) to %s is broken: CONSECUTIVE_FAILURES=(%d)",
+                        member.pipe_index, member.binding, 
+                        member.consecutive_failures)
+
+        self.__post_connected_count()
+
+    def __post_connected_count(self):
+        connected_count = sum(1 
+                              for member 
+                              in self.__members 
+                              if member.connection is not None and 
+                                 member.connection.connected is True)
+
+        rpipe.stats.post_to_gauge(
+            rpipe.config.statsd.EVENT_CONNECTION_CLIENT_POOL_CONNECTED_GAUGE,
+            connected_count)
 
     @property
-    def connection(self):
-        if self.__c is None or self.__c.connected is False:
-            _logger.info("Establishing new connection.")
-            c = _ClientConnectionHandler()
-            c.open()
-            self.__c = c
+    def members(self):
+        return list(self.__members)
+
+    @property
+    def servers(self):
+        return list(self.__servers)
+
+    def __select(self, verb, noun):
+        server = self.__policy.select(verb, noun or '')
+        if server is None:
+            return None
+
+        return server.connection
+
+    def get_connection(self, verb=None, noun=None, timeout=None):
+        """Return a pipe to the server that the routing policy chooses for 
+        the event. If no server is available (e.g. we're reconnecting), or 
+        other sends are still waiting for one, wait (behind them). Raise 
+        RpBackpressure if too many are already waiting, or 
+        RpConnectionUnavailable if the timeout expires first.
+        """
+
+        if not self.__waiters:
+            c = self.__select(verb, noun)
+            if c is not None:
+                return c
+
+        if len(self.__waiters) >= \
+                rpipe.config.client.OUTBOUND_BUFFER_MAX_COUNT:
+            rpipe.stats.post_to_counter(
+                rpipe.config.statsd.EVENT_CONNECTION_CLIENT_BUFFER_REJECT_TICK)
+
+            raise rpipe.exceptions.RpBackpressure(
+                    "Too many sends are waiting for a connection.")
+
+        if timeout is None:
+            timeout = rpipe.config.client.OUTBOUND_BUFFER_TIMEOUT_S
         else:
-            _logger.debug("Reusing connection.")
+            timeout = min(timeout, 
+                          rpipe.config.client.OUTBOUND_BUFFER_TIMEOUT_S)
+
+        waiter = gevent.event.AsyncResult()
+        entry = (verb, noun, waiter)
+        self.__waiters.append(entry)
+
+        # A pipe might be available already (and we're just queued behind 
+        # sends that are about to go).
+        self.__hand_over()
+
+        rpipe.stats.post_to_gauge(
+            rpipe.config.statsd.EVENT_CONNECTION_CLIENT_BUFFER_SIZE_GAUGE,
+            len(self.__waiters))
+
+        try:
+            with rpipe.stats.time_and_post(
+                    rpipe.config.statsd.\
+                        EVENT_CONNECTION_CLIENT_BUFFER_WAIT_TIMING):
+                try:
+                    return waiter.get(timeout=timeout)
+                except gevent.Timeout:
+                    raise rpipe.exceptions.RpConnectionUnavailable(
+                            "No connection became available within "
+                            "(%.2f) seconds." % (timeout,))
+        finally:
+            self.__waiters.remove(entry)
+
+            # The next in line might have been waiting on us.
+            self.__hand_over()
+
+_cm = None
+
+def get_client_manager():
+    global _cm
+
+    if _cm is None:
+        routing_policy_cls = rpipe.utility.load_cls_from_string(
+                                rpipe.config.client.ROUTING_POLICY_FQ_CLASS)
+
+        assert issubclass(
+                routing_policy_cls, 
+                rpipe.client.routing_policy.RoutingPolicy) is True
 
-        return self.__c
+        _cm = _ClientManager(
+                _get_targets(), 
+                rpipe.config.client.POOL_SIZE,
+                routing_policy_cls)
 
-_cm = _ClientManager()
+    return _cm
 
-def get_connection():
-    return _cm.connection
+def get_connection(verb=None, noun=None, timeout=None):
+    return get_client_manager().get_connection(verb, noun, timeout=timeout)
@@ -0,0 +1,101 @@
+"""Policies that choose which server an outbound event is sent to, when the
+client maintains pipes to several (see TARGETS in rpipe.config.client).
+
+A policy is constructed with every configured server (in the configured
+order), and returns the one to use for each event, or None. Servers that aren't
+available (no pipe is connected) must be skipped, which is how we fail over.
+"""
+
+import logging
+import bisect
+import hashlib
+
+import rpipe.config.client
+
+_logger = logging.getLogger(__name__)
+
+
+class RoutingPolicy(object):
+    def __init__(self, servers):
+        self.servers = servers
+
+    def select(self, verb, noun):
+        raise NotImplementedError()
+
+
+class PrimarySecondaryRoutingPolicy(RoutingPolicy):
+    """Send everything to the first available server in the configured
+    order.
+    """
+
+    def select(self, verb, noun):
+        for server in self.servers:
+            if server.is_available is True:
+                return server
+
+        return None
+
+
+class ConsistentHashRoutingPolicy(RoutingPolicy):
+    """Shard by noun (including its parameters), so that the same noun always
+    goes to the same server while it's available. When a server is
+    unavailable, its nouns move to the next server on the ring, and only
+    those.
+    """
+
+    def __init__(self, servers):
+        super(ConsistentHashRoutingPolicy, self).__init__(servers)
+
+        replicas = rpipe.config.client.CONSISTENT_HASH_REPLICAS
+
+        # A sorted list of (point, index-of-server). The index breaks ties 
+        # between equal points.
+        ring = []
+        for i, server in enumerate(servers):
+            for j in range(replicas):
+                point = self.__hash('%s:%d-%d' % (server.binding + (j,)))
+                ring.append((point, i))
+
+        ring.sort()
+
+        self.__points = [point for (point, i) in ring]
+        self.__ring_servers = [servers[i] for (point, i) in ring]
+
+    def __hash(self, value):
+        if isinstance(value, unicode) is True:
+            value = value.encode('utf-8')
+
+        return int(hashlib.md5(value).hexdigest()[:8], 16)
+
+    def select(self, verb, noun):
+        start = bisect.bisect(self.__points, self.__hash(noun))
+
+        ring_size = len(self.__ring_servers)
+        for i in range(ring_size):
+            server = self.__ring_servers[(start + i) % ring_size]
+            if server.is_available is True:
+                return server
+
+        return None
+
+
+class LeastLatencyRoutingPolicy(RoutingPolicy):
+    """Send to the available server with the lowest (smoothed) heartbeat
+    round-trip. Servers that haven't been measured yet are tried last.
+    """
+
+    def select(self, verb, noun):
+        best = None
+        best_srtt_s = None
+        for server in self.servers:
+            if server.is_available is False:
+                continue
+
+            srtt_s = server.srtt_s
+            if best is None or \
+               srtt_s is not None and \
+               (best_srtt_s is None or srtt_s < best_srtt_s):
+                best = server
+                best_srtt_s = srtt_s
+
+        return best
@@ -0,0 +1,121 @@
+"""Encoding and decoding of event payloads, by mimetype. JSON is always
+available (using the implementation set in the config), and msgpack is
+available if it's installed. Others can be added with register_codec().
+"""
+
+import logging
+import collections
+import importlib
+
+import rpipe.config.protocol
+
+_JSON_IMPLEMENTATIONS = ('json', 'simplejson', 'ujson')
+
+if rpipe.config.protocol.JSON_IMPLEMENTATION not in _JSON_IMPLEMENTATIONS:
+    raise ValueError("JSON implementation not supported: [%s]" % 
+                     (rpipe.config.protocol.JSON_IMPLEMENTATION,))
+
+_json = importlib.import_module(rpipe.config.protocol.JSON_IMPLEMENTATION)
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+_logger = logging.getLogger(__name__)
+
+CT_JSON = 'application/json'
+CT_MSGPACK = 'application/x-msgpack'
+
+CODEC_T = collections.namedtuple(
+            'Codec',
+            ['mimetype', 'encode', 'decode'])
+
+_CODECS = {}
+
+def register_codec(mimetype, encode, decode):
+    """Register the functions that encode an object to a string, and decode
+    it back, for the given mimetype.
+    """
+
+    _CODECS[mimetype.lower()] = CODEC_T(mimetype, encode, decode)
+
+def get_codec(mimetype):
+    """Return the codec for the mimetype (ignoring any parameters, like 
+    "; charset=utf-8"), or None if there isn't one.
+    """
+
+    if not mimetype:
+        return None
+
+    try:
+        return _CODECS[mimetype]
+    except KeyError:
+        mimetype = mimetype.partition(';')[0].strip().lower()
+        return _CODECS.get(mimetype)
+
+def get_mimetypes():
+    return [codec.mimetype for codec in _CODECS.values()]
+
+def _parse_accept(accept):
+    """Return the mimetypes from an Accept header, most-preferred first."""
+
+    ranked = []
+    for i, part in enumerate(accept.split(',')):
+        parameters = part.split(';')
+
+        mimetype = parameters[0].strip().lower()
+        if not mimetype:
+            continue
+
+        quality = 1.0
+        for parameter in parameters[1:]:
+            (name, _, value) = parameter.strip().partition('=')
+            if name == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+
+        if quality > 0:
+            ranked.append((-quality, i, mimetype))
+
+    ranked.sort()
+
+    return [mimetype for (quality, i, mimetype) in ranked]
+
+def negotiate(accept, default=CT_JSON):
+    """Return the registered mimetype that best satisfies the given Accept
+    header. If nothing acceptable is registered, we fall back to the default
+    (rather than refusing to answer).
+    """
+
+    if not accept:
+        return default
+
+    for mimetype in _parse_accept(accept):
+        if mimetype in _CODECS:
+            return _CODECS[mimetype].mimetype
+
+        if mimetype == '*/*':
+            return default
+
+        if mimetype.endswith('/*') is True:
+            prefix = mimetype[:-1]
+
+            if default.startswith(prefix) is True:
+                return default
+
+            for codec in _CODECS.values():
+                if codec.mimetype.startswith(prefix) is True:
+                    return codec.mimetype
+
+    _logger.debug("Nothing acceptable is registered. Using [%s]: [%s]",
+                  default, accept)
+
+    return default
+
+register_codec(CT_JSON, _json.dumps, _json.loads)
+
+if msgpack is not None:
+    register_codec(CT_MSGPACK, msgpack.packb, msgpack.unpackb)
@@ -1,12 +1,69 @@
 import os
 import os.path
 import sys
+import socket
 
 USER_CONFIG_MODULE_NAME = os.environ.get('RP_CLIENT_USER_CONFIG_MODULE', '')
 
 TARGET_HOSTNAME = os.environ.get('RP_CLIENT_TARGET_HOSTNAME', 'localhost')
 TARGET_PORT = int(os.environ.get('RP_CLIENT_TARGET_PORT', '1234'))
 
+# To maintain pipes to several servers, list them as "host:port,host:port" 
+# (an IPv6 address is given as "[address]:port"). Otherwise, we just connect to 
+# the target above.
+_TARGETS = os.environ.get('RP_CLIENT_TARGETS', '')
+
+def _parse_target(target):
+    (host, _, port) = target.rpartition(':')
+
+    if host.startswith('[') is True and host.endswith(']') is True:
+        host = host[1:-1]
+    elif ':' in host:
+        # An IPv6 address that isn't bracketed, or no port at all.
+        host = ''
+
+    if host == '' or port.isdigit() is False or not 0 < int(port) < 65536:
+        raise ValueError("RP_CLIENT_TARGETS entry [%s] is not \"host:port\" "
+                         "(or \"[address]:port\" for IPv6)." % (target,))
+
+    return (host, int(port))
+
+TARGETS = [_parse_target(target.strip())
+           for target
+           in _TARGETS.split(',')
+           if target.strip()]
+
+# The number of connections (pipes) to keep to each server. Outbound events 
+# are balanced across them.
+POOL_SIZE = int(os.environ.get('RP_CLIENT_POOL_SIZE', '1'))
+
+# Which server each outbound event goes to. The policies in 
+# rpipe.client.routing_policy are: PrimarySecondaryRoutingPolicy, 
+# ConsistentHashRoutingPolicy (by noun), and LeastLatencyRoutingPolicy.
+ROUTING_POLICY_FQ_CLASS = \
+    os.environ.get(
+        'RP_CLIENT_ROUTING_POLICY_FQ_CLASS',
+        'rpipe.client.routing_policy.PrimarySecondaryRoutingPolicy')
+
+# The number of points that each server has on the consistent-hashing ring.
+CONSISTENT_HASH_REPLICAS = 100
+
+# While no server is available, outbound events wait (in order) for a pipe to 
+# reconnect. This caps how many can wait, and how long each waits (unless the 
+# request's own timeout is shorter).
+OUTBOUND_BUFFER_MAX_COUNT = \
+    int(os.environ.get('RP_CLIENT_OUTBOUND_BUFFER_MAX_COUNT', '1000'))
+
+OUTBOUND_BUFFER_TIMEOUT_S = \
+    float(os.environ.get('RP_CLIENT_OUTBOUND_BUFFER_TIMEOUT_S', '10'))
+
+# Requests with these (idempotent) verbs are retried on another server if the 
+# pipe drops before the reply arrives.
+FAILOVER_RETRY_VERBS = ('get',)
+
+# How we identify ourselves to the server in the hello.
+IDENTITY = os.environ.get('RP_CLIENT_IDENTITY', socket.gethostname())
+
 _CERT_PATH = os.environ.get('RP_CLIENT_CERT_PATH', '/var/lib/restpipe')
 
 if os.path.exists(_CERT_PATH) is False:
@@ -20,6 +77,16 @@ CRT_FILEPATH = os.path.join(_CERT_PATH, _CRT_FILENAME)
 
 DEFAULT_READ_CHUNK_LENGTH = 1024
 HEARTBEAT_INTERVAL_S = int(os.environ.get('RP_CLIENT_HEARTBEAT_INTERVAL_S', '5'))
+
+# Heartbeats are skipped while traffic is flowing in both directions. 
+# Otherwise, they're sent a little early to allow for the measured round-trip 
+# time, and their replies are waited on for a multiple of it (within these 
+# bounds). The timeout is never shorter than the interval, so that a GC pause 
+# or a burst of traffic doesn't drop a healthy connection, and never longer 
+# than the reply timeout that heartbeats used to get.
+HEARTBEAT_MIN_INTERVAL_S = 1
+HEARTBEAT_MAX_TIMEOUT_S = 30
+HEARTBEAT_TIMEOUT_RTO_MULTIPLE = 4
 MAX_CONNECT_ATTEMPTS = 0
 RECONNECT_DELAY_S = 5
 
@@ -33,9 +100,15 @@ CONNECTION_STATE_CHANGE_EVENT_CLASS = \
         'RP_CONNECTION_STATE_CHANGE_EVENT_CLASS',
         'rpipe.state_change_event.StateChangeEvent') or None
 
-# We deal in terms of seconds, and we need to make sure to give the other side 
-# enough time to clean-up the old connection.
-MINIMAL_CONNECTION_FAIL_REATTEMPT_WAIT_TIME_S = 5
+# After a pipe fails, we wait before reconnecting it. The wait doubles with 
+# each consecutive failure (up to the maximum), and is jittered (to between 
+# half and all of it) so that clients don't reconnect in lockstep after a 
+# server restart.
+RECONNECT_BACKOFF_INITIAL_S = \
+    float(os.environ.get('RP_CLIENT_RECONNECT_BACKOFF_INITIAL_S', '1'))
+
+RECONNECT_BACKOFF_MAX_S = \
+    float(os.environ.get('RP_CLIENT_RECONNECT_BACKOFF_MAX_S', '60'))
 
 # Install attributes on this module from the optional user-config.
 if USER_CONFIG_MODULE_NAME != '':
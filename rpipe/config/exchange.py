@@ -1,4 +1,111 @@
-IDLE_TIMEOUT_S = .5
+import os
 
 UNHANDLED_EVENT_CODE = 250
 UNHANDLED_EXCEPTION_CODE = 251
+
+# The code that an event is answered with when the receiving side is too far 
+# behind to accept it (see INCOMING_HIGH_WATER_COUNT).
+INCOMING_REFUSED_CODE = 503
+
+# The code that an event is answered with when its reply is larger than we 
+# (or the other side) will send (see MAX_MESSAGE_BYTES).
+REPLY_TOO_LARGE_CODE = 413
+
+# The code that an event is answered with when its reply carries binary data 
+# that the other side can't parse (it predates binary payloads).
+BINARY_DATA_UNSUPPORTED_CODE = 406
+
+# The writer drains everything queued (up to these caps) into one write.
+WRITE_BATCH_MAX_COUNT = 256
+WRITE_BATCH_MAX_BYTES = 256 * 1024
+
+USE_TCP_NODELAY = True
+USE_TCP_CORK = False
+
+# Have the kernel detect dead peers on its own, independently of heartbeats. 
+# The user-timeout bounds how long sent data may go unacknowledged before the 
+# connection is dropped (Linux only). Set the idle time or timeout to 0 to 
+# leave the system defaults.
+TCP_KEEPALIVE_IDLE_S = 10
+TCP_KEEPALIVE_INTERVAL_S = 5
+TCP_KEEPALIVE_COUNT = 3
+TCP_USER_TIMEOUT_MS = 30000
+
+# How long we'll wait on a reply when the caller doesn't say.
+DEFAULT_REPLY_TIMEOUT_S = 30
+
+# How often unanswered messages are checked against their deadlines.
+REPLY_EXPIRY_INTERVAL_S = 1
+
+# Per-connection high-water marks for unprocessed incoming messages. Above 
+# either, new events are refused (with INCOMING_REFUSED_CODE) rather than 
+# queued. Replies and heartbeats are always accepted.
+INCOMING_HIGH_WATER_COUNT = 1000
+INCOMING_HIGH_WATER_BYTES = 64 * 1024 * 1024
+
+# New requests wait (for up to BACKPRESSURE_WAIT_TIMEOUT_S) while the outgoing 
+# queue is above either of these, and are then rejected.
+OUTGOING_HIGH_WATER_COUNT = 1000
+OUTGOING_HIGH_WATER_BYTES = 64 * 1024 * 1024
+BACKPRESSURE_WAIT_TIMEOUT_S = 5
+
+# Outgoing priority lanes (lower goes first).
+PRIORITY_CONTROL = 0
+PRIORITY_REPLY = 1
+PRIORITY_HIGH = 2
+PRIORITY_NORMAL = 3
+PRIORITY_LOW = 4
+
+# The priorities that events may request (see HEADER_EVENT_PRIORITY).
+EVENT_PRIORITIES = {
+    'high': PRIORITY_HIGH,
+    'normal': PRIORITY_NORMAL,
+    'low': PRIORITY_LOW,
+}
+
+# When enabled, an event with one of these verbs that's identical to one 
+# already in flight on the same connection waits on that one's reply rather 
+# than being sent again (see rpipe.event.emit).
+SINGLEFLIGHT_ENABLED = bool(int(os.environ.get('RP_SINGLEFLIGHT', '0')))
+SINGLEFLIGHT_VERBS = ('get',)
+
+# A waiting lane is served after being passed over this many times in a row.
+STARVATION_MAX_SKIPS = 32
+
+# The initial (and resting) size of each connection's receive-buffer. It grows 
+# temporarily to hold a larger message.
+READ_BUFFER_BYTES = 64 * 1024
+
+# Message bodies at least this large are compressed (when the other side 
+# supports it, and when it actually helps). The codec may be "zlib", "bz2", or 
+# empty to disable compression.
+COMPRESSION_CODEC = os.environ.get('RP_COMPRESSION_CODEC', 'zlib')
+COMPRESSION_LEVEL = int(os.environ.get('RP_COMPRESSION_LEVEL', '6'))
+COMPRESSION_THRESHOLD_BYTES = 1024
+
+# Toward peers that support it, message bodies larger than this are sent as a 
+# series of fragments, interleaved with other traffic.
+FRAGMENT_BYTES = 64 * 1024
+
+# The largest (reassembled) message that we'll send or accept.
+MAX_MESSAGE_BYTES = 256 * 1024 * 1024
+
+# The most messages that the other side may have partially sent at once, and 
+# the most bytes that their fragments may hold between them. A well-behaved 
+# peer stays within its outgoing high-water marks (plus one maximal message). 
+# Beyond either, the connection is dropped as a protocol error.
+MAX_OPEN_FRAGMENTED_MESSAGES = OUTGOING_HIGH_WATER_COUNT
+MAX_OPEN_FRAGMENTED_BYTES = OUTGOING_HIGH_WATER_BYTES + MAX_MESSAGE_BYTES
+
+# Toward peers that support it, events are coalesced into a single batch 
+# message (up to a count and byte cap). With a window of 0, a batch collects 
+# whatever is sent before the sending gthread yields, which adds no latency. A 
+# longer window (in seconds) trades latency for larger batches. Set it to an 
+# empty string to disable batching.
+_EVENT_BATCH_WINDOW_S = os.environ.get('RP_EVENT_BATCH_WINDOW_S', '0')
+EVENT_BATCH_WINDOW_S = float(_EVENT_BATCH_WINDOW_S) \
+                        if _EVENT_BATCH_WINDOW_S \
+                        else None
+
+EVENT_BATCH_MAX_COUNT = 100
+EVENT_BATCH_MAX_BYTES = 64 * 1024
@@ -1,4 +1,45 @@
+import os
+
 WATCH_LOOP_INTERVAL_S = 1
 DEFAULT_WATCH_WAIT_TIMEOUT_S = 5
 UNHANDLED_EVENT_DEFAULT_RESULT_CODE = 255
-MESSAGE_LOOP_READ_TIMEOUT_S = 1
\ No newline at end of file
+MESSAGE_LOOP_READ_TIMEOUT_S = 1
+
+# The number of events that may be handled concurrently for one connection, 
+# and across all connections in the process.
+EVENT_DISPATCH_POOL_SIZE = 20
+EVENT_DISPATCH_GLOBAL_MAX = 200
+
+# The number of events (per connection) that may wait for a handler to free 
+# up. Beyond that, events are refused (see INCOMING_REFUSED_CODE in 
+# rpipe.config.exchange).
+EVENT_DISPATCH_BACKLOG_MAX = 1000
+
+# How long the client waits on the reply to its hello.
+HELLO_TIMEOUT_S = 10
+
+# The verbs whose handlers are found by name (e.g. "get_time"). Other methods 
+# are only routed if they're decorated with rpipe.route.route().
+EVENT_VERBS = ('get', 'post', 'put', 'delete', 'patch')
+
+# The number of distinct (verb, noun) pairs whose routes are remembered per 
+# event-handler class.
+ROUTE_RESOLVED_CACHE_MAX_ENTRIES = 10000
+
+# The default bounds of each cached route's responses (see 
+# rpipe.route.cached).
+RESPONSE_CACHE_MAX_ENTRIES = 1000
+RESPONSE_CACHE_MAX_BYTES = 16 * 1024 * 1024
+
+# The shared timer wheel (heartbeats and their watchdogs). The range of the 
+# wheel is TICK_S * SLOT_COUNT ** LEVEL_COUNT (beyond which timers are just 
+# placed again when they're reached).
+TIMER_WHEEL_TICK_S = 0.1
+TIMER_WHEEL_SLOT_COUNT = 64
+TIMER_WHEEL_LEVEL_COUNT = 4
+
+# The module that JSON payloads are encoded and decoded with ("json", 
+# "simplejson", or "ujson"). The faster implementations don't produce 
+# byte-for-byte the same output as the standard library, so they have to be 
+# asked for.
+JSON_IMPLEMENTATION = os.environ.get('RP_JSON_IMPLEMENTATION', 'json')
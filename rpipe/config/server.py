@@ -1,12 +1,16 @@
 import os
 import os.path
 import sys
+import socket
 
 USER_CONFIG_MODULE_NAME = os.environ.get('RP_SERVER_USER_CONFIG_MODULE', '')
 
 BIND_IP = os.environ.get('RP_SERVER_BIND_INTERFACE', '0.0.0.0')
 BIND_PORT = int(os.environ.get('RP_SERVER_BIND_PORT', '1234'))
 
+# How we identify ourselves to clients in the hello.
+IDENTITY = os.environ.get('RP_SERVER_IDENTITY', socket.gethostname())
+
 _CERT_PATH = os.environ.get('RP_SERVER_CERT_PATH', '/var/lib/restpipe')
 
 if os.path.exists(_CERT_PATH) is False:
@@ -33,7 +37,21 @@ EVENT_HANDLER_FQ_CLASS = \
 
 DEFAULT_CONNECTION_WAIT_TIMEOUT_S = 20
 
-CLIENT_HOSTNAME_RESOLVER_CLS = 'rpipe.server.hostname_resolver.HostnameResolverDns'
+# If set (e.g. to "rpipe.server.hostname_resolver.HostnameResolverDns"), a 
+# name that no connected client has identified itself with is resolved to an 
+# IP, and the event goes to a client connected from that IP. Off by default, 
+# since several clients can share an IP (e.g. behind NAT).
+CLIENT_HOSTNAME_RESOLVER_CLS = \
+    os.environ.get('RP_SERVER_CLIENT_HOSTNAME_RESOLVER_CLS') or None
+
+# A client that doesn't finish the TLS handshake within this long is dropped, 
+# so that it can't hold a connection (and its gthread) open.
+HANDSHAKE_TIMEOUT_S = \
+    float(os.environ.get('RP_SERVER_HANDSHAKE_TIMEOUT_S', '10'))
+
+# Connections accepted within this long of each other are reported as one 
+# reconnect storm.
+RECONNECT_STORM_WINDOW_S = 1
 
 # Install attributes on this module from the optional user-config.
 if USER_CONFIG_MODULE_NAME != '':
@@ -11,11 +11,58 @@ EVENT_CONNECTION_CLIENT_HEARTBEAT_TIMING       = 'client.connect.heartbeat.timin
 EVENT_CONNECTION_CLIENT_HEARTBEAT_SUCCESS_TICK = 'client.connect.heartbeat.success.tick'
 EVENT_CONNECTION_CLIENT_HEARTBEAT_FAIL_TICK    = 'client.connect.heartbeat.fail.tick'
 
+EVENT_CONNECTION_CLIENT_HEARTBEAT_RTT_TIMING      = 'client.connect.heartbeat.rtt.timing'
+EVENT_CONNECTION_CLIENT_HEARTBEAT_RTO_GAUGE       = 'client.connect.heartbeat.rto.gauge'
+EVENT_CONNECTION_CLIENT_HEARTBEAT_SUPPRESSED_TICK = 'client.connect.heartbeat.suppressed.tick'
+
+EVENT_CONNECTION_CLIENT_POOL_CONNECTED_GAUGE = 'client.connect.pool.connected.gauge'
+EVENT_CONNECTION_CLIENT_FAILOVER_RETRY_TICK  = 'client.connect.failover.retry.tick'
+
+EVENT_CONNECTION_CLIENT_HANDSHAKE_TIMING       = 'client.connect.handshake.timing'
+EVENT_CONNECTION_CLIENT_BACKOFF_TIMING         = 'client.connect.backoff.timing'
+
+EVENT_CONNECTION_CLIENT_BUFFER_SIZE_GAUGE   = 'client.buffer.size.gauge'
+EVENT_CONNECTION_CLIENT_BUFFER_WAIT_TIMING  = 'client.buffer.wait.timing'
+EVENT_CONNECTION_CLIENT_BUFFER_REJECT_TICK  = 'client.buffer.reject.tick'
+
+EVENT_CONNECTION_SERVER_NEW_TICK               = 'server.connect.new.tick'
+EVENT_CONNECTION_SERVER_STORM_SIZE_GAUGE       = 'server.connect.storm.size.gauge'
+EVENT_CONNECTION_SERVER_HANDSHAKE_TIMING       = 'server.connect.handshake.timing'
+EVENT_CONNECTION_SERVER_HANDSHAKE_FAIL_TICK    = 'server.connect.handshake.fail.tick'
+EVENT_CONNECTION_SERVER_HANDSHAKE_RESUMED_TICK = 'server.connect.handshake.resumed.tick'
+
 EVENT_CONNECTION_SEND_TICK   = 'message.send.tick'
 EVENT_CONNECTION_SEND_TIMING = 'message.send.timing'
 
 EVENT_MESSAGE_RECEIVE_TICK          = 'message.receive.tick'
 EVENT_MESSAGE_RECEIVE_HANDLE_TIMING = 'message.receive.handle.timing'
 
+EVENT_EXCHANGE_REPLY_INFLIGHT_GAUGE = 'exchange.reply.inflight.gauge'
+EVENT_EXCHANGE_REPLY_TIMEOUT_TICK   = 'exchange.reply.timeout.tick'
+
+EVENT_EXCHANGE_BACKPRESSURE_TICK        = 'exchange.backpressure.tick'
+EVENT_EXCHANGE_BACKPRESSURE_REJECT_TICK = 'exchange.backpressure.reject.tick'
+EVENT_EXCHANGE_INCOMING_REJECT_TICK     = 'exchange.incoming.reject.tick'
+
+EVENT_EXCHANGE_EVENT_BATCH_SIZE_GAUGE = 'exchange.event_batch.size.gauge'
+
+EVENT_EMIT_SINGLEFLIGHT_JOINED_TICK = 'event.singleflight.joined.tick'
+
+EVENT_TIMER_WHEEL_TIMERS_GAUGE = 'timer_wheel.timers.gauge'
+
+EVENT_DISPATCH_POOL_SATURATED_TICK = 'message.dispatch.pool.saturated.tick'
+EVENT_DISPATCH_POOL_FREE_GAUGE     = 'message.dispatch.pool.free.gauge'
+EVENT_DISPATCH_QUEUE_WAIT_TIMING   = 'message.dispatch.queue_wait.timing'
+EVENT_DISPATCH_BACKLOG_REJECT_TICK = 'message.dispatch.backlog.reject.tick'
+
+EVENT_PROTOCOL_COMPRESS_TIMING      = 'protocol.compress.timing'
+EVENT_PROTOCOL_COMPRESS_SAVED_BYTES = 'protocol.compress.saved_bytes'
+
+EVENT_CONNECTION_NEGOTIATED_TEMPLATE = 'connection.negotiated.%(setting)s.tick'
+
 EVENT_HANDLER_TICK_TEMPLATE = 'message.received.handle.%(handler_name)s.tick'
 EVENT_HANDLER_TIMING_TEMPLATE = 'message.received.handle.%(handler_name)s.timing'
+
+EVENT_HANDLER_CACHE_HIT_TEMPLATE   = 'message.received.handle.%(handler_name)s.cache.hit.tick'
+EVENT_HANDLER_CACHE_MISS_TEMPLATE  = 'message.received.handle.%(handler_name)s.cache.miss.tick'
+EVENT_HANDLER_CACHE_EVICT_TEMPLATE = 'message.received.handle.%(handler_name)s.cache.evict.tick'
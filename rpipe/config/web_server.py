@@ -1 +1,7 @@
 HEADER_EVENT_RETURN_CODE = 'X-Event-Return-Code'
+
+# An optional, per-request override of how long to wait on the reply.
+HEADER_EVENT_TIMEOUT_S = 'X-Event-Timeout-S'
+
+# An optional priority for the event ("high", "normal", or "low").
+HEADER_EVENT_PRIORITY = 'X-Event-Priority'
@@ -1,12 +1,30 @@
 import logging
 
+import gevent
+import gevent.event
+
+import rpipe.config.exchange
+import rpipe.config.statsd
 import rpipe.protocols
 import rpipe.protocol
 import rpipe.connection
+import rpipe.exceptions
+import rpipe.stats
 
 _logger = logging.getLogger(__name__)
 
-def emit(c, verb, noun, data, mimetype=None):
+# The results of events that are currently being sent, for single-flight 
+# coalescing. The key covers everything that determines the reply.
+_in_flight = {}
+
+def emit(c, verb, noun, data, mimetype=None, timeout=None, priority=None, 
+         accept=None, singleflight=None):
+    """Send an event and return the (code, mimetype, data) of the reply. If 
+    singleflight is True (or it's None and single-flight is enabled in the 
+    configuration), a safe event that's identical to one already in flight on 
+    the same connection just waits on that one's reply.
+    """
+
     assert issubclass(c.__class__, rpipe.connection.Connection)
 
     if mimetype is None:
@@ -14,6 +32,47 @@ def emit(c, verb, noun, data, mimetype=None):
 
     mimetype = mimetype.split(';')[0]
 
+    if singleflight is None:
+        singleflight = rpipe.config.exchange.SINGLEFLIGHT_ENABLED
+
+    if singleflight is False or \
+       verb.lower() not in rpipe.config.exchange.SINGLEFLIGHT_VERBS:
+        return _emit(c, verb, noun, data, mimetype, timeout, priority, accept)
+
+    key = (c, verb.lower(), noun, mimetype, data, accept)
+
+    try:
+        result = _in_flight[key]
+    except KeyError:
+        pass
+    else:
+        _logger.debug("Joining in-flight event: [%s] [%s]", verb, noun)
+
+        rpipe.stats.post_to_counter(
+            rpipe.config.statsd.EVENT_EMIT_SINGLEFLIGHT_JOINED_TICK)
+
+        try:
+            return result.get(timeout=timeout)
+        except gevent.Timeout:
+            raise rpipe.exceptions.RpReplyTimeout(
+                    "No reply received for in-flight event [%s] [%s]." % 
+                    (verb, noun))
+
+    result = gevent.event.AsyncResult()
+    _in_flight[key] = result
+
+    try:
+        r = _emit(c, verb, noun, data, mimetype, timeout, priority, accept)
+    except Exception as e:
+        result.set_exception(e)
+        raise
+    else:
+        result.set(r)
+        return r
+    finally:
+        del _in_flight[key]
+
+def _emit(c, verb, noun, data, mimetype, timeout, priority, accept):
     _logger.info("Emitting [%s] [%s]: (%d) bytes", verb, noun, len(data))
 
     message_obj = rpipe.protocol.get_obj_from_type(rpipe.protocols.MT_EVENT)
@@ -23,6 +82,9 @@ def emit(c, verb, noun, data, mimetype=None):
     message_obj.mimetype = mimetype
     message_obj.data = data
 
-    r = c.initiate_message(message_obj)
+    if accept:
+        message_obj.accept = accept
+
+    r = c.initiate_message(message_obj, timeout=timeout, priority=priority)
 
     return (r.code, r.mimetype, r.data)
@@ -23,3 +23,27 @@ class RpConnectionFail(RpConnectionRetry):
 
 class RpConnectionClosed(RpConnectionRetry):
     pass
+
+
+class RpConnectionUnavailable(RpException):
+    pass
+
+
+class RpReplyTimeout(RpException):
+    pass
+
+
+class RpBackpressure(RpException):
+    pass
+
+
+class RpMessageTooLarge(RpException):
+    pass
+
+
+class RpBinaryDataUnsupported(RpException):
+    pass
+
+
+class RpProtocolError(RpException):
+    pass
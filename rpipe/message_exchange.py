@@ -1,16 +1,271 @@
 import logging
+import heapq
+import time
+import collections
 
 import gevent
 import gevent.queue
-import gevent.select
 import gevent.event
 
 import rpipe.config.exchange
+import rpipe.config.statsd
 import rpipe.exceptions
 import rpipe.protocol
+import rpipe.protocols
+import rpipe.stats
+import rpipe.timer_wheel
 
 _logger = logging.getLogger(__name__)
 
+# An entry in the outgoing queue. Once a fragmented message has started being 
+# written, it's requeued with the generator of its remaining fragments.
+_OUTGOING_T = collections.namedtuple(
+                '_OUTGOING_T', 
+                ['priority', 'message_id', 'message_obj', 'size', 'fragments'])
+
+
+class _OutgoingScheduler(object):
+    """A set of FIFO lanes, one per priority (lower values go first). A lane 
+    that has been passed over too many times in a row gets served next, so 
+    bulk traffic can be delayed but not starved.
+    """
+
+    def __init__(self, lane_count, max_skips):
+        self.__lanes = [collections.deque() for i in range(lane_count)]
+        self.__skips = [0] * lane_count
+        self.__max_skips = max_skips
+        self.__count = 0
+        self.__available = gevent.event.Event()
+
+    def qsize(self):
+        return self.__count
+
+    def put(self, priority, item):
+        self.__lanes[priority].append(item)
+        self.__count += 1
+        self.__available.set()
+
+    def get(self):
+        while self.__count == 0:
+            self.__available.clear()
+            self.__available.wait()
+
+        return self.get_nowait()
+
+    def get_nowait(self):
+        if self.__count == 0:
+            raise gevent.queue.Empty()
+
+        selected = None
+        for i in range(len(self.__lanes) - 1, -1, -1):
+            if self.__lanes[i] and self.__skips[i] >= self.__max_skips:
+                selected = i
+                break
+
+        if selected is None:
+            for i, lane in enumerate(self.__lanes):
+                if lane:
+                    selected = i
+                    break
+
+        for i in range(selected + 1, len(self.__lanes)):
+            if self.__lanes[i]:
+                self.__skips[i] += 1
+
+        self.__skips[selected] = 0
+        self.__count -= 1
+
+        return self.__lanes[selected].popleft()
+
+
+# Requests that may be refused when the incoming queue is full. Anything else 
+# (e.g. heartbeats) is always accepted.
+_REFUSABLE_TYPES = (
+    rpipe.protocols.MT_EVENT, 
+    rpipe.protocols.MT_EVENT_BATCH,
+)
+
+def _fill_refused_reply(reply_message_obj):
+    reply_message_obj.version = 1
+    reply_message_obj.code = rpipe.config.exchange.INCOMING_REFUSED_CODE
+    reply_message_obj.mimetype = 'text/plain'
+    reply_message_obj.data = 'Too many incoming events'
+
+
+class ReplyFuture(object):
+    """The eventual reply to a message. If is_held is True (for messages sent 
+    with send()), the exchange keeps tracking it after the reply arrives, until 
+    it's collected with wait_on_reply() or its deadline passes.
+    """
+
+    def __init__(self, address, message_id, deadline, is_held=False):
+        self.__address = address
+        self.__message_id = message_id
+        self.__deadline = deadline
+        self.__is_held = is_held
+        self.__result = gevent.event.AsyncResult()
+
+    def __repr__(self):
+        return ('<ReplyFuture %s %s>' % 
+                (self.__address, 
+                 rpipe.protocol.get_string_from_message_id(self.__message_id)))
+
+    def set(self, message):
+        self.__result.set(message)
+
+    def set_exception(self, exception):
+        self.__result.set_exception(exception)
+
+    def ready(self):
+        return self.__result.ready()
+
+    def wait(self, timeout=None):
+        """Block until the future is resolved or the timeout passes. Return 
+        whether it was resolved.
+        """
+
+        self.__result.wait(timeout=timeout)
+        return self.__result.ready()
+
+    def rawlink(self, callback):
+        """Invoke the callback with this future once it's resolved."""
+
+        self.__result.rawlink(lambda result: callback(self))
+
+    def get_message(self, timeout=None):
+        """Return the (message_info, message_obj) 2-tuple of the reply. If no 
+        timeout is given, we wait until the deadline established when the 
+        message was sent.
+        """
+
+        if timeout is None:
+            timeout = max(0, self.__deadline - time.time())
+
+        try:
+            return self.__result.get(timeout=timeout)
+        except gevent.Timeout:
+            rpipe.stats.post_to_counter(
+                rpipe.config.statsd.EVENT_EXCHANGE_REPLY_TIMEOUT_TICK)
+
+            raise rpipe.exceptions.RpReplyTimeout(
+                    "No reply received for message [%s] from [%s]." % 
+                    (rpipe.protocol.get_string_from_message_id(
+                        self.__message_id), 
+                     self.__address))
+
+    def get(self, timeout=None):
+        """Return the reply message object."""
+
+        (message_info, message_obj) = self.get_message(timeout=timeout)
+        return message_obj
+
+    @property
+    def address(self):
+        return self.__address
+
+    @property
+    def message_id(self):
+        return self.__message_id
+
+    @property
+    def deadline(self):
+        return self.__deadline
+
+    @property
+    def is_held(self):
+        return self.__is_held
+
+
+class _EventBatch(object):
+    """Events that are waiting to go out together under a single message-ID. 
+    This stands in for their futures while the batch is tracked, and hands 
+    each of them its own reply. The replies may arrive over several 
+    messages.
+    """
+
+    def __init__(self, message_id, priority):
+        self.message_id = message_id
+        self.priority = priority
+        self.size = 0
+        self.events = []
+        self.futures = []
+
+        # The number of events that haven't been answered.
+        self.outstanding_count = 0
+
+    def add(self, message_obj, future):
+        self.events.append(message_obj)
+        self.futures.append(future)
+        self.size += message_obj.ByteSize()
+        self.outstanding_count += 1
+
+    def build_message_obj(self):
+        """A batch of one is just sent as a regular event."""
+
+        if len(self.events) == 1:
+            return self.events[0]
+
+        message_obj = rpipe.protocol.get_obj_from_type(
+                        rpipe.protocols.MT_EVENT_BATCH)
+
+        message_obj.version = 1
+        message_obj.events.extend(self.events)
+
+        return message_obj
+
+    def set(self, message):
+        """Hand out the replies in the message. Return the number of events 
+        that were answered by it.
+        """
+
+        (message_info, message_obj) = message
+
+        if rpipe.protocols.get_type_from_obj(message_obj) == \
+           rpipe.protocols.MT_EVENT_R:
+            replies = [message_obj]
+            indices = [0]
+        else:
+            replies = message_obj.replies
+            indices = message_obj.indices or range(len(replies))
+
+        answered_count = 0
+        for (i, reply_obj) in zip(indices, replies):
+            if i >= len(self.futures) or self.futures[i].ready() is True:
+                _logger.warning("Dropping reply to unknown or already-"
+                                "answered event (%d) of batch: %s", 
+                                i, rpipe.protocol.get_string_from_message_id(
+                                    self.message_id))
+                continue
+
+            self.futures[i].set((message_info, reply_obj))
+            answered_count += 1
+
+        self.outstanding_count -= answered_count
+
+        return answered_count
+
+    def set_exception(self, exception):
+        for future in self.futures:
+            if future.ready() is False:
+                future.set_exception(exception)
+
+        self.outstanding_count = 0
+
+    def expire(self, now, exception):
+        """Fail the events whose own deadlines have passed. Return how many 
+        there were.
+        """
+
+        expired_count = 0
+        for future in self.futures:
+            if future.ready() is False and future.deadline <= now:
+                future.set_exception(exception)
+                expired_count += 1
+
+        self.outstanding_count -= expired_count
+
+        return expired_count
+
 
 class _MessageExchange(object):
     """This runs for a particular socket in its own gthread."""
@@ -19,105 +274,873 @@ class _MessageExchange(object):
         self.__ws = ws
         self.__address = address
 
+        self.__ws.set_nodelay(rpipe.config.exchange.USE_TCP_NODELAY)
+
+        if rpipe.config.exchange.TCP_KEEPALIVE_IDLE_S > 0:
+            self.__ws.set_keepalive(
+                rpipe.config.exchange.TCP_KEEPALIVE_IDLE_S,
+                rpipe.config.exchange.TCP_KEEPALIVE_INTERVAL_S,
+                rpipe.config.exchange.TCP_KEEPALIVE_COUNT)
+
+        if rpipe.config.exchange.TCP_USER_TIMEOUT_MS > 0:
+            self.__ws.set_user_timeout(
+                rpipe.config.exchange.TCP_USER_TIMEOUT_MS)
+
+        # We only compress or fragment once the other side has indicated that 
+        # it can handle it, either with flags on the frames that it sends or 
+        # (authoritatively) in a hello.
+        self.__codec = rpipe.protocol.get_codec_from_name(
+                        rpipe.config.exchange.COMPRESSION_CODEC)
+
+        if self.__codec is not None:
+            rpipe.protocol.check_compression_level(
+                self.__codec, 
+                rpipe.config.exchange.COMPRESSION_LEVEL)
+
+        self.__send_codec = None
+        self.__peer_accepts_fragments = False
+        self.__peer_accepts_event_batch = False
+        self.__peer_accepts_binary_data = False
+        self.__fragment_bytes = rpipe.config.exchange.FRAGMENT_BYTES
+        self.__max_send_bytes = rpipe.config.exchange.MAX_MESSAGE_BYTES
+        self.__peer_capabilities = None
+
+        # While we're waiting on the reply to our hello, new requests are held 
+        # (see start_hello()).
+        self.__hello_settled = gevent.event.Event()
+        self.__hello_settled.set()
+
+        self.__frame_reader = rpipe.protocol.FrameReader(
+                                self.__ws, 
+                                rpipe.config.exchange.READ_BUFFER_BYTES,
+                                rpipe.config.exchange.MAX_MESSAGE_BYTES,
+                                rpipe.config.exchange.\
+                                    MAX_OPEN_FRAGMENTED_MESSAGES,
+                                rpipe.config.exchange.\
+                                    MAX_OPEN_FRAGMENTED_BYTES)
+
+        # The reader never blocks on the incoming queue, since replies (and 
+        # heartbeats) behind a request would stop being routed. Instead, new 
+        # events that arrive while the queue is above its high-water marks are 
+        # refused with an immediate reply (see __refuse_request()).
         self.__incoming = gevent.queue.Queue()
-        self.__outgoing = gevent.queue.Queue()
+        self.__incoming_bytes = 0
+
+        # The outgoing queue is bounded by count and bytes. Only new requests 
+        # are held to it (see send()), so that replies and control messages 
+        # are never refused.
+        self.__outgoing = _OutgoingScheduler(
+                            rpipe.config.exchange.PRIORITY_LOW + 1, 
+                            rpipe.config.exchange.STARVATION_MAX_SKIPS)
+        self.__outgoing_bytes = 0
+        self.__outgoing_room = gevent.event.Event()
+        self.__outgoing_room.set()
 
+        # Replies that we're waiting on, by message-ID, plus a heap of 
+        # (deadline, message-ID) so that stale entries can be expired in order.
         self.__replied = {}
+        self.__reply_deadlines = []
+
+        self.__id_allocator = rpipe.protocol.MessageIdAllocator(self.__replied)
+
+        # Events that are still collecting into a batch, by priority.
+        self.__event_batches = {}
+
+        # A batch is tracked under one message-ID. This is the number of 
+        # events beyond the first in the batches being tracked, so that we can 
+        # count events in flight rather than messages.
+        self.__batched_extra_count = 0
+
+        # The number of tracked futures that have been resolved but are being 
+        # held until they're collected (see ReplyFuture).
+        self.__held_count = 0
+
+        self.__expire_timer = None
+
+        # Any traffic at all shows that the connection is alive.
+        self.__last_received_epoch = None
+        self.__last_sent_epoch = None
 
     def run(self):
-        """Read incoming messages and write outgoing messages."""
+        """Read incoming messages and write outgoing messages. The reader and 
+        the writer each block in their own gthread, so neither has to poll. 
+        We return as soon as either of them does.
+        """
 
         _logger.info("Message exchange running for connection: %s", 
                      self.__address)
 
+        reader_g = gevent.spawn(self.__read_loop)
+        writer_g = gevent.spawn(self.__write_loop)
+        self.__schedule_expire()
+
+        try:
+            gevent.joinall([reader_g, writer_g], count=1)
+        finally:
+            gevent.killall([reader_g, writer_g])
+            self.__expire_timer.cancel()
+            self.__fail_outstanding()
+            self.__hello_settled.set()
+
+        # The other gthreads can determine that we've existed by checking our 
+        # state.
+
+        _logger.warning("Message-exchange terminating for [%s].", 
+                        self.__address)
+
+    def __read_loop(self):
+        """Block on the socket, and route each message either to the waiter 
+        for a reply or to the incoming queue.
+        """
+
         while 1:
-            is_active = False
-            r = gevent.select.select(
-                    [self.__ws], [], [], 
-                    0)
+            try:
+                message = self.__frame_reader.read_message()
+            except rpipe.exceptions.RpConnectionClosed:
+                break
+            except (rpipe.exceptions.RpMessageTooLarge, 
+                    rpipe.exceptions.RpProtocolError) as e:
+                _logger.error("Closing connection to [%s]: %s", 
+                              self.__address, str(e))
+                break
 
-            if r[0]:
-                _logger.debug("Reading message.")
+            _logger.debug("Read message.")
 
-                try:
-                    message = rpipe.protocol.read_message_from_file_object(
-                                self.__ws)
-                except rpipe.exceptions.RpConnectionClosed:
-                    break
+            self.__last_received_epoch = time.time()
 
-                (message_info, message_obj) = message
-                message_id = rpipe.protocol.get_message_id_from_info(
-                                message_info)
+            (message_info, message_obj) = message
+            message_id = rpipe.protocol.get_message_id_from_info(
+                            message_info)
 
-                message_id_str = rpipe.protocol.get_string_from_message_id(
-                                    message_id)
+            message_type = rpipe.protocol.get_message_type_from_info(
+                            message_info)
 
-                try:
-                    r = self.__replied[message_id]
-                except KeyError:
-                    _logger.debug("This message was a general request: %s", 
-                                  message_id_str)
+            if self.__peer_capabilities is None:
+                self.__detect_peer_flags(message_info)
+
+            message_id_str = rpipe.protocol.get_string_from_message_id(
+                                message_id)
+
+            if rpipe.protocols.is_reply_type(message_type) is False:
+                _logger.debug("This message was a general request: %s", 
+                              message_id_str)
+
+                if self.__has_incoming_room() is False and \
+                   message_type in _REFUSABLE_TYPES:
+                    self.__refuse_request(message_id, message_obj)
+                    continue
+
+                self.__incoming_bytes += \
+                    rpipe.protocol.get_message_length_from_info(message_info)
+
+                self.__incoming.put(message)
+                continue
+
+            try:
+                future = self.__replied[message_id]
+            except KeyError:
+                # Nobody is waiting anymore (it probably timed-out). Don't 
+                # let it fall through as a request.
+                _logger.warning("Dropping reply to a message that is no "
+                                "longer being tracked: %s", message_id_str)
+                continue
+
+            _logger.debug("This message was a reply: %s", message_id_str)
+
+            if future.__class__ is _EventBatch:
+                self.__batched_extra_count -= future.set(message)
+
+                # It stays tracked until every event has been answered.
+                if future.outstanding_count == 0:
+                    self.__untrack_reply(message_id)
+
+                continue
+            elif future.is_held is False:
+                self.__untrack_reply(message_id)
+            elif future.ready() is True:
+                _logger.warning("Dropping duplicate reply: %s", 
+                                message_id_str)
+                continue
+            else:
+                # It stays tracked (so that its message-ID isn't reused) 
+                # until it's collected or expires.
+                self.__held_count += 1
+
+            future.set(message)
+
+    def __has_incoming_room(self):
+        return self.__incoming.qsize() < \
+                rpipe.config.exchange.INCOMING_HIGH_WATER_COUNT and \
+               self.__incoming_bytes < \
+                rpipe.config.exchange.INCOMING_HIGH_WATER_BYTES
+
+    def __refuse_request(self, message_id, message_obj):
+        """We're too far behind to take on another event. Answer it (or each 
+        event in the batch) right away so that the other side doesn't wait 
+        out its timeout.
+        """
+
+        _logger.warning("Incoming queue for [%s] is full: (%d) messages, "
+                        "(%d) bytes. Refusing request: %s", 
+                        self.__address, self.__incoming.qsize(), 
+                        self.__incoming_bytes, 
+                        rpipe.protocol.get_string_from_message_id(message_id))
+
+        rpipe.stats.post_to_counter(
+            rpipe.config.statsd.EVENT_EXCHANGE_INCOMING_REJECT_TICK)
+
+        if rpipe.protocols.get_type_from_obj(message_obj) == \
+           rpipe.protocols.MT_EVENT_BATCH:
+            reply_message_obj = rpipe.protocol.get_obj_from_type(
+                                    rpipe.protocols.MT_EVENT_BATCH_R)
+
+            reply_message_obj.version = 1
+
+            for i in range(len(message_obj.events)):
+                _fill_refused_reply(reply_message_obj.replies.add())
+        else:
+            reply_message_obj = rpipe.protocol.get_obj_from_type(
+                                    rpipe.protocols.MT_EVENT_R)
+
+            _fill_refused_reply(reply_message_obj)
+
+        self.__enqueue(
+            reply_message_obj, 
+            message_id, 
+            False, 
+            None, 
+            None, 
+            None)
+
+    def __untrack_reply(self, message_id):
+        future = self.__replied.pop(message_id)
+
+        if future.__class__ is _EventBatch:
+            # The batch counts once, plus once for each other event that's 
+            # still outstanding.
+            self.__batched_extra_count -= future.outstanding_count - 1
+        elif future.ready() is True:
+            self.__held_count -= 1
+
+        return future
+
+    def __detect_peer_flags(self, message_info):
+        if self.__send_codec is None and \
+           message_info['accepts_compression'] is True:
+            _logger.info("Peer [%s] accepts compression.", self.__address)
+            self.__send_codec = self.__codec
+
+        if self.__peer_accepts_fragments is False and \
+           message_info['accepts_fragments'] is True:
+            _logger.info("Peer [%s] accepts fragmented messages.", 
+                         self.__address)
+
+            self.__peer_accepts_fragments = True
+
+    def set_peer_capabilities(self, protocol_version, identity, codecs, 
+                              features, max_frame_bytes=None, 
+                              max_message_bytes=None):
+        """Apply what the other side advertised in its hello. This takes 
+        precedence over anything inferred from frame flags. Return a dictionary 
+        of what was settled on.
+        """
+
+        if self.__codec is not None and \
+           rpipe.config.exchange.COMPRESSION_CODEC in codecs:
+            self.__send_codec = self.__codec
+        else:
+            self.__send_codec = None
+
+        self.__peer_accepts_fragments = \
+            rpipe.protocol.FEATURE_FRAGMENTS in features
+
+        self.__peer_accepts_event_batch = \
+            rpipe.protocol.FEATURE_EVENT_BATCH in features
+
+        self.__peer_accepts_binary_data = \
+            rpipe.protocol.FEATURE_BINARY_DATA in features
+
+        if max_frame_bytes:
+            self.__fragment_bytes = min(
+                                        rpipe.config.exchange.FRAGMENT_BYTES, 
+                                        max_frame_bytes)
+
+        if max_message_bytes:
+            self.__max_send_bytes = min(
+                                        rpipe.config.exchange.MAX_MESSAGE_BYTES, 
+                                        max_message_bytes)
+
+        self.__peer_capabilities = {
+            'protocol_version': protocol_version,
+            'identity': identity,
+            'codec': rpipe.config.exchange.COMPRESSION_CODEC \
+                        if self.__send_codec is not None \
+                        else None,
+            'features': list(features),
+            'fragment_bytes': self.__fragment_bytes,
+            'max_message_bytes': self.__max_send_bytes,
+        }
+
+        _logger.info("Negotiated with [%s]: %s", 
+                     self.__address, self.__peer_capabilities)
+
+        return self.__peer_capabilities
+
+    def start_hello(self):
+        """Hold new requests until finish_hello() is called, so that nothing 
+        goes out before we know what the other side supports. Control 
+        messages (like the hello itself) and replies aren't held.
+        """
+
+        self.__hello_settled.clear()
+
+    def finish_hello(self):
+        """The hello was answered, or failed or timed-out. Release the held 
+        requests.
+        """
+
+        self.__hello_settled.set()
+
+    def __wait_for_hello(self, priority):
+        if self.__hello_settled.is_set() is True:
+            return
+
+        if priority is not None and \
+           priority < rpipe.config.exchange.PRIORITY_HIGH:
+            return
+
+        _logger.debug("Holding request to [%s] until the hello is settled.", 
+                      self.__address)
 
-                    self.__incoming.put(message)
-                else:
-                    _logger.debug("This message was a reply: %s", 
-                                  message_id_str)
+        self.__hello_settled.wait()
 
-                    r[1] = message
-                    r[0].set()
+    @property
+    def hello_settled(self):
+        """Whether requests can go out (nothing is being held for the 
+        hello)."""
 
-                is_active = True
+        return self.__hello_settled.is_set()
 
-            if self.__outgoing.empty() is False:
-                (message_id, message_obj) = self.__outgoing.get()
-                message_id_str = rpipe.protocol.get_string_from_message_id(
-                                    message_id)
+    @property
+    def peer_capabilities(self):
+        """What was negotiated in the hello, or None if there wasn't one (yet). 
+        """
 
-                _logger.debug("Sending message: %s", message_id_str)
+        return self.__peer_capabilities
+
+    def __schedule_expire(self):
+        self.__expire_timer = rpipe.timer_wheel.get_timer_wheel().schedule(
+                                rpipe.config.exchange.REPLY_EXPIRY_INTERVAL_S,
+                                self.__expire)
+
+    def __expire(self):
+        """Periodically (from the timer wheel) expire tracked replies whose 
+        deadlines have passed, waking anybody still waiting on them.
+        """
+
+        now = time.time()
+        while self.__reply_deadlines and \
+              self.__reply_deadlines[0][0] <= now:
+            (deadline, message_id) = heapq.heappop(self.__reply_deadlines)
+
+            try:
+                future = self.__replied[message_id]
+            except KeyError:
+                continue
+
+            if future.__class__ is _EventBatch:
+                self.__expire_batch_events(future, now)
+                continue
+
+            # The ID may have been reused for a later send.
+            if future.deadline != deadline:
+                continue
+
+            # A reply that arrived but was never collected.
+            if future.__class__ is not _EventBatch and \
+               future.ready() is True:
+                self.__untrack_reply(message_id)
+                continue
+
+            message_id_str = rpipe.protocol.get_string_from_message_id(
+                                message_id)
+
+            _logger.warning("Expiring reply that never arrived: %s", 
+                            message_id_str)
+
+            self.__untrack_reply(message_id)
+
+            future.set_exception(
+                rpipe.exceptions.RpReplyTimeout(
+                    "No reply received for message [%s] from [%s]." % 
+                    (message_id_str, self.__address)))
+
+        rpipe.stats.post_to_gauge(
+            rpipe.config.statsd.EVENT_EXCHANGE_REPLY_INFLIGHT_GAUGE,
+            len(self.__replied))
+
+        self.__schedule_expire()
+
+    def __expire_batch_events(self, batch, now):
+        """Expire the events of the batch whose deadlines have passed, and 
+        stop tracking the batch once none are left.
+        """
+
+        message_id_str = rpipe.protocol.get_string_from_message_id(
+                            batch.message_id)
+
+        expired_count = batch.expire(
+                            now, 
+                            rpipe.exceptions.RpReplyTimeout(
+                                "No reply received for event in batch [%s] "
+                                "from [%s]." % (message_id_str, 
+                                                self.__address)))
+
+        if expired_count == 0:
+            return
+
+        _logger.warning("Expiring (%d) event(s) of batch whose replies never "
+                        "arrived: %s", expired_count, message_id_str)
+
+        self.__batched_extra_count -= expired_count
+
+        if batch.outstanding_count == 0:
+            self.__untrack_reply(batch.message_id)
+
+    def __fail_outstanding(self):
+        """The connection is gone. Nothing that's still outstanding will be 
+        answered.
+        """
+
+        replied = list(self.__replied.values())
+        self.__replied.clear()
+        self.__batched_extra_count = 0
+        self.__held_count = 0
+
+        for future in replied:
+            if future.__class__ is not _EventBatch and \
+               future.ready() is True:
+                continue
+
+            future.set_exception(
+                rpipe.exceptions.RpConnectionClosed(
+                    "Connection to [%s] closed before a reply was "
+                    "received." % (self.__address,)))
+
+    def __write_loop(self):
+        """Block on the outgoing queue. Once something is available, drain 
+        whatever else is already queued (up to a count and byte cap) and send 
+        it as a single write, rather than one write and flush per message.
+        """
+
+        while 1:
+            item = self.__outgoing.get()
+            batch = []
+            batch_length = 0
+
+            while 1:
+                data = self.__get_next_frame(item)
+                if data is not None:
+                    batch.append(data)
+                    batch_length += len(data)
+
+                if len(batch) >= rpipe.config.exchange.WRITE_BATCH_MAX_COUNT or \
+                   batch_length >= rpipe.config.exchange.WRITE_BATCH_MAX_BYTES:
+                    break
 
                 try:
-                    rpipe.protocol.send_message_obj(
-                        self.__ws, 
-                        message_obj, 
-                        message_id=message_id)
-                except rpipe.exceptions.RpConnectionClosed:
+                    item = self.__outgoing.get_nowait()
+                except gevent.queue.Empty:
                     break
 
-                is_active = True
+            if self.__has_outgoing_room() is True:
+                self.__outgoing_room.set()
 
-            if is_active is False:
-                gevent.sleep(rpipe.config.exchange.IDLE_TIMEOUT_S)
+            if not batch:
+                continue
 
-        # The other gthreads can determine that we've existed by checking our 
-        # state.
+            _logger.debug("Sending (%d) frame(s): (%d) bytes", 
+                          len(batch), batch_length)
 
-        _logger.warning("Message-exchange terminating for [%s].", 
-                        self.__address)
+            try:
+                self.__write_batch(batch)
+            except rpipe.exceptions.RpConnectionClosed:
+                break
+
+            self.__last_sent_epoch = time.time()
+
+    def __get_next_frame(self, item):
+        """Return the next frame to write for the given queue entry, or None if 
+        a fragmented message turned out to have nothing left. Large messages 
+        are written one fragment at a time, and then go to the back of their 
+        lane, so that they don't hold up everything behind them.
+        """
+
+        if item.fragments is None:
+            self.__outgoing_bytes -= item.size
+            kwargs = self.__get_serialize_kwargs()
+
+            if self.__peer_accepts_fragments is False:
+                (data, message_id) = rpipe.protocol.serialize_message_obj(
+                                        item.message_obj, 
+                                        message_id=item.message_id,
+                                        **kwargs)
+
+                return data
+
+            (fragments, message_id) = \
+                rpipe.protocol.serialize_message_obj_fragments(
+                    item.message_obj, 
+                    self.__fragment_bytes,
+                    message_id=item.message_id,
+                    **kwargs)
+        else:
+            fragments = item.fragments
+
+        try:
+            data = next(fragments)
+        except StopIteration:
+            return None
+
+        self.__outgoing.put(
+            item.priority, 
+            item._replace(message_obj=None, fragments=fragments))
+
+        return data
+
+    def __get_serialize_kwargs(self):
+        kwargs = {
+            'flags': rpipe.protocol.MF_ACCEPTS_COMPRESSION | \
+                     rpipe.protocol.MF_ACCEPTS_FRAGMENTS,
+        }
+
+        if self.__send_codec is not None:
+            kwargs['codec'] = self.__send_codec
+            kwargs['compression_level'] = \
+                rpipe.config.exchange.COMPRESSION_LEVEL
+            kwargs['compression_threshold'] = \
+                rpipe.config.exchange.COMPRESSION_THRESHOLD_BYTES
+
+        return kwargs
+
+    def __write_batch(self, batch):
+        if rpipe.config.exchange.USE_TCP_CORK is True:
+            self.__ws.set_cork(True)
+
+        try:
+            self.__ws.write(''.join(batch))
+        finally:
+            if rpipe.config.exchange.USE_TCP_CORK is True:
+                self.__ws.set_cork(False)
+
+    def __has_outgoing_room(self):
+        return self.__outgoing.qsize() < \
+                rpipe.config.exchange.OUTGOING_HIGH_WATER_COUNT and \
+               self.__outgoing_bytes < \
+                rpipe.config.exchange.OUTGOING_HIGH_WATER_BYTES
+
+    def __wait_for_outgoing_room(self, timeout=None):
+        """Block (for a bounded time) while the outgoing queue is above its 
+        high-water marks. Raise RpBackpressure if it doesn't drain in time.
+        """
+
+        if self.__has_outgoing_room() is True:
+            return
+
+        rpipe.stats.post_to_counter(
+            rpipe.config.statsd.EVENT_EXCHANGE_BACKPRESSURE_TICK)
+
+        if timeout is None:
+            timeout = rpipe.config.exchange.BACKPRESSURE_WAIT_TIMEOUT_S
+
+        stop_at = time.time() + timeout
+        while self.__has_outgoing_room() is False:
+            self.__outgoing_room.clear()
+
+            remaining_s = stop_at - time.time()
+            if remaining_s <= 0 or \
+               self.__outgoing_room.wait(timeout=remaining_s) is False:
+                rpipe.stats.post_to_counter(
+                    rpipe.config.statsd.EVENT_EXCHANGE_BACKPRESSURE_REJECT_TICK)
+
+                raise rpipe.exceptions.RpBackpressure(
+                        "Outgoing queue for [%s] is full: (%d) messages, "
+                        "(%d) bytes" % 
+                        (self.__address, self.__outgoing.qsize(), 
+                         self.__outgoing_bytes))
+
+    def send(self, message_obj, reply_to_message_id=None, 
+             expect_response=True, timeout=None, backpressure_timeout=None, 
+             priority=None, **kwargs):
+        """Queue a message and return its message-ID. If a response is 
+        expected, the reply can be collected with wait_on_reply().
+        """
+
+        if reply_to_message_id is None:
+            self.__wait_for_hello(priority)
+
+        self.__check_data(message_obj)
+
+        (message_id, future) = self.__enqueue(
+                                message_obj, 
+                                reply_to_message_id, 
+                                expect_response, 
+                                timeout, 
+                                backpressure_timeout, 
+                                priority,
+                                is_held=True)
+
+        return message_id
+
+    def send_async(self, message_obj, timeout=None, 
+                   backpressure_timeout=None, priority=None):
+        """Queue a message and return a ReplyFuture for its reply. Events may 
+        be held for a moment so that they can go out in a batch.
+        """
+
+        self.__wait_for_hello(priority)
+        self.__check_data(message_obj)
+
+        if self.__peer_accepts_event_batch is True and \
+           rpipe.config.exchange.EVENT_BATCH_WINDOW_S is not None and \
+           rpipe.protocols.get_type_from_obj(message_obj) == \
+            rpipe.protocols.MT_EVENT:
+            return self.__add_to_event_batch(
+                    message_obj, 
+                    timeout, 
+                    backpressure_timeout, 
+                    priority)
+
+        (message_id, future) = self.__enqueue(
+                                message_obj, 
+                                None, 
+                                True, 
+                                timeout, 
+                                backpressure_timeout, 
+                                priority)
+
+        return future
+
+    def __add_to_event_batch(self, message_obj, timeout, backpressure_timeout, 
+                             priority):
+        """Add the event to the open batch for its priority, opening one (and 
+        scheduling it to be flushed at the end of the window) if necessary.
+        """
+
+        if priority is None:
+            priority = rpipe.config.exchange.PRIORITY_NORMAL
+
+        if priority >= rpipe.config.exchange.PRIORITY_HIGH:
+            self.__wait_for_outgoing_room(timeout=backpressure_timeout)
+
+        self.__check_size(message_obj.ByteSize())
+
+        batch = self.__event_batches.get(priority)
+
+        # The event won't fit in the open batch. Send that one now.
+        if batch is not None and \
+           batch.size + message_obj.ByteSize() > \
+            min(rpipe.config.exchange.EVENT_BATCH_MAX_BYTES, 
+                self.__max_send_bytes):
+            self.__flush_event_batch(batch)
+            batch = None
+
+        if batch is None:
+            batch = _EventBatch(self.__id_allocator.allocate(), priority)
+            self.__event_batches[priority] = batch
+
+            # Reserve the message-ID, so that it isn't allocated again.
+            self.__replied[batch.message_id] = batch
+
+            # With no window, we just collect whatever is sent before the 
+            # current gthread yields.
+            if rpipe.config.exchange.EVENT_BATCH_WINDOW_S > 0:
+                gevent.spawn_later(
+                    rpipe.config.exchange.EVENT_BATCH_WINDOW_S, 
+                    self.__flush_event_batch, 
+                    batch)
+            else:
+                gevent.spawn(self.__flush_event_batch, batch)
+
+        if timeout is None:
+            timeout = rpipe.config.exchange.DEFAULT_REPLY_TIMEOUT_S
+
+        future = ReplyFuture(
+                    self.__address, 
+                    batch.message_id, 
+                    time.time() + timeout)
+
+        batch.add(message_obj, future)
+
+        if len(batch.events) > 1:
+            self.__batched_extra_count += 1
+
+        # Each event in the batch expires on its own deadline.
+        heapq.heappush(
+            self.__reply_deadlines, 
+            (future.deadline, batch.message_id))
+
+        if len(batch.events) >= rpipe.config.exchange.EVENT_BATCH_MAX_COUNT:
+            self.__flush_event_batch(batch)
+
+        return future
+
+    def __flush_event_batch(self, batch):
+        """Queue the batch, unless it was already sent (when the window 
+        closes on a batch that already filled up).
+        """
+
+        if self.__event_batches.get(batch.priority) is not batch:
+            return
+
+        del self.__event_batches[batch.priority]
+
+        rpipe.stats.post_to_gauge(
+            rpipe.config.statsd.EVENT_EXCHANGE_EVENT_BATCH_SIZE_GAUGE,
+            len(batch.events))
+
+        message_obj = batch.build_message_obj()
+        size = rpipe.protocol.get_standard_header_length() + \
+               message_obj.ByteSize()
+
+        self.__put_outgoing(batch.priority, batch.message_id, message_obj, size)
+
+    def __check_data(self, message_obj):
+        """Raise RpBinaryDataUnsupported if the message carries event data 
+        that isn't UTF-8 and the peer hasn't said that it can parse that.
+        """
+
+        if self.__peer_accepts_binary_data is True:
+            return
+
+        message_type = rpipe.protocols.get_type_from_obj(message_obj)
+
+        if message_type in (rpipe.protocols.MT_EVENT, 
+                            rpipe.protocols.MT_EVENT_R):
+            payloads = [message_obj.data]
+        elif message_type == rpipe.protocols.MT_EVENT_BATCH:
+            payloads = [event.data for event in message_obj.events]
+        elif message_type == rpipe.protocols.MT_EVENT_BATCH_R:
+            payloads = [reply.data for reply in message_obj.replies]
+        else:
+            return
+
+        for data in payloads:
+            if rpipe.protocol.is_text(data) is False:
+                raise rpipe.exceptions.RpBinaryDataUnsupported(
+                        "Peer [%s] doesn't accept binary event data." % 
+                        (self.__address,))
+
+    def __check_size(self, size):
+        size += rpipe.protocol.get_standard_header_length()
+
+        if size > self.__max_send_bytes:
+            raise rpipe.exceptions.RpMessageTooLarge(
+                    "Message of (%d) bytes exceeds the maximum of (%d)." % 
+                    (size, self.__max_send_bytes))
+
+        return size
+
+    def __put_outgoing(self, priority, message_id, message_obj, size):
+        self.__outgoing_bytes += size
+        self.__outgoing.put(
+            priority, 
+            _OUTGOING_T(priority, message_id, message_obj, size, None))
+
+    def __enqueue(self, message_obj, reply_to_message_id, expect_response, 
+                  timeout, backpressure_timeout, priority, is_held=False):
+        if priority is None:
+            if reply_to_message_id is None:
+                priority = rpipe.config.exchange.PRIORITY_NORMAL
+            else:
+                priority = rpipe.config.exchange.PRIORITY_REPLY
+
+        if priority >= rpipe.config.exchange.PRIORITY_HIGH:
+            self.__wait_for_outgoing_room(timeout=backpressure_timeout)
 
-    def send(self, message_obj, reply_to_message_id=None, expect_response=True, **kwargs):
         if reply_to_message_id is None:
-            message_id = rpipe.protocol.id_generator()
+            message_id = self.__id_allocator.allocate()
         else:
             message_id = reply_to_message_id
 
-        self.__outgoing.put((message_id, message_obj))
+        size = self.__check_size(message_obj.ByteSize())
 
         if expect_response is True:
+            if timeout is None:
+                timeout = rpipe.config.exchange.DEFAULT_REPLY_TIMEOUT_S
+
             # Add the tracking information to track the future reply.
-            self.__replied[message_id] = [gevent.event.Event(), None]
+            deadline = time.time() + timeout
+            future = ReplyFuture(
+                        self.__address, 
+                        message_id, 
+                        deadline, 
+                        is_held=is_held)
 
-        return message_id
+            self.__replied[message_id] = future
+            heapq.heappush(self.__reply_deadlines, (deadline, message_id))
+        else:
+            future = None
+
+        self.__put_outgoing(priority, message_id, message_obj, size)
+
+        return (message_id, future)
 
     def read(self, **kwargs):
-        return self.__incoming.get(**kwargs)
+        message = self.__incoming.get(**kwargs)
+
+        (message_info, message_obj) = message
+        self.__incoming_bytes -= \
+            rpipe.protocol.get_message_length_from_info(message_info)
+
+        return message
+
+    def wait_on_reply(self, message_id, timeout=None):
+        """Wait for the reply to the given message, and return the 
+        (message_info, message_obj) 2-tuple. Return None if the timeout passes 
+        first (the reply can still be waited on again). If no timeout is 
+        given, we wait until the deadline established when it was sent.
+        """
+
+        try:
+            future = self.__replied[message_id]
+        except KeyError:
+            rpipe.stats.post_to_counter(
+                rpipe.config.statsd.EVENT_EXCHANGE_REPLY_TIMEOUT_TICK)
+
+            raise rpipe.exceptions.RpReplyTimeout(
+                    "Message [%s] to [%s] is not awaiting a reply." % 
+                    (rpipe.protocol.get_string_from_message_id(message_id), 
+                     self.__address))
+
+        if future.wait(timeout=timeout) is False:
+            return None
+
+        if self.__replied.get(message_id) is future:
+            self.__untrack_reply(message_id)
+
+        return future.get_message(timeout=0)
+
+    @property
+    def in_flight_count(self):
+        """The number of replies that we're waiting on (counting each event 
+        in a batch).
+        """
+
+        return len(self.__replied) + self.__batched_extra_count - \
+               self.__held_count
+
+    @property
+    def last_received_epoch(self):
+        """When we last received a message (of any type), or None."""
 
-    def wait_on_reply(self, message_id, **kwargs):
-        r = self.__replied[message_id]
-        if r[0].wait(**kwargs) is True:
-            del self.__replied[message_id]
-            return r[1]
+        return self.__last_received_epoch
 
-        return None
+    @property
+    def last_sent_epoch(self):
+        """When we last wrote anything, or None."""
+
+        return self.__last_sent_epoch
 
 #    @property
 #    def incoming(self):
@@ -154,12 +1177,77 @@ def send(address, message_obj, **kwargs):
 def wait_on_reply(address, message_id, **kwargs):
     return _instances[address][1].wait_on_reply(message_id, **kwargs)
 
-def send_and_receive(address, message_obj):
-    """A convenience function to send a message and wait on a reply."""
+def get_exchange(address):
+    return _instances[address][1]
+
+def send_async(address, message_obj, **kwargs):
+    """Send a message and return a ReplyFuture for the reply."""
+
+    return _instances[address][1].send_async(message_obj, **kwargs)
+
+def as_completed(futures, timeout=None):
+    """Yield the given futures (which may belong to different connections) as 
+    they're resolved. Raise RpReplyTimeout if they're not all resolved within 
+    the timeout (which is shared by all of them).
+    """
+
+    futures = list(futures)
+    resolved = gevent.queue.Queue()
+
+    for future in futures:
+        future.rawlink(resolved.put)
+
+    if timeout is not None:
+        stop_at = time.time() + timeout
+
+    for i in range(len(futures)):
+        if timeout is None:
+            remaining_s = None
+        else:
+            remaining_s = max(0, stop_at - time.time())
+
+        try:
+            yield resolved.get(timeout=remaining_s)
+        except gevent.queue.Empty:
+            raise rpipe.exceptions.RpReplyTimeout(
+                    "(%d) of (%d) replies were not received in time." % 
+                    (len(futures) - i, len(futures)))
+
+def gather(futures, timeout=None, return_exceptions=False):
+    """Wait on all of the given futures with a shared deadline, and return the 
+    reply message objects in the same order. If return_exceptions is True, 
+    failures are returned in place of their replies rather than raised.
+    """
+
+    if timeout is not None:
+        stop_at = time.time() + timeout
+
+    results = []
+    for future in futures:
+        if timeout is None:
+            remaining_s = None
+        else:
+            remaining_s = max(0, stop_at - time.time())
+
+        try:
+            results.append(future.get(timeout=remaining_s))
+        except rpipe.exceptions.RpException as e:
+            if return_exceptions is False:
+                raise
+
+            results.append(e)
+
+    return results
 
-    message_id = send(address, message_obj, expect_response=True)
-    message = wait_on_reply(address, message_id)
+def send_and_receive(address, message_obj, timeout=None, priority=None):
+    """A convenience function to send a message and wait on a reply. Raises 
+    RpReplyTimeout if the reply doesn't arrive in time.
+    """
 
-    (message_info, message_obj) = message
+    future = send_async(
+                address, 
+                message_obj, 
+                timeout=timeout,
+                priority=priority)
 
-    return message_obj
+    return future.get()
@@ -1,13 +1,16 @@
 import logging
 import collections
 import traceback
-import json
 import types
 import time
+import functools
 
 import web
 import gevent
+import gevent.lock
+import gevent.pool
 
+import rpipe.config.exchange
 import rpipe.config.protocol
 import rpipe.config.statsd
 import rpipe.config.client
@@ -15,7 +18,10 @@ import rpipe.protocol
 import rpipe.protocols
 import rpipe.exceptions
 import rpipe.message_exchange
+import rpipe.codec
+import rpipe.route
 import rpipe.stats
+import rpipe.timer_wheel
 
 _logger = logging.getLogger(__name__)
 
@@ -24,17 +30,39 @@ CONNECTION_CONTEXT_T = collections.namedtuple(
                         'ConnectionContext', 
                         ['participant_address'])
 
-_CT_JSON = 'application/json'
+# Caps the number of events being handled at once across all connections.
+_DISPATCH_SEMAPHORE = gevent.lock.BoundedSemaphore(
+                        rpipe.config.protocol.EVENT_DISPATCH_GLOBAL_MAX)
 
 
 class CommonMessageLoop(object):
     def __init__(self, wrapped_socket, event_handler, connection_context, 
-                 watch_heartbeats=False):
+                 watch_heartbeats=False, identity=None, initiate_hello=False,
+                 exchange_key=None, hello_cb=None, ready_cb=None):
+        """The exchange is registered under the participant's address unless 
+        an exchange_key is given (e.g. when there are several connections to 
+        the same participant). If given, hello_cb is invoked with the 
+        capabilities that the other side advertises, once they're applied, 
+        and ready_cb is invoked (in its own gthread) once requests can be 
+        sent: when the hello is settled, if we initiate one, or as soon as the 
+        exchange is started.
+        """
+
         assert wrapped_socket is not None
 
         self.__ws = wrapped_socket
         self.__eh = event_handler
+        self.__routes = rpipe.route.get_route_table(event_handler.__class__)
         self.__ctx = connection_context
+
+        if exchange_key is None:
+            exchange_key = connection_context.participant_address
+
+        self.__exchange_key = exchange_key
+        self.__identity = identity
+        self.__initiate_hello = initiate_hello
+        self.__hello_cb = hello_cb
+        self.__ready_cb = ready_cb
         
         heartbeat_reply_message_obj = \
             rpipe.protocol.get_obj_from_type(
@@ -44,64 +72,114 @@ class CommonMessageLoop(object):
 
         self.__heartbeat_reply_message_obj = heartbeat_reply_message_obj
 
-        self.__last_heartbeat_epoch = None
+        self.__message_handlers = {
+            rpipe.protocols.MT_HEARTBEAT: self.__handle_heartbeat,
+            rpipe.protocols.MT_EVENT: self.__dispatch_event,
+            rpipe.protocols.MT_EVENT_BATCH: self.__dispatch_event_batch,
+        }
+
+        # Events are handled concurrently, so that a slow handler doesn't 
+        # hold up the rest of the connection. When every handler is busy, 
+        # events wait in a bounded backlog, which the handlers drain.
+        self.__dispatch_pool = gevent.pool.Pool(
+                                rpipe.config.protocol.EVENT_DISPATCH_POOL_SIZE)
+
+        self.__dispatch_backlog = collections.deque()
+
+        # The watchdog is a deadline on the shared timer wheel. Any message 
+        # from the other side (not just a heartbeat) counts as liveness, which 
+        # is only checked when the deadline comes up.
+        self.__heartbeat_alarm_threshold_s = \
+            rpipe.config.client.HEARTBEAT_INTERVAL_S * 2
+
+        self.__heartbeat_watchdog_timer = None
 
         if watch_heartbeats is True:
-            self.__heartbeat_watchdog_g = gevent.spawn(
-                                            self.__watch_heartbeats,
-                                            gevent.getcurrent())
+            _logger.debug("Starting heartbeat watchdog: "
+                          "ALARM_THRESHOLD=(%d)s", 
+                          self.__heartbeat_alarm_threshold_s)
+
+            self.__heartbeat_watchdog_timer = \
+                rpipe.timer_wheel.get_timer_wheel().schedule(
+                    self.__heartbeat_alarm_threshold_s,
+                    self.__heartbeats_missed,
+                    gevent.getcurrent())
+
+    def __heartbeats_missed(self, parent_g):
+        """The watchdog deadline has come up. Unless something was received 
+        since it was set, the connection is dead. This is invoked from the 
+        timer wheel, so it mustn't block.
+        """
 
-    def __watch_heartbeats(self, parent_g):
-        """Make sure that heartbeats are happening on this connection."""
+        try:
+            exchange = rpipe.message_exchange.get_exchange(
+                        self.__exchange_key)
+        except KeyError:
+            last_received_epoch = None
+        else:
+            last_received_epoch = exchange.last_received_epoch
+
+        if last_received_epoch is None:
+            _logger.error("Nothing has been received yet. Terminating "
+                          "connection: [%s]", self.__ws)
+        else:
+            since_last_s = time.time() - last_received_epoch
 
-        alarm_threshold_s = rpipe.config.client.HEARTBEAT_INTERVAL_S * 2
+            if since_last_s < self.__heartbeat_alarm_threshold_s:
+                self.__heartbeat_watchdog_timer = \
+                    rpipe.timer_wheel.get_timer_wheel().schedule(
+                        self.__heartbeat_alarm_threshold_s - since_last_s,
+                        self.__heartbeats_missed,
+                        parent_g)
 
-        _logger.debug("Starting heartbeat watchdog: ALARM_THRESHOLD=(%d)s", 
-                      alarm_threshold_s)
+                return
 
-        while 1:
-            gevent.sleep(alarm_threshold_s)
-            
-            if self.__last_heartbeat_epoch is None:
-                parent_g.kill()
-                raise IOError("No heartbeats have occurred yet. Terminating "
-                              "connection: [%s]" % (self.__ws,))
-
-            time_since_last_heartbeat_s = time.time() - \
-                                          self.__last_heartbeat_epoch
-
-            # Was there a heartbeat since the last check?
-            if time_since_last_heartbeat_s > alarm_threshold_s:
-                parent_g.kill()
-                raise IOError("Heartbeats are not being received, or not "
-                              "keeping up. Terminating connection. "
-                              "SINCE_LAST=(%d)s > "
-                              "CHECK_INTERVAL=(%d)s SOCKET=[%s]" % 
-                              (time_since_last_heartbeat_s, 
-                               alarm_threshold_s,
-                               self.__ws))
-            else:
-                _logger.debug("Heartbeats are still timely: (%d)s < (%d)s",
-                              time_since_last_heartbeat_s,
-                              alarm_threshold_s)
+            _logger.error("Heartbeats are not being received, or not keeping "
+                          "up. Terminating connection. SINCE_LAST=(%d)s > "
+                          "CHECK_INTERVAL=(%d)s SOCKET=[%s]", 
+                          since_last_s, 
+                          self.__heartbeat_alarm_threshold_s,
+                          self.__ws)
+
+        parent_g.kill(block=False)
 
     def handle(self, exit_on_unknown=False):
-        rpipe.message_exchange.start_exchange(
-            self.__ws, 
-            self.__ctx.participant_address)
+        exchange = rpipe.message_exchange.start_exchange(
+                    self.__ws, 
+                    self.__exchange_key)
 
         _logger.debug("Starting loop for messages from participant: %s", 
                       self.__ctx.participant_address)
-            
+
+        # Requests are held until the hello is answered (or fails).
+        if self.__initiate_hello is True:
+            exchange.start_hello()
+            gevent.spawn(self.__send_hello, exchange)
+        elif self.__ready_cb is not None:
+            gevent.spawn(self.__ready_cb)
+
+        # We might also be killed by the heartbeat watchdog.
+        try:
+            self.__read_messages(exit_on_unknown)
+        finally:
+            if self.__heartbeat_watchdog_timer is not None:
+                self.__heartbeat_watchdog_timer.cancel()
+
+            self.__dispatch_pool.kill()
+            self.__dispatch_backlog.clear()
+            rpipe.message_exchange.stop_exchange(
+                self.__exchange_key)
+
+    def __read_messages(self, exit_on_unknown):
         while 1:
-            if rpipe.message_exchange.is_alive(self.__ctx.participant_address) is False:
+            if rpipe.message_exchange.is_alive(self.__exchange_key) is False:
                 _logger.warning("Message exchange has ended. Terminating "
                                 "message-loop.")
                 break
 
             try:
                 message = rpipe.message_exchange.read(
-                            self.__ctx.participant_address, 
+                            self.__exchange_key, 
                             timeout=rpipe.config.protocol.\
                                         MESSAGE_LOOP_READ_TIMEOUT_S)
             except gevent.queue.Empty:
@@ -118,11 +196,9 @@ class CommonMessageLoop(object):
                             message_info)
             message_id = rpipe.protocol.get_message_id_from_info(message_info)
 
-            if message_type == rpipe.protocols.MT_HEARTBEAT:
-                handler = self.__handle_heartbeat
-            elif message_type == rpipe.protocols.MT_EVENT:
-                handler = self.__handle_event
-            else:
+            try:
+                handler = self.__message_handlers[message_type]
+            except KeyError:
                 _logger.warning("Received unhandled message (%d) [%s].", 
                                 message_type, message_obj.__class__.__name__)
 
@@ -139,86 +215,338 @@ class CommonMessageLoop(object):
                 else:
                     continue
 
-            with rpipe.stats.time_and_post(
-                    rpipe.config.statsd.\
-                        EVENT_MESSAGE_RECEIVE_HANDLE_TIMING):
-                handler(message_id, message_obj)
+            handler(message_id, message_obj)
+
+    def set_message_handler(self, message_type, handler):
+        """Handle an additional (registered) message-type. The handler receives 
+        the message-ID and the message object.
+        """
+
+        self.__message_handlers[message_type] = handler
+
+    def __build_hello_heartbeat(self, message_type):
+        """Build a heartbeat (or heartbeat reply) that carries our 
+        capabilities.
+        """
+
+        message_obj = rpipe.protocol.get_obj_from_type(message_type)
+        message_obj.version = 1
 
-        rpipe.message_exchange.stop_exchange(self.__ctx.participant_address)
+        hello = message_obj.hello
+        hello.protocol_version = rpipe.protocol.PROTOCOL_VERSION
+        hello.max_frame_bytes = rpipe.config.exchange.FRAGMENT_BYTES
+        hello.max_message_bytes = rpipe.config.exchange.MAX_MESSAGE_BYTES
+        hello.codecs.extend(rpipe.protocol.get_codec_names())
+        hello.features.append(rpipe.protocol.FEATURE_FRAGMENTS)
+        hello.features.append(rpipe.protocol.FEATURE_EVENT_BATCH)
+        hello.features.append(rpipe.protocol.FEATURE_BINARY_DATA)
+
+        if self.__identity is not None:
+            hello.identity = self.__identity
+
+        return message_obj
+
+    def __apply_hello(self, hello):
+        exchange = rpipe.message_exchange.get_exchange(
+                    self.__exchange_key)
+
+        negotiated = exchange.set_peer_capabilities(
+                        hello.protocol_version,
+                        hello.identity or None,
+                        hello.codecs,
+                        hello.features,
+                        max_frame_bytes=hello.max_frame_bytes,
+                        max_message_bytes=hello.max_message_bytes)
+
+        rpipe.stats.post_to_counter(
+            rpipe.config.statsd.EVENT_CONNECTION_NEGOTIATED_TEMPLATE % 
+            { 'setting': 'codec.%s' % (negotiated['codec'] or 'none') })
+
+        for feature in negotiated['features']:
+            rpipe.stats.post_to_counter(
+                rpipe.config.statsd.EVENT_CONNECTION_NEGOTIATED_TEMPLATE % 
+                { 'setting': 'feature.%s' % (feature,) })
+
+        if self.__hello_cb is not None:
+            self.__hello_cb(negotiated)
+
+    def __send_hello(self, exchange):
+        """Send a heartbeat carrying our capabilities as soon as the 
+        connection is up, and apply the ones that come back. A peer that 
+        predates the hello answers with a plain heartbeat reply, and is just 
+        treated conservatively.
+        """
+
+        try:
+            self.__negotiate()
+        finally:
+            exchange.finish_hello()
+
+        if self.__ready_cb is not None:
+            self.__ready_cb()
+
+    def __negotiate(self):
+        message_obj = self.__build_hello_heartbeat(
+                        rpipe.protocols.MT_HEARTBEAT)
+
+        try:
+            reply_message_obj = rpipe.message_exchange.send_and_receive(
+                                    self.__exchange_key, 
+                                    message_obj, 
+                                    timeout=rpipe.config.protocol.\
+                                                HELLO_TIMEOUT_S,
+                                    priority=rpipe.config.exchange.\
+                                                PRIORITY_CONTROL)
+        except (KeyError, rpipe.exceptions.RpException):
+            _logger.exception("Hello to [%s] failed.", 
+                              self.__ctx.participant_address)
+            return
+
+        if reply_message_obj.HasField('hello') is False:
+            _logger.info("[%s] didn't send a hello. It predates the "
+                         "handshake.", self.__ctx.participant_address)
+
+            rpipe.stats.post_to_counter(
+                rpipe.config.statsd.EVENT_CONNECTION_NEGOTIATED_TEMPLATE % 
+                { 'setting': 'legacy' })
+
+            return
+
+        self.__apply_hello(reply_message_obj.hello)
 
     def __handle_heartbeat(self, message_id, message_obj):
         _logger.debug("Responding to heartbeat: %s", 
                       self.__ctx.participant_address)
 
-        self.__last_heartbeat_epoch = time.time()
+        if message_obj.HasField('hello') is True:
+            _logger.debug("Heartbeat carries a hello.")
+
+            self.__apply_hello(message_obj.hello)
+
+            reply_message_obj = self.__build_hello_heartbeat(
+                                    rpipe.protocols.MT_HEARTBEAT_R)
+        else:
+            reply_message_obj = self.__heartbeat_reply_message_obj
 
         rpipe.message_exchange.send(
-            self.__ctx.participant_address, 
-            self.__heartbeat_reply_message_obj,
+            self.__exchange_key, 
+            reply_message_obj,
             reply_to_message_id=message_id,
-            expect_response=False)
+            expect_response=False,
+            priority=rpipe.config.exchange.PRIORITY_CONTROL)
+
+    def __dispatch_event(self, message_id, message_obj):
+        respond_cb = functools.partial(self.__send_event_response, message_id)
+        self.__spawn_event(message_obj, respond_cb)
+
+    def __dispatch_event_batch(self, message_id, message_obj):
+        """Dispatch each of the events in the batch individually, and answer 
+        them as they finish, so that a slow event doesn't hold up the others. 
+        The replies that are ready at the same time go out together.
+        """
+
+        _logger.debug("Received batch of (%d) events.", 
+                      len(message_obj.events))
+
+        # The replies that haven't been sent yet (one partial batch-reply).
+        partial = [None]
+
+        def send_partial():
+            reply_message_obj = partial[0]
+            partial[0] = None
+
+            self.__send_reply(message_id, reply_message_obj)
+
+        def respond_cb(i, code, mimetype='text/plain', data=''):
+            if partial[0] is None:
+                partial[0] = rpipe.protocol.get_obj_from_type(
+                                rpipe.protocols.MT_EVENT_BATCH_R)
+
+                partial[0].version = 1
+
+                gevent.spawn(send_partial)
+
+            self.__fill_event_reply(
+                partial[0].replies.add(), 
+                code, 
+                mimetype, 
+                data)
+
+            partial[0].indices.append(i)
+
+        for i, event_message_obj in enumerate(message_obj.events):
+            self.__spawn_event(
+                event_message_obj, 
+                functools.partial(respond_cb, i))
+
+    def __spawn_event(self, message_obj, respond_cb):
+        """Hand the event to the dispatch pool. If the pool is saturated, the 
+        event waits in the backlog, or is refused right away if that's full 
+        too. We never block here, so that heartbeats and hellos are never held 
+        up behind slow handlers.
+        """
+
+        queued_at_epoch = time.time()
+
+        if self.__dispatch_pool.full() is False:
+            self.__dispatch_pool.spawn(
+                self.__run_events, 
+                message_obj, 
+                respond_cb,
+                queued_at_epoch)
+        elif len(self.__dispatch_backlog) < \
+                rpipe.config.protocol.EVENT_DISPATCH_BACKLOG_MAX:
+            rpipe.stats.post_to_counter(
+                rpipe.config.statsd.EVENT_DISPATCH_POOL_SATURATED_TICK)
 
-    def __handle_event(self, message_id, message_obj):
-        _logger.info("Received event from [%s]: [%s] [%s]", 
-                     self.__ctx.participant_address, message_obj.verb, 
-                     message_obj.noun)
+            self.__dispatch_backlog.append(
+                (message_obj, respond_cb, queued_at_epoch))
+        else:
+            _logger.warning("Dispatch backlog for [%s] is full. Refusing "
+                            "event: [%s] [%s]", 
+                            self.__ctx.participant_address, message_obj.verb, 
+                            message_obj.noun)
 
-        url_parts = message_obj.noun.split('//')
+            rpipe.stats.post_to_counter(
+                rpipe.config.statsd.EVENT_DISPATCH_BACKLOG_REJECT_TICK)
 
-        noun = url_parts[0]
-        if len(url_parts) > 1:
-            parameters = url_parts[1].split('/')
-        else:
-            parameters = []
+            respond_cb(
+                rpipe.config.exchange.INCOMING_REFUSED_CODE, 
+                'text/plain', 
+                'Too many incoming events')
 
-        handler_parts = [
-            message_obj.verb.lower(),
-            noun.replace('/', '_'),
-        ]
-        
-        event_handler_name = '_'.join(handler_parts)
+        rpipe.stats.post_to_gauge(
+            rpipe.config.statsd.EVENT_DISPATCH_POOL_FREE_GAUGE,
+            self.__dispatch_pool.free_count())
 
-        try:
-            handler = getattr(self.__eh, event_handler_name)
-        except AttributeError:
-            _logger.warning("Event is not handled: METHOD=[%s]", 
-                            event_handler_name)
-
-            self.__send_event_response(
-                message_id, 
-                rpipe.config.protocol.UNHANDLED_EVENT_DEFAULT_RESULT_CODE)
-        else:
-            counter_name = rpipe.config.statsd.EVENT_HANDLER_TICK_TEMPLATE % \
-                           { 'handler_name': event_handler_name }
+    def __run_events(self, message_obj, respond_cb, queued_at_epoch):
+        """Handle the given event, and then whatever is waiting in the 
+        backlog.
+        """
+
+        while 1:
+            self.__run_event(message_obj, respond_cb, queued_at_epoch)
+
+            try:
+                (message_obj, respond_cb, queued_at_epoch) = \
+                    self.__dispatch_backlog.popleft()
+            except IndexError:
+                break
+
+    def __run_event(self, message_obj, respond_cb, queued_at_epoch):
+        """Handle the event. Every event is answered, even if its handling 
+        fails.
+        """
 
-            rpipe.stats.post_to_counter(counter_name)
+        responded = [False]
 
-            timer_name = rpipe.config.statsd.EVENT_HANDLER_TIMING_TEMPLATE % \
-                         { 'handler_name': event_handler_name }
+        def respond_once_cb(*args, **kwargs):
+            responded[0] = True
+            respond_cb(*args, **kwargs)
 
-            with rpipe.stats.time_and_post(timer_name):
-                self.__process_event(
-                    handler,
-                    message_id,
-                    parameters,
-                    message_obj.mimetype,
-                    message_obj.data)
+        with _DISPATCH_SEMAPHORE:
+            wait_ms = (time.time() - queued_at_epoch) * 1000.0
+
+            rpipe.stats.post_timing(
+                rpipe.config.statsd.EVENT_DISPATCH_QUEUE_WAIT_TIMING,
+                wait_ms)
+
+            try:
+                with rpipe.stats.time_and_post(
+                        rpipe.config.statsd.\
+                            EVENT_MESSAGE_RECEIVE_HANDLE_TIMING):
+                    self.__handle_event(message_obj, respond_once_cb)
+            except Exception:
+                _logger.exception("Event handling failed: [%s] [%s]", 
+                                  message_obj.verb, message_obj.noun)
+            finally:
+                if responded[0] is False:
+                    respond_cb(
+                        rpipe.config.exchange.UNHANDLED_EXCEPTION_CODE, 
+                        'text/plain', 
+                        'Event was not answered')
+
+    def __handle_event(self, message_obj, respond_cb):
+        _logger.info("Received event from [%s]: [%s] [%s]", 
+                     self.__ctx.participant_address, message_obj.verb, 
+                     message_obj.noun)
 
-    def __process_event(self, handler, message_id, parameters, mimetype, data):
+        try:
+            (route, parameters) = self.__routes.lookup(
+                                    message_obj.verb, 
+                                    message_obj.noun,
+                                    event_handler=self.__eh)
+        except LookupError as e:
+            _logger.warning("Event is not handled: METHOD=[%s]", str(e))
+
+            respond_cb(rpipe.config.protocol.UNHANDLED_EVENT_DEFAULT_RESULT_CODE)
+            return
+
+        if route.cache is not None and message_obj.verb.lower() == 'get':
+            cache_key = (
+                tuple(parameters), 
+                message_obj.mimetype, 
+                message_obj.data, 
+                message_obj.accept,
+                self.__exchange_key \
+                    if route.cache_per_connection is True \
+                    else None)
+
+            reply = route.cache.get(cache_key)
+            if reply is not None:
+                _logger.debug("Responding from cache: [%s]", route.name)
+
+                respond_cb(*reply)
+                return
+
+            respond_cb = functools.partial(
+                            self.__cache_and_respond, 
+                            route.cache, 
+                            cache_key, 
+                            respond_cb)
+
+        rpipe.stats.post_to_counter(route.tick_name)
+
+        with rpipe.stats.time_and_post(route.timing_name):
+            self.__process_event(
+                route,
+                respond_cb,
+                parameters,
+                message_obj.mimetype,
+                message_obj.data,
+                message_obj.accept)
+
+    def __cache_and_respond(self, cache, cache_key, respond_cb, code, 
+                            mimetype='text/plain', data=''):
+        if code == 0 and \
+           issubclass(data.__class__, types.GeneratorType) is False:
+            cache.set(cache_key, (code, mimetype, data))
+
+        respond_cb(code, mimetype, data)
+
+    def __process_event(self, route, respond_cb, parameters, mimetype, data, 
+                        accept):
         """Processes event in a new gthread."""
 
         _logger.debug("Forwarding event to event-handler. MIMETYPE=[%s] "
                       "PARAMS=%s", mimetype, parameters)
 
-        # We shouldn't even receive data within a GET.
-        if mimetype == _CT_JSON and data:
-            _logger.debug("Decoding JSON data.")
-            data = json.loads(data)
-
         code = 0
 
         try:
-            result = handler(self.__ctx, (mimetype, data), *parameters)
+            # We shouldn't even receive data within a GET. Data that doesn't 
+            # decode is reported like any other failure of the event.
+            if data:
+                codec = rpipe.codec.get_codec(mimetype)
+                if codec is not None:
+                    _logger.debug("Decoding [%s] data.", mimetype)
+                    data = codec.decode(data)
+
+            result = route.invoke(
+                        self.__eh, 
+                        self.__ctx, 
+                        (mimetype, data), 
+                        parameters)
         except Exception as e:
             _logger.exception("Unhandled exception during event: %s", 
                               e.__class__.__name__)
@@ -239,30 +567,40 @@ class CommonMessageLoop(object):
             mimetype = None
             result_data = result
 
-        if mimetype is None:
-            mimetype = _CT_JSON
-
-        _logger.debug("Event result for handler [%s]: [%s] [%s] (%s)", 
-                      handler.func_name, mimetype, 
-                      result_data.__class__.__name__, code)
-
         if result_data is None:
             _logger.debug("Result data was [literally] None. Coalescing to "
                           "empty.")
 
             result_data = ''
 
-        if issubclass(result_data.__class__, 
-                      (basestring, types.GeneratorType)) is False:
-            if mimetype == _CT_JSON:
-                result_data = json.dumps(result_data)
+        is_encoded = issubclass(
+                        result_data.__class__, 
+                        (basestring, types.GeneratorType))
+
+        # If we have to encode the result, we use whatever the requester 
+        # prefers.
+        if mimetype is None:
+            if is_encoded is True:
+                mimetype = rpipe.codec.CT_JSON
             else:
-                raise ValueError("Response to noun [%s] was invalid type and "
-                                 "we're not allowed to encode it to JSON: "
-                                 "[%s]" %
-                                 (noun, result_data.__class__.__name__))
+                mimetype = rpipe.codec.negotiate(accept)
 
-        self.__send_event_response(message_id, code, mimetype, result_data)
+        _logger.debug("Event result for handler [%s]: [%s] [%s] (%s)", 
+                      route.name, mimetype, 
+                      result_data.__class__.__name__, code)
+
+        if is_encoded is False:
+            codec = rpipe.codec.get_codec(mimetype)
+            if codec is None:
+                raise ValueError("Response from route [%s] was invalid type "
+                                 "and there's no codec to encode it to "
+                                 "[%s]: [%s]" %
+                                 (route.name, mimetype, 
+                                  result_data.__class__.__name__))
+
+            result_data = codec.encode(result_data)
+
+        respond_cb(code, mimetype, result_data)
 
     def __send_event_response(self, reply_to_message_id, code, 
                               mimetype='text/plain', data=''):
@@ -276,13 +614,87 @@ class CommonMessageLoop(object):
         reply_message_obj = rpipe.protocol.get_obj_from_type(
                                 rpipe.protocols.MT_EVENT_R)
 
+        self.__fill_event_reply(reply_message_obj, code, mimetype, data)
+        self.__send_reply(reply_to_message_id, reply_message_obj)
+
+    def __fill_event_reply(self, reply_message_obj, code, mimetype, data):
         reply_message_obj.version = 1
         reply_message_obj.mimetype = mimetype
         reply_message_obj.code = code
+
+        if issubclass(data.__class__, unicode) is True:
+            data = data.encode('utf-8')
+
         reply_message_obj.data = data
 
-        rpipe.message_exchange.send(
-            self.__ctx.participant_address, 
-            reply_message_obj,
-            reply_to_message_id=reply_to_message_id,
-            expect_response=False)
+    def __send_reply(self, reply_to_message_id, reply_message_obj):
+        try:
+            rpipe.message_exchange.send(
+                self.__exchange_key, 
+                reply_message_obj,
+                reply_to_message_id=reply_to_message_id,
+                expect_response=False)
+        except rpipe.exceptions.RpMessageTooLarge as e:
+            _logger.error("Reply to [%s] is too large: %s", 
+                          rpipe.protocol.get_string_from_message_id(
+                            reply_to_message_id), 
+                          str(e))
+
+            # In a batch, we give up on the largest replies until the rest 
+            # fit.
+            self.__send_substitute_reply(
+                reply_to_message_id, 
+                reply_message_obj, 
+                rpipe.config.exchange.REPLY_TOO_LARGE_CODE, 
+                'Reply too large',
+                lambda replies: sorted(
+                                    replies, 
+                                    key=lambda reply_obj: reply_obj.ByteSize(), 
+                                    reverse=True))
+        except rpipe.exceptions.RpBinaryDataUnsupported as e:
+            _logger.error("Reply to [%s] can't be sent: %s", 
+                          rpipe.protocol.get_string_from_message_id(
+                            reply_to_message_id), 
+                          str(e))
+
+            self.__send_substitute_reply(
+                reply_to_message_id, 
+                reply_message_obj, 
+                rpipe.config.exchange.BINARY_DATA_UNSUPPORTED_CODE, 
+                'Peer does not accept binary data',
+                lambda replies: [reply_obj 
+                                 for reply_obj 
+                                 in replies 
+                                 if rpipe.protocol.is_text(
+                                        reply_obj.data) is False])
+
+    def __send_substitute_reply(self, reply_to_message_id, reply_message_obj, 
+                                code, data, select_replies):
+        """The reply couldn't be sent. Tell the requester why, rather than 
+        leaving it to time out. In a batch, the replies returned by 
+        select_replies() are replaced (in order) until the rest can be sent.
+        """
+
+        if rpipe.protocols.get_type_from_obj(reply_message_obj) == \
+           rpipe.protocols.MT_EVENT_BATCH_R:
+            replies = select_replies(reply_message_obj.replies)
+        else:
+            reply_message_obj = rpipe.protocol.get_obj_from_type(
+                                    rpipe.protocols.MT_EVENT_R)
+
+            replies = [reply_message_obj]
+
+        for reply_obj in replies:
+            self.__fill_event_reply(reply_obj, code, 'text/plain', data)
+
+            try:
+                rpipe.message_exchange.send(
+                    self.__exchange_key, 
+                    reply_message_obj,
+                    reply_to_message_id=reply_to_message_id,
+                    expect_response=False)
+            except (rpipe.exceptions.RpMessageTooLarge, 
+                    rpipe.exceptions.RpBinaryDataUnsupported):
+                continue
+
+            return
@@ -1,18 +1,79 @@
 import struct
+import sys
 import random
 import logging
 import math
+import time
+import zlib
+import bz2
 
 import gevent.ssl
 import gevent.socket
 
+import google.protobuf.message
+
+import rpipe.config.exchange
+import rpipe.config.statsd
 import rpipe.exceptions
 import rpipe.protocols
-import rpipe.utility
+import rpipe.stats
 
 # Message flags.
 MF_IS_REPLY = 0x01
 
+# The codec (if any) that the body was compressed with.
+MF_CODEC_MASK = 0x06
+_MF_CODEC_SHIFT = 1
+
+# Set by senders that can decompress. Older peers neither set nor check it, so 
+# we never compress toward them.
+MF_ACCEPTS_COMPRESSION = 0x08
+
+# Set on every fragment of a message except the last. Like compression, we 
+# only fragment toward peers that set MF_ACCEPTS_FRAGMENTS.
+MF_HAS_MORE = 0x10
+MF_ACCEPTS_FRAGMENTS = 0x20
+
+# Advertised in the hello at the start of a connection. Peers that predate the 
+# hello just ignore it.
+PROTOCOL_VERSION = 2
+
+FEATURE_FRAGMENTS = 'fragments'
+FEATURE_EVENT_BATCH = 'event_batch'
+
+# Event data used to be a (UTF-8) string field. Peers that don't advertise 
+# this can't parse anything else.
+FEATURE_BINARY_DATA = 'binary_data'
+
+CODEC_ZLIB = 1
+CODEC_BZ2 = 2
+
+_CODECS_BY_NAME = {
+    'zlib': CODEC_ZLIB,
+    'bz2': CODEC_BZ2,
+}
+
+_COMPRESSORS = {
+    CODEC_ZLIB: zlib.compress,
+    CODEC_BZ2: bz2.compress,
+}
+
+# The compression levels that each codec accepts.
+_COMPRESSION_LEVELS = {
+    CODEC_ZLIB: (0, 9),
+    CODEC_BZ2: (1, 9),
+}
+
+# The Python 2 bz2 decompressor can't cap its output, so we feed it the 
+# compressed data a little at a time and check the size as we go. Each piece 
+# can only complete a block or two (at most ~46MB apiece).
+_BZ2_INPUT_CHUNK_BYTES = 64
+
+_TCP_USER_TIMEOUT_LINUX = 18
+
+# (Message_Type, Flags, Data_Length, Message_ID)
+_HEADER_FORMAT = '!BBII'
+
 _MESSAGE_ID_MAXIMUM = 2**32
 _MESSAGE_ID_MAX_ZEROES = int(math.ceil(math.log(_MESSAGE_ID_MAXIMUM, 10))) - 1
 _MESSAGE_ID_MINIMUM = int('1' + '0' * _MESSAGE_ID_MAX_ZEROES)
@@ -60,9 +121,267 @@ class SocketWrapper(object):
             _logger.exception(message)
             raise rpipe.exceptions.RpConnectionClosed(message)
 
+    def recv_into(self, buffer_):
+        """Read whatever is available directly from the socket (bypassing the 
+        file-object) into the given buffer.
+        """
+
+        try:
+            received = self.__socket.recv_into(buffer_)
+        except gevent.ssl.SSLError as e:
+            message = ("There was an SSL error (read). Closing stream: %s" % (str(e)))
+            _logger.exception(message)
+            raise rpipe.exceptions.RpConnectionClosed(message)
+        except gevent.socket.error as e:
+            message = ("There was a socket error (read). Closing stream: %s" % (str(e)))
+            _logger.exception(message)
+            raise rpipe.exceptions.RpConnectionClosed(message)
+
+        if received == 0:
+            raise rpipe.exceptions.RpConnectionClosed()
+
+        return received
+
+    def set_nodelay(self, is_enabled):
+        """Toggle Nagle's algorithm. We coalesce our own writes, so there's no 
+        point in having the kernel hold them back as well.
+        """
+
+        self.__socket.setsockopt(
+            gevent.socket.IPPROTO_TCP, 
+            gevent.socket.TCP_NODELAY, 
+            1 if is_enabled is True else 0)
+
+    def set_keepalive(self, idle_s, interval_s, count):
+        """Enable TCP keepalive probes. The timing options are only applied 
+        where the platform supports them.
+        """
+
+        self.__socket.setsockopt(
+            gevent.socket.SOL_SOCKET, 
+            gevent.socket.SO_KEEPALIVE, 
+            1)
+
+        options = (
+            ('TCP_KEEPIDLE', idle_s),
+            ('TCP_KEEPINTVL', interval_s),
+            ('TCP_KEEPCNT', count),
+        )
+
+        for (name, value) in options:
+            option = getattr(gevent.socket, name, None)
+            if option is None:
+                continue
+
+            self.__socket.setsockopt(gevent.socket.IPPROTO_TCP, option, value)
+
+    def set_user_timeout(self, timeout_ms):
+        """Drop the connection if sent data goes unacknowledged for this long 
+        (Linux only).
+        """
+
+        option = getattr(gevent.socket, 'TCP_USER_TIMEOUT', None)
+        if option is None:
+            if sys.platform.startswith('linux') is False:
+                return
+
+            # Python 2 doesn't export it.
+            option = _TCP_USER_TIMEOUT_LINUX
+
+        self.__socket.setsockopt(gevent.socket.IPPROTO_TCP, option, timeout_ms)
+
+    def set_cork(self, is_enabled):
+        """Hold partial frames in the kernel until uncorked (Linux only)."""
+
+        try:
+            option = gevent.socket.TCP_CORK
+        except AttributeError:
+            return
+
+        self.__socket.setsockopt(
+            gevent.socket.IPPROTO_TCP, 
+            option, 
+            1 if is_enabled is True else 0)
+
     def __str__(self):
         return str(self.__socket.getpeername())
 
+class MessageIdAllocator(object):
+    """Allocate message-IDs sequentially (from a random starting point), 
+    wrapping around within the fixed-width range, and skipping any ID that is 
+    still present in the given in-flight collection.
+    """
+
+    def __init__(self, in_flight, start=None):
+        if start is None:
+            start = id_generator()
+
+        self.__in_flight = in_flight
+        self.__next = start
+
+    def allocate(self):
+        attempts = 0
+        while attempts < _MESSAGE_ID_MAXIMUM - _MESSAGE_ID_MINIMUM:
+            message_id = self.__next
+
+            self.__next += 1
+            if self.__next >= _MESSAGE_ID_MAXIMUM:
+                self.__next = _MESSAGE_ID_MINIMUM
+
+            if message_id not in self.__in_flight:
+                return message_id
+
+            attempts += 1
+
+        raise rpipe.exceptions.RpException("No message-IDs are available.")
+
+class FrameReader(object):
+    """Read messages from a socket through a reusable receive-buffer. Each 
+    receive takes as much as is available, so many small frames can be 
+    extracted from one read, and headers are unpacked in place.
+    """
+
+    def __init__(self, ws, buffer_size, max_message_bytes, 
+                 max_partial_count, max_partial_bytes):
+        self.__ws = ws
+        self.__default_size = buffer_size
+        self.__max_message_bytes = max_message_bytes
+        self.__max_partial_count = max_partial_count
+        self.__max_partial_bytes = max_partial_bytes
+        self.__reset_buffer(buffer_size)
+
+        # Fragments of messages that haven't been completed yet, by type and 
+        # message-ID, and the number of bytes that they hold between them.
+        self.__partials = {}
+        self.__partial_bytes = 0
+
+    def __reset_buffer(self, size):
+        self.__buffer = bytearray(size)
+        self.__view = memoryview(self.__buffer)
+        self.__start = 0
+        self.__end = 0
+
+    def __fill(self, length):
+        """Make sure that at least the given number of unconsumed bytes are 
+        buffered.
+        """
+
+        while self.__end - self.__start < length:
+            if self.__start + length > len(self.__buffer):
+                # There's not enough room after the unconsumed data. Move it to 
+                # the front, into a larger buffer if it still won't fit.
+                pending = self.__view[self.__start:self.__end].tobytes()
+
+                if length > len(self.__buffer):
+                    self.__reset_buffer(max(length, len(self.__buffer) * 2))
+                else:
+                    self.__start = 0
+                    self.__end = 0
+
+                self.__buffer[0:len(pending)] = pending
+                self.__end = len(pending)
+
+            self.__end += self.__ws.recv_into(self.__view[self.__end:])
+
+    def __read_frame(self):
+        """Return the info and the body of the next frame."""
+
+        header_length = get_standard_header_length()
+        self.__fill(header_length)
+
+        (message_type, flags, data_length, message_id) = struct.unpack_from(
+            _HEADER_FORMAT, 
+            self.__buffer, 
+            self.__start)
+
+        message_info = _get_message_info(
+                        message_type, 
+                        flags, 
+                        data_length, 
+                        message_id)
+
+        if data_length > self.__max_message_bytes:
+            raise rpipe.exceptions.RpMessageTooLarge(
+                    "Frame of (%d) bytes exceeds the maximum of (%d)." % 
+                    (data_length, self.__max_message_bytes))
+
+        self.__fill(header_length + data_length)
+
+        body_start = self.__start + header_length
+        body_end = body_start + data_length
+
+        # Protobuf can only parse a string, so this is the one copy.
+        body = self.__view[body_start:body_end].tobytes()
+
+        if body_end == self.__end:
+            # Everything has been consumed. Start from the front again, and 
+            # give back the memory if a large message had grown the buffer.
+            if len(self.__buffer) > self.__default_size:
+                self.__reset_buffer(self.__default_size)
+            else:
+                self.__start = 0
+                self.__end = 0
+        else:
+            self.__start = body_end
+
+        return (message_info, body)
+
+    def read_message(self):
+        """Return the next complete message, reassembling fragments. Fragments 
+        of different messages may arrive interleaved.
+        """
+
+        while 1:
+            (message_info, body) = self.__read_frame()
+            key = (message_info['type'], message_info['message_id'])
+
+            if message_info['has_more'] is True:
+                try:
+                    (fragments, length) = self.__partials[key]
+                except KeyError:
+                    if len(self.__partials) >= self.__max_partial_count:
+                        raise rpipe.exceptions.RpProtocolError(
+                                "Too many fragmented messages are open: "
+                                "(%d)" % (len(self.__partials),))
+
+                    (fragments, length) = ([], 0)
+
+                length += len(body)
+                if length > self.__max_message_bytes:
+                    raise rpipe.exceptions.RpMessageTooLarge(
+                            "Fragmented message exceeds the maximum of (%d) "
+                            "bytes." % (self.__max_message_bytes,))
+
+                self.__partial_bytes += len(body)
+                if self.__partial_bytes > self.__max_partial_bytes:
+                    raise rpipe.exceptions.RpProtocolError(
+                            "Open fragmented messages exceed the maximum of "
+                            "(%d) bytes." % (self.__max_partial_bytes,))
+
+                fragments.append(body)
+                self.__partials[key] = (fragments, length)
+
+                continue
+
+            try:
+                (fragments, length) = self.__partials.pop(key)
+            except KeyError:
+                pass
+            else:
+                self.__partial_bytes -= length
+
+                fragments.append(body)
+                body = ''.join(fragments)
+
+                message_info['length'] = len(body)
+
+            message_obj = _unserialize(
+                            message_info, 
+                            body, 
+                            self.__max_message_bytes)
+
+            return (message_info, message_obj)
+
 def id_generator():
     """Generate IDs for composed messages. They will all the the same length.
     """
@@ -70,10 +389,7 @@ def id_generator():
     return random.randrange(_MESSAGE_ID_MINIMUM, _MESSAGE_ID_MAXIMUM)
 
 def get_obj_from_type(message_type):
-    fq_module_name = rpipe.protocols.get_fq_module_name_for_type(message_type)
-    message_cls = rpipe.utility.load_cls_from_string(fq_module_name)
-
-    return message_cls()
+    return rpipe.protocols.get_cls_for_type(message_type)()
 
 #def get_name_from_message_cls(message_cls):
 #    parts = []
@@ -86,7 +402,96 @@ def get_obj_from_type(message_type):
 #        parts[i] += c
 #    return '_'.join(parts)
 
-def _serialize(message_obj, message_id=None, is_response=False, flags=0):
+def get_codec_from_name(name):
+    """Return the codec for the given name ("zlib" or "bz2"), or None if the 
+    name is empty.
+    """
+
+    if not name:
+        return None
+
+    try:
+        return _CODECS_BY_NAME[name]
+    except KeyError:
+        raise ValueError("Compression codec not supported: [%s]" % (name,))
+
+def get_codec_names():
+    return sorted(_CODECS_BY_NAME.keys())
+
+def check_compression_level(codec, level):
+    """Raise ValueError if the codec doesn't support the level."""
+
+    (minimum, maximum) = _COMPRESSION_LEVELS[codec]
+    if not (minimum <= level <= maximum):
+        raise ValueError("Compression level for codec (%d) must be between "
+                         "(%d) and (%d): (%d)" % 
+                         (codec, minimum, maximum, level))
+
+def _decompress_zlib(data, max_bytes):
+    decompressor = zlib.decompressobj()
+
+    # A maximum-length of 0 means unbounded.
+    decompressed = decompressor.decompress(data, max_bytes + 1)
+    if len(decompressed) > max_bytes or decompressor.unconsumed_tail:
+        raise rpipe.exceptions.RpMessageTooLarge(
+                "Decompressed message exceeds the maximum of (%d) bytes." % 
+                (max_bytes,))
+
+    return decompressed + decompressor.flush()
+
+def _decompress_bz2(data, max_bytes):
+    decompressor = bz2.BZ2Decompressor()
+
+    parts = []
+    length = 0
+    for offset in range(0, len(data), _BZ2_INPUT_CHUNK_BYTES):
+        part = decompressor.decompress(
+                data[offset:offset + _BZ2_INPUT_CHUNK_BYTES])
+
+        length += len(part)
+        if length > max_bytes:
+            raise rpipe.exceptions.RpMessageTooLarge(
+                    "Decompressed message exceeds the maximum of (%d) "
+                    "bytes." % (max_bytes,))
+
+        parts.append(part)
+
+    return ''.join(parts)
+
+_DECOMPRESSORS = {
+    CODEC_ZLIB: _decompress_zlib,
+    CODEC_BZ2: _decompress_bz2,
+}
+
+def _compress(codec, level, serialized):
+    """Return the compressed data, or None if it wasn't worth it."""
+
+    start_epoch = time.time()
+    compressed = _COMPRESSORS[codec](serialized, level)
+    elapsed_ms = (time.time() - start_epoch) * 1000.0
+
+    rpipe.stats.post_timing(
+        rpipe.config.statsd.EVENT_PROTOCOL_COMPRESS_TIMING, 
+        elapsed_ms)
+
+    saved = len(serialized) - len(compressed)
+    if saved <= 0:
+        return None
+
+    rpipe.stats.post_to_counter(
+        rpipe.config.statsd.EVENT_PROTOCOL_COMPRESS_SAVED_BYTES, 
+        count=saved)
+
+    return compressed
+
+def _serialize_body(message_obj, message_id=None, is_response=False, 
+                    flags=0, codec=None, compression_level=6, 
+                    compression_threshold=0):
+    """Return the message-type, flags, body, and message-ID for a message. If 
+    a codec is given, the body is compressed if it's at least the threshold 
+    size, and if that actually makes it smaller.
+    """
+
     if message_id is None:
         message_id = id_generator()
 
@@ -96,33 +501,71 @@ def _serialize(message_obj, message_id=None, is_response=False, flags=0):
     message_type = rpipe.protocols.get_type_from_obj(message_obj)
     serialized = message_obj.SerializeToString()
 
+    if codec is not None and len(serialized) >= compression_threshold:
+        compressed = _compress(codec, compression_level, serialized)
+        if compressed is not None:
+            serialized = compressed
+            flags |= (codec << _MF_CODEC_SHIFT)
+
+    return (message_type, flags, serialized, message_id)
+
+def _pack_frame(message_type, flags, message_id, body):
     header = struct.pack(
-                '!BBII', 
+                _HEADER_FORMAT, 
                 message_type, 
                 flags, 
-                len(serialized), 
+                len(body), 
                 message_id)
 
-    whole_message = header + serialized
     _logger.debug("Serializing [%s]: (%d) + (%d)", 
                   get_string_from_message_id(message_id), len(header), 
-                  len(serialized))
+                  len(body))
+
+    return header + body
+
+def _serialize(message_obj, **kwargs):
+    (message_type, flags, body, message_id) = _serialize_body(
+                                                message_obj, 
+                                                **kwargs)
+
+    whole_message = _pack_frame(message_type, flags, message_id, body)
 
     return (whole_message, message_id)
 
+def _iterate_fragments(message_type, flags, message_id, body, fragment_bytes):
+    offset = 0
+    while 1:
+        fragment = body[offset:offset + fragment_bytes]
+        offset += len(fragment)
+
+        if offset < len(body):
+            yield _pack_frame(
+                    message_type, 
+                    flags | MF_HAS_MORE, 
+                    message_id, 
+                    fragment)
+        else:
+            yield _pack_frame(message_type, flags, message_id, fragment)
+            break
+
 def get_standard_header_length():
     # (Message_Type + Flags + Data_Length) + Message_ID
     return (1 + 1 + 4 + 4)
 
 def get_message_info_from_header(header):
-    parts = struct.unpack('!BBII', header)
-    (message_type, flags, data_length, message_id) = parts
+    parts = struct.unpack(_HEADER_FORMAT, header)
+    return _get_message_info(*parts)
 
+def _get_message_info(message_type, flags, data_length, message_id):
     return {
         'type': message_type,
         'length': data_length,
         'message_id': message_id,
         'is_response': bool(flags & MF_IS_REPLY),
+        'codec': (flags & MF_CODEC_MASK) >> _MF_CODEC_SHIFT,
+        'accepts_compression': bool(flags & MF_ACCEPTS_COMPRESSION),
+        'has_more': bool(flags & MF_HAS_MORE),
+        'accepts_fragments': bool(flags & MF_ACCEPTS_FRAGMENTS),
     }
 
 def get_message_length_from_info(message_info):
@@ -134,12 +577,53 @@ def get_message_id_from_info(message_info):
 def get_message_type_from_info(message_info):
     return message_info['type']
 
-def _unserialize(message_info, data):
-    message_obj = get_obj_from_type(message_info['type'])
-    message_obj.ParseFromString(data)
+def _unserialize(message_info, data, max_bytes=None):
+    """Parse the body of a message. A compressed body may not decompress to 
+    more than the given number of bytes (by default, MAX_MESSAGE_BYTES).
+    """
+
+    codec = message_info['codec']
+    if codec:
+        if max_bytes is None:
+            max_bytes = rpipe.config.exchange.MAX_MESSAGE_BYTES
+
+        try:
+            decompress = _DECOMPRESSORS[codec]
+        except KeyError:
+            raise rpipe.exceptions.RpProtocolError(
+                    "Message was compressed with an unknown codec: (%d)" % 
+                    (codec,))
+
+        try:
+            data = decompress(data, max_bytes)
+        except (zlib.error, IOError, EOFError) as e:
+            raise rpipe.exceptions.RpProtocolError(
+                    "Message could not be decompressed: %s" % (str(e),))
+
+    try:
+        message_obj = get_obj_from_type(message_info['type'])
+    except KeyError:
+        raise rpipe.exceptions.RpProtocolError(
+                "Message has an unknown type: (%d)" % (message_info['type'],))
+
+    try:
+        message_obj.ParseFromString(data)
+    except google.protobuf.message.DecodeError as e:
+        raise rpipe.exceptions.RpProtocolError(
+                "Message could not be parsed: %s" % (str(e),))
 
     return message_obj
 
+def is_text(data):
+    """Return whether the data is valid UTF-8."""
+
+    try:
+        data.decode('utf-8')
+    except UnicodeDecodeError:
+        return False
+
+    return True
+
 def get_string_from_message_id(message_id):
     return ('%010d' % (message_id,))
 
@@ -173,8 +657,33 @@ def read_message_from_file_object(file_):
 
     return (message_info, message_obj)
 
+def serialize_message_obj(message_obj, **kwargs):
+    """Return a 2-tuple of the complete frame (header and body) and the 
+    message-ID.
+    """
+
+    return _serialize(message_obj, **kwargs)
+
+def serialize_message_obj_fragments(message_obj, fragment_bytes, **kwargs):
+    """Like serialize_message_obj(), but return a generator of frames, each 
+    with at most the given number of body bytes.
+    """
+
+    (message_type, flags, body, message_id) = _serialize_body(
+                                                message_obj, 
+                                                **kwargs)
+
+    fragments = _iterate_fragments(
+                    message_type, 
+                    flags, 
+                    message_id, 
+                    body, 
+                    fragment_bytes)
+
+    return (fragments, message_id)
+
 def send_message_obj(ws, message_obj, **kwargs):
-    (data, message_id) = _serialize(message_obj, **kwargs)
+    (data, message_id) = serialize_message_obj(message_obj, **kwargs)
     _logger.debug("Sending [%s].", get_string_from_message_id(message_id))
 
     ws.write(data)
@@ -1,28 +1,65 @@
-_MESSAGE_PACKAGE = 'rpipe.protocols'
+from rpipe.protocols import heartbeat_pb2
+from rpipe.protocols import event_pb2
 
 MT_HEARTBEAT = 0x01
 MT_EVENT     = 0x02
+MT_EVENT_BATCH = 0x03
 
 MT_HEARTBEAT_R = 0x80
 MT_EVENT_R     = 0x81
+MT_EVENT_BATCH_R = 0x82
 
-_MESSAGE_MAP = {
-    MT_HEARTBEAT: 'heartbeat_pb2.Heartbeat',
-    MT_HEARTBEAT_R: 'heartbeat_pb2.HeartbeatReply',
-    MT_EVENT: 'event_pb2.Event',
-    MT_EVENT_R: 'event_pb2.EventReply',
-}
+# All reply types have the high bit set.
+_MT_REPLY_MASK = 0x80
 
-_MESSAGE_MAP_R = dict([(v, k) for (k, v) in _MESSAGE_MAP.items()])
+# These are populated once, here, and by anyone registering their own types.
+_TYPE_TO_CLS = {}
+_CLS_TO_TYPE = {}
+_TYPE_TO_NAME = {}
+
+def register_message_type(message_type, message_cls, is_reply=False):
+    """Associate a message-type code with a protobuf message class. Reply 
+    types must have the high bit set, and nothing else may.
+    """
+
+    if message_type in _TYPE_TO_CLS:
+        raise ValueError("Message-type (0x%02x) is already registered to "
+                         "[%s]." % (message_type, _TYPE_TO_NAME[message_type]))
+
+    if is_reply_type(message_type) != is_reply:
+        raise ValueError("Message-type (0x%02x) for [%s] must %shave the high "
+                         "bit set." % 
+                         (message_type, message_cls.__name__, 
+                          '' if is_reply is True else 'not '))
+
+    module_name = message_cls.__module__
+
+    _TYPE_TO_CLS[message_type] = message_cls
+    _CLS_TO_TYPE[message_cls] = message_type
+    _TYPE_TO_NAME[message_type] = \
+        module_name[module_name.rfind('.') + 1:] + '.' + message_cls.__name__
+
+def is_reply_type(message_type):
+    return bool(message_type & _MT_REPLY_MASK)
+
+register_message_type(MT_HEARTBEAT, heartbeat_pb2.Heartbeat)
+register_message_type(MT_HEARTBEAT_R, heartbeat_pb2.HeartbeatReply, 
+                      is_reply=True)
+register_message_type(MT_EVENT, event_pb2.Event)
+register_message_type(MT_EVENT_R, event_pb2.EventReply, is_reply=True)
+register_message_type(MT_EVENT_BATCH, event_pb2.EventBatch)
+register_message_type(MT_EVENT_BATCH_R, event_pb2.EventBatchReply, 
+                      is_reply=True)
+
+def get_cls_for_type(message_type):
+    return _TYPE_TO_CLS[message_type]
 
 def get_fq_cls_name_for_type(message_type):
-    return _MESSAGE_MAP[message_type]
+    return _TYPE_TO_NAME[message_type]
 
 def get_fq_module_name_for_type(message_type):
-    return ('%s.%s' % (_MESSAGE_PACKAGE, _MESSAGE_MAP[message_type]))
+    message_cls = _TYPE_TO_CLS[message_type]
+    return ('%s.%s' % (message_cls.__module__, message_cls.__name__))
 
 def get_type_from_obj(message_obj):
-    module_name = message_obj.__module__
-    pivot = module_name.rfind('.')
-    fq_cls = module_name[pivot + 1:] + '.' + message_obj.__class__.__name__
-    return _MESSAGE_MAP_R[fq_cls]
+    return _CLS_TO_TYPE[message_obj.__class__]
@@ -13,7 +13,7 @@ from google.protobuf import descriptor_pb2
 DESCRIPTOR = _descriptor.FileDescriptor(
   name='event.proto',
   package='rpipe.event',
-  serialized_pb='\n\x0b\x65vent.proto\x12\x0brpipe.event\"T\n\x05\x45vent\x12\x0f\n\x07version\x18\x01 \x02(\r\x12\x0c\n\x04verb\x18\x02 \x02(\t\x12\x0c\n\x04noun\x18\x03 \x02(\t\x12\x10\n\x08mimetype\x18\x04 \x01(\t\x12\x0c\n\x04\x64\x61ta\x18\x05 \x01(\t\"K\n\nEventReply\x12\x0f\n\x07version\x18\x01 \x02(\r\x12\x10\n\x08mimetype\x18\x02 \x01(\t\x12\x0c\n\x04\x63ode\x18\x03 \x02(\r\x12\x0c\n\x04\x64\x61ta\x18\x04 \x02(\t')
+  serialized_pb='\n\x0b\x65vent.proto\x12\x0brpipe.event\"d\n\x05\x45vent\x12\x0f\n\x07version\x18\x01 \x02(\r\x12\x0c\n\x04verb\x18\x02 \x02(\t\x12\x0c\n\x04noun\x18\x03 \x02(\t\x12\x10\n\x08mimetype\x18\x04 \x01(\t\x12\x0c\n\x04\x64\x61ta\x18\x05 \x01(\x0c\x12\x0e\n\x06\x61\x63\x63\x65pt\x18\x06 \x01(\t\"K\n\nEventReply\x12\x0f\n\x07version\x18\x01 \x02(\r\x12\x10\n\x08mimetype\x18\x02 \x01(\t\x12\x0c\n\x04\x63ode\x18\x03 \x02(\r\x12\x0c\n\x04\x64\x61ta\x18\x04 \x02(\x0c\"A\n\nEventBatch\x12\x0f\n\x07version\x18\x01 \x02(\r\x12\"\n\x06\x65vents\x18\x02 \x03(\x0b\x32\x12.rpipe.event.Event\"]\n\x0f\x45ventBatchReply\x12\x0f\n\x07version\x18\x01 \x02(\r\x12(\n\x07replies\x18\x02 \x03(\x0b\x32\x17.rpipe.event.EventReply\x12\x0f\n\x07indices\x18\x03 \x03(\r')
 
 
 
@@ -55,7 +55,14 @@ _EVENT = _descriptor.Descriptor(
       options=None),
     _descriptor.FieldDescriptor(
       name='data', full_name='rpipe.event.Event.data', index=4,
-      number=5, type=9, cpp_type=9, label=1,
+      number=5, type=12, cpp_type=9, label=1,
+      has_default_value=False, default_value="",
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None),
+    _descriptor.FieldDescriptor(
+      name='accept', full_name='rpipe.event.Event.accept', index=5,
+      number=6, type=9, cpp_type=9, label=1,
       has_default_value=False, default_value=unicode("", "utf-8"),
       message_type=None, enum_type=None, containing_type=None,
       is_extension=False, extension_scope=None,
@@ -70,7 +77,7 @@ _EVENT = _descriptor.Descriptor(
   is_extendable=False,
   extension_ranges=[],
   serialized_start=28,
-  serialized_end=112,
+  serialized_end=128,
 )
 
 
@@ -104,8 +111,43 @@ _EVENTREPLY = _descriptor.Descriptor(
       options=None),
     _descriptor.FieldDescriptor(
       name='data', full_name='rpipe.event.EventReply.data', index=3,
-      number=4, type=9, cpp_type=9, label=2,
-      has_default_value=False, default_value=unicode("", "utf-8"),
+      number=4, type=12, cpp_type=9, label=2,
+      has_default_value=False, default_value="",
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None),
+  ],
+  extensions=[
+  ],
+  nested_types=[],
+  enum_types=[
+  ],
+  options=None,
+  is_extendable=False,
+  extension_ranges=[],
+  serialized_start=130,
+  serialized_end=205,
+)
+
+
+_EVENTBATCH = _descriptor.Descriptor(
+  name='EventBatch',
+  full_name='rpipe.event.EventBatch',
+  filename=None,
+  file=DESCRIPTOR,
+  containing_type=None,
+  fields=[
+    _descriptor.FieldDescriptor(
+      name='version', full_name='rpipe.event.EventBatch.version', index=0,
+      number=1, type=13, cpp_type=3, label=2,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None),
+    _descriptor.FieldDescriptor(
+      name='events', full_name='rpipe.event.EventBatch.events', index=1,
+      number=2, type=11, cpp_type=10, label=3,
+      has_default_value=False, default_value=[],
       message_type=None, enum_type=None, containing_type=None,
       is_extension=False, extension_scope=None,
       options=None),
@@ -118,12 +160,58 @@ _EVENTREPLY = _descriptor.Descriptor(
   options=None,
   is_extendable=False,
   extension_ranges=[],
-  serialized_start=114,
-  serialized_end=189,
+  serialized_start=207,
+  serialized_end=272,
 )
 
+
+_EVENTBATCHREPLY = _descriptor.Descriptor(
+  name='EventBatchReply',
+  full_name='rpipe.event.EventBatchReply',
+  filename=None,
+  file=DESCRIPTOR,
+  containing_type=None,
+  fields=[
+    _descriptor.FieldDescriptor(
+      name='version', full_name='rpipe.event.EventBatchReply.version', index=0,
+      number=1, type=13, cpp_type=3, label=2,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None),
+    _descriptor.FieldDescriptor(
+      name='replies', full_name='rpipe.event.EventBatchReply.replies', index=1,
+      number=2, type=11, cpp_type=10, label=3,
+      has_default_value=False, default_value=[],
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None),
+    _descriptor.FieldDescriptor(
+      name='indices', full_name='rpipe.event.EventBatchReply.indices', index=2,
+      number=3, type=13, cpp_type=3, label=3,
+      has_default_value=False, default_value=[],
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None),
+  ],
+  extensions=[
+  ],
+  nested_types=[],
+  enum_types=[
+  ],
+  options=None,
+  is_extendable=False,
+  extension_ranges=[],
+  serialized_start=274,
+  serialized_end=367,
+)
+
+_EVENTBATCH.fields_by_name['events'].message_type = _EVENT
+_EVENTBATCHREPLY.fields_by_name['replies'].message_type = _EVENTREPLY
 DESCRIPTOR.message_types_by_name['Event'] = _EVENT
 DESCRIPTOR.message_types_by_name['EventReply'] = _EVENTREPLY
+DESCRIPTOR.message_types_by_name['EventBatch'] = _EVENTBATCH
+DESCRIPTOR.message_types_by_name['EventBatchReply'] = _EVENTBATCHREPLY
 
 class Event(_message.Message):
   __metaclass__ = _reflection.GeneratedProtocolMessageType
@@ -137,5 +225,17 @@ class EventReply(_message.Message):
 
   # @@protoc_insertion_point(class_scope:rpipe.event.EventReply)
 
+class EventBatch(_message.Message):
+  __metaclass__ = _reflection.GeneratedProtocolMessageType
+  DESCRIPTOR = _EVENTBATCH
+
+  # @@protoc_insertion_point(class_scope:rpipe.event.EventBatch)
+
+class EventBatchReply(_message.Message):
+  __metaclass__ = _reflection.GeneratedProtocolMessageType
+  DESCRIPTOR = _EVENTBATCHREPLY
+
+  # @@protoc_insertion_point(class_scope:rpipe.event.EventBatchReply)
+
 
 # @@protoc_insertion_point(module_scope)
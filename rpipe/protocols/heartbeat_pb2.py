@@ -13,11 +13,74 @@ from google.protobuf import descriptor_pb2
 DESCRIPTOR = _descriptor.FileDescriptor(
   name='heartbeat.proto',
   package='rpipe.support',
-  serialized_pb='\n\x0fheartbeat.proto\x12\rrpipe.support\"\x1c\n\tHeartbeat\x12\x0f\n\x07version\x18\x01 \x02(\r\"!\n\x0eHeartbeatReply\x12\x0f\n\x07version\x18\x01 \x02(\r')
+  serialized_pb='\n\x0fheartbeat.proto\x12\rrpipe.support\"\x89\x01\n\x05Hello\x12\x18\n\x10protocol_version\x18\x01 \x02(\r\x12\x10\n\x08identity\x18\x02 \x01(\t\x12\x17\n\x0fmax_frame_bytes\x18\x03 \x01(\r\x12\x19\n\x11max_message_bytes\x18\x04 \x01(\r\x12\x0e\n\x06\x63odecs\x18\x05 \x03(\t\x12\x10\n\x08\x66\x65\x61tures\x18\x06 \x03(\t\"A\n\tHeartbeat\x12\x0f\n\x07version\x18\x01 \x02(\r\x12#\n\x05hello\x18\x02 \x01(\x0b\x32\x14.rpipe.support.Hello\"F\n\x0eHeartbeatReply\x12\x0f\n\x07version\x18\x01 \x02(\r\x12#\n\x05hello\x18\x02 \x01(\x0b\x32\x14.rpipe.support.Hello')
 
 
 
 
+_HELLO = _descriptor.Descriptor(
+  name='Hello',
+  full_name='rpipe.support.Hello',
+  filename=None,
+  file=DESCRIPTOR,
+  containing_type=None,
+  fields=[
+    _descriptor.FieldDescriptor(
+      name='protocol_version', full_name='rpipe.support.Hello.protocol_version', index=0,
+      number=1, type=13, cpp_type=3, label=2,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None),
+    _descriptor.FieldDescriptor(
+      name='identity', full_name='rpipe.support.Hello.identity', index=1,
+      number=2, type=9, cpp_type=9, label=1,
+      has_default_value=False, default_value=unicode("", "utf-8"),
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None),
+    _descriptor.FieldDescriptor(
+      name='max_frame_bytes', full_name='rpipe.support.Hello.max_frame_bytes', index=2,
+      number=3, type=13, cpp_type=3, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None),
+    _descriptor.FieldDescriptor(
+      name='max_message_bytes', full_name='rpipe.support.Hello.max_message_bytes', index=3,
+      number=4, type=13, cpp_type=3, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None),
+    _descriptor.FieldDescriptor(
+      name='codecs', full_name='rpipe.support.Hello.codecs', index=4,
+      number=5, type=9, cpp_type=9, label=3,
+      has_default_value=False, default_value=[],
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None),
+    _descriptor.FieldDescriptor(
+      name='features', full_name='rpipe.support.Hello.features', index=5,
+      number=6, type=9, cpp_type=9, label=3,
+      has_default_value=False, default_value=[],
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None),
+  ],
+  extensions=[
+  ],
+  nested_types=[],
+  enum_types=[
+  ],
+  options=None,
+  is_extendable=False,
+  extension_ranges=[],
+  serialized_start=35,
+  serialized_end=172,
+)
+
+
 _HEARTBEAT = _descriptor.Descriptor(
   name='Heartbeat',
   full_name='rpipe.support.Heartbeat',
@@ -32,6 +95,13 @@ _HEARTBEAT = _descriptor.Descriptor(
       message_type=None, enum_type=None, containing_type=None,
       is_extension=False, extension_scope=None,
       options=None),
+    _descriptor.FieldDescriptor(
+      name='hello', full_name='rpipe.support.Heartbeat.hello', index=1,
+      number=2, type=11, cpp_type=10, label=1,
+      has_default_value=False, default_value=None,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None),
   ],
   extensions=[
   ],
@@ -41,8 +111,8 @@ _HEARTBEAT = _descriptor.Descriptor(
   options=None,
   is_extendable=False,
   extension_ranges=[],
-  serialized_start=34,
-  serialized_end=62,
+  serialized_start=174,
+  serialized_end=239,
 )
 
 
@@ -60,6 +130,13 @@ _HEARTBEATREPLY = _descriptor.Descriptor(
       message_type=None, enum_type=None, containing_type=None,
       is_extension=False, extension_scope=None,
       options=None),
+    _descriptor.FieldDescriptor(
+      name='hello', full_name='rpipe.support.HeartbeatReply.hello', index=1,
+      number=2, type=11, cpp_type=10, label=1,
+      has_default_value=False, default_value=None,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None),
   ],
   extensions=[
   ],
@@ -69,13 +146,22 @@ _HEARTBEATREPLY = _descriptor.Descriptor(
   options=None,
   is_extendable=False,
   extension_ranges=[],
-  serialized_start=64,
-  serialized_end=97,
+  serialized_start=241,
+  serialized_end=311,
 )
 
+_HEARTBEAT.fields_by_name['hello'].message_type = _HELLO
+_HEARTBEATREPLY.fields_by_name['hello'].message_type = _HELLO
+DESCRIPTOR.message_types_by_name['Hello'] = _HELLO
 DESCRIPTOR.message_types_by_name['Heartbeat'] = _HEARTBEAT
 DESCRIPTOR.message_types_by_name['HeartbeatReply'] = _HEARTBEATREPLY
 
+class Hello(_message.Message):
+  __metaclass__ = _reflection.GeneratedProtocolMessageType
+  DESCRIPTOR = _HELLO
+
+  # @@protoc_insertion_point(class_scope:rpipe.support.Hello)
+
 class Heartbeat(_message.Message):
   __metaclass__ = _reflection.GeneratedProtocolMessageType
   DESCRIPTOR = _HEARTBEAT
@@ -0,0 +1,94 @@
+import logging
+import collections
+import time
+
+import rpipe.config.statsd
+import rpipe.stats
+
+_logger = logging.getLogger(__name__)
+
+
+class ResponseCache(object):
+    """Encoded replies for one route, bounded by age, count, and bytes. The
+    least-recently used entries are evicted first.
+    """
+
+    def __init__(self, name, ttl_s, max_entries, max_bytes):
+        self.__ttl_s = ttl_s
+        self.__max_entries = max_entries
+        self.__max_bytes = max_bytes
+
+        # key => (expires_at_epoch, reply)
+        self.__entries = collections.OrderedDict()
+        self.__bytes = 0
+
+        self.__hit_name = \
+            rpipe.config.statsd.EVENT_HANDLER_CACHE_HIT_TEMPLATE % \
+            { 'handler_name': name }
+
+        self.__miss_name = \
+            rpipe.config.statsd.EVENT_HANDLER_CACHE_MISS_TEMPLATE % \
+            { 'handler_name': name }
+
+        self.__evict_name = \
+            rpipe.config.statsd.EVENT_HANDLER_CACHE_EVICT_TEMPLATE % \
+            { 'handler_name': name }
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def get(self, key):
+        """Return the cached reply, or None."""
+
+        try:
+            (expires_at_epoch, reply) = self.__entries.pop(key)
+        except KeyError:
+            rpipe.stats.post_to_counter(self.__miss_name)
+            return None
+
+        if expires_at_epoch <= time.time():
+            self.__bytes -= self.__get_size(reply)
+            rpipe.stats.post_to_counter(self.__miss_name)
+            return None
+
+        # Reinsert, to mark it as the most-recently used.
+        self.__entries[key] = (expires_at_epoch, reply)
+
+        rpipe.stats.post_to_counter(self.__hit_name)
+        return reply
+
+    def set(self, key, reply):
+        size = self.__get_size(reply)
+        if size > self.__max_bytes:
+            _logger.debug("Reply of (%d) bytes is too large to cache.", size)
+            return
+
+        try:
+            (expires_at_epoch, previous_reply) = self.__entries.pop(key)
+        except KeyError:
+            pass
+        else:
+            self.__bytes -= self.__get_size(previous_reply)
+
+        self.__entries[key] = (time.time() + self.__ttl_s, reply)
+        self.__bytes += size
+
+        evicted = 0
+        while len(self.__entries) > self.__max_entries or \
+              self.__bytes > self.__max_bytes:
+            (evicted_key, (expires_at_epoch, evicted_reply)) = \
+                self.__entries.popitem(last=False)
+
+            self.__bytes -= self.__get_size(evicted_reply)
+            evicted += 1
+
+        if evicted > 0:
+            rpipe.stats.post_to_counter(self.__evict_name, evicted)
+
+    def clear(self):
+        self.__entries.clear()
+        self.__bytes = 0
+
+    def __get_size(self, reply):
+        (code, mimetype, data) = reply
+        return len(data)
@@ -0,0 +1,274 @@
+"""Routing of events to event-handler methods. Each event-handler class is
+introspected once into a table, so that dispatching an event is a dictionary
+lookup rather than string-building and getattr().
+
+By default, a "<verb>" event for noun "<a>/<b>" is handled by the method named
+"<verb>_<a>_<b>" (for the verbs in EVENT_VERBS). Methods may also be routed 
+explicitly, and have their parameters (the parts of the noun after the "//") 
+converted, with the route() decorator. The replies of idempotent GET routes 
+may be cached with the cached() decorator.
+
+Handlers are always invoked through the event-handler instance, so static and 
+class methods work, and handlers that only exist on the instance (or come 
+from __getattr__()) are still found by name, just without the table.
+"""
+
+import logging
+import inspect
+import collections
+
+import rpipe.config.protocol
+import rpipe.config.statsd
+import rpipe.response_cache
+
+_logger = logging.getLogger(__name__)
+
+# The arguments that every handler receives ahead of the parameters: self, the
+# connection context, and the (mimetype, data) 2-tuple.
+_LEADING_ARGUMENT_COUNT = 3
+
+_ROUTES_ATTRIBUTE = '_rp_routes'
+_CACHE_ATTRIBUTE = '_rp_cache'
+
+# The configuration of a route's response cache.
+_CACHE_CONFIG_T = collections.namedtuple(
+                    '_CACHE_CONFIG_T', 
+                    ['ttl_s', 'max_entries', 'max_bytes', 'per_connection'])
+
+def get_handler_name(verb, noun_path):
+    return verb.lower() + '_' + noun_path.replace('/', '_')
+
+def _is_conventional_name(name):
+    (verb, _, noun_path) = name.partition('_')
+    return verb in rpipe.config.protocol.EVENT_VERBS and noun_path != ''
+
+def route(verb=None, noun=None, **converters):
+    """Route the given verb and noun to the decorated method, in addition to
+    its conventional name. The keyword arguments map parameter names to
+    callables that convert them (e.g. int). If no verb and noun are given,
+    only the converters are applied to the method's conventional route.
+    """
+
+    if (verb is None) != (noun is None):
+        raise ValueError("A route needs both a verb and a noun, or neither.")
+
+    def decorator(method):
+        routes = method.__dict__.setdefault(_ROUTES_ATTRIBUTE, [])
+        routes.append((verb, noun, converters))
+
+        return method
+
+    return decorator
+
+def cached(ttl_s, max_entries=None, max_bytes=None, per_connection=True):
+    """Cache the (encoded) replies of the decorated method, for GET events 
+    only. Replies are keyed by the parameters, data, and requested encoding, 
+    and, unless per_connection is False, the connection that the event 
+    arrived on. Only pass False if the reply doesn't depend on who is asking. 
+    Only successful replies are cached.
+    """
+
+    if max_entries is None:
+        max_entries = rpipe.config.protocol.RESPONSE_CACHE_MAX_ENTRIES
+
+    if max_bytes is None:
+        max_bytes = rpipe.config.protocol.RESPONSE_CACHE_MAX_BYTES
+
+    def decorator(method):
+        setattr(
+            method, 
+            _CACHE_ATTRIBUTE, 
+            _CACHE_CONFIG_T(ttl_s, max_entries, max_bytes, per_connection))
+
+        return method
+
+    return decorator
+
+
+class Route(object):
+    def __init__(self, name, attribute_name, method, converters=None):
+        """The method is the attribute as found on the class (or instance), 
+        which is only used to read its decorations and arguments.
+        """
+
+        self.name = name
+        self.attribute_name = attribute_name
+        self.method = method
+        self.hit_count = 0
+
+        cache_config = getattr(method, _CACHE_ATTRIBUTE, None)
+        if cache_config is not None:
+            self.cache = rpipe.response_cache.ResponseCache(
+                            name,
+                            cache_config.ttl_s, 
+                            cache_config.max_entries, 
+                            cache_config.max_bytes)
+
+            self.cache_per_connection = cache_config.per_connection
+        else:
+            self.cache = None
+            self.cache_per_connection = False
+
+        self.tick_name = rpipe.config.statsd.EVENT_HANDLER_TICK_TEMPLATE % \
+                         { 'handler_name': name }
+
+        self.timing_name = \
+            rpipe.config.statsd.EVENT_HANDLER_TIMING_TEMPLATE % \
+            { 'handler_name': name }
+
+        # A list of converters by parameter position (None where there isn't
+        # one), or None if no parameters are converted.
+        self.__converters = None
+
+        if converters:
+            # A static method (or anything else that isn't a method) doesn't 
+            # take "self".
+            leading_count = _LEADING_ARGUMENT_COUNT
+            if inspect.ismethod(method) is False:
+                leading_count -= 1
+
+            argument_names = inspect.getargspec(method).args
+            parameter_names = argument_names[leading_count:]
+
+            unknown = set(converters.keys()) - set(parameter_names)
+            if unknown:
+                raise ValueError("Route [%s] has converters for parameters "
+                                 "that [%s] doesn't take: %s" %
+                                 (name, method.__name__, sorted(unknown)))
+
+            self.__converters = [converters.get(parameter_name)
+                                 for parameter_name
+                                 in parameter_names]
+
+    def __repr__(self):
+        return ('<Route %s -> %s>' % (self.name, self.attribute_name))
+
+    def convert_parameters(self, parameters):
+        if self.__converters is None:
+            return parameters
+
+        converted = []
+        for i, parameter in enumerate(parameters):
+            if i < len(self.__converters) and \
+               self.__converters[i] is not None:
+                parameter = self.__converters[i](parameter)
+
+            converted.append(parameter)
+
+        return converted
+
+    def invoke(self, event_handler, ctx, post_data, parameters):
+        parameters = self.convert_parameters(parameters)
+        handler = getattr(event_handler, self.attribute_name)
+
+        return handler(ctx, post_data, *parameters)
+
+
+class RouteTable(object):
+    """The routes of one event-handler class."""
+
+    def __init__(self, event_handler_cls):
+        self.__routes = {}
+
+        # Resolved (verb, noun-path) pairs, so that repeated events skip even
+        # the handler-name normalization.
+        self.__resolved = {}
+
+        for attribute_name in dir(event_handler_cls):
+            if attribute_name.startswith('_') is True:
+                continue
+
+            method = getattr(event_handler_cls, attribute_name)
+            if callable(method) is False:
+                continue
+
+            conventional_converters = None
+            for (verb, noun, converters) in \
+                    getattr(method, _ROUTES_ATTRIBUTE, []):
+                if verb is None:
+                    conventional_converters = converters
+                    continue
+
+                name = get_handler_name(verb, noun)
+                self.__routes[name] = Route(
+                                        name, 
+                                        attribute_name, 
+                                        method, 
+                                        converters)
+
+            if _is_conventional_name(attribute_name) is True and \
+               attribute_name not in self.__routes:
+                self.__routes[attribute_name] = Route(
+                                                    attribute_name,
+                                                    attribute_name,
+                                                    method,
+                                                    conventional_converters)
+
+        _logger.debug("Built route table for [%s]: (%d) routes",
+                      event_handler_cls.__name__, len(self.__routes))
+
+    def __len__(self):
+        return len(self.__routes)
+
+    def lookup(self, verb, noun, event_handler=None):
+        """Return a 2-tuple of the route and the (unconverted) parameters.
+        If the class doesn't have a handler, but the given event-handler 
+        instance does, a route is made for it on the spot. Raise LookupError 
+        if nothing handles the event.
+        """
+
+        url_parts = noun.split('//')
+
+        noun_path = url_parts[0]
+        if len(url_parts) > 1:
+            parameters = url_parts[1].split('/')
+        else:
+            parameters = []
+
+        key = (verb, noun_path)
+
+        try:
+            route_ = self.__resolved[key]
+        except KeyError:
+            name = get_handler_name(verb, noun_path)
+
+            try:
+                route_ = self.__routes[name]
+            except KeyError:
+                return (self.__get_instance_route(name, event_handler), 
+                        parameters)
+
+            if len(self.__resolved) < \
+                    rpipe.config.protocol.ROUTE_RESOLVED_CACHE_MAX_ENTRIES:
+                self.__resolved[key] = route_
+
+        route_.hit_count += 1
+
+        return (route_, parameters)
+
+    def __get_instance_route(self, name, event_handler):
+        if event_handler is None or _is_conventional_name(name) is False:
+            raise LookupError(name)
+
+        method = getattr(event_handler, name, None)
+        if method is None or callable(method) is False:
+            raise LookupError(name)
+
+        return Route(name, name, method)
+
+    @property
+    def routes(self):
+        return self.__routes.values()
+
+_tables = {}
+
+def get_route_table(event_handler_cls):
+    """Return the (shared) route table for the given event-handler class."""
+
+    try:
+        return _tables[event_handler_cls]
+    except KeyError:
+        table = RouteTable(event_handler_cls)
+        _tables[event_handler_cls] = table
+
+        return table
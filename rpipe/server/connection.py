@@ -6,16 +6,20 @@ import time
 import socket
 
 import gevent
+import gevent.event
 import gevent.server
 import gevent.ssl
 
 import rpipe.config.server
+import rpipe.config.statsd
 import rpipe.server.exceptions
 import rpipe.utility
 import rpipe.protocol
 import rpipe.connection
 import rpipe.request_server
 import rpipe.message_loop
+import rpipe.message_exchange
+import rpipe.stats
 
 _logger = logging.getLogger(__name__)
 
@@ -34,59 +38,234 @@ class TestServerEventHandler(ServerEventHandler):
         return { 'result_from_server': str(x) + str(y) }
 
 
+# The indexes of the connection catalog.
+IDX_IDENTITY = 'identity'
+IDX_IP = 'ip'
+IDX_HOSTNAME = 'hostname'
+
+
 class _ConnectionCatalog(object):
-    """Keep track of connections and their IPs. This is the principle reason 
-    that no two clients can connect from the same host.
+    """Keep track of connections, indexed by client identity (the CN of its 
+    certificate, else the name that it announces in its hello, else its IP), 
+    and by IP and hostname. Several clients can connect from the same IP 
+    (e.g. behind NAT), and a client may have several connections (a pool of 
+    pipes). Requests for a client are sent on whichever of its connections 
+    has the fewest replies outstanding.
+
+    An announced name isn't authenticated, so it's only used for a client 
+    without a CN, and never for a name that a connected client's certificate 
+    claims.
     """
 
     def __init__(self):
-        self.__connections = {}
+        # index => key => [connection, ...]
+        self.__indexes = {
+            IDX_IDENTITY: {},
+            IDX_IP: {},
+            IDX_HOSTNAME: {},
+        }
+
+        # id(connection) => [(index, key), ...], as registered (the identity 
+        # can change once the hello arrives).
+        self.__registered_keys = {}
+
+        # (index, key) => [event, waiter-count]
+        self.__waiters = {}
+
+        # Lowercased CN => number of registered connections with it.
+        self.__certificate_names = {}
+
+    def __get_name(self, c):
+        """The (authenticated or unclaimed) name to index the client by, or 
+        None.
+        """
+
+        if c.certificate_cn is not None:
+            announced_identity = c.announced_identity
+            if announced_identity is not None and \
+               announced_identity.lower() != c.certificate_cn.lower():
+                _logger.warning("Client [%s] announced a different name "
+                                "than its certificate: [%s]. Ignoring it.", 
+                                c.certificate_cn, announced_identity)
+
+            return c.certificate_cn
+
+        announced_identity = c.announced_identity
+        if announced_identity is None:
+            return None
+
+        if announced_identity.lower() in self.__certificate_names:
+            _logger.warning("Client at [%s] announced a name that belongs to "
+                            "a certificate: [%s]. Ignoring it.", 
+                            c.ip, announced_identity)
 
-    def register(self, c):
+            return None
+
+        return announced_identity
+
+    def __get_keys(self, c):
+        name = self.__get_name(c)
+
+        keys = [(IDX_IDENTITY, name or c.ip), 
+                (IDX_IP, c.ip)]
+
+        if name is not None:
+            keys.append((IDX_HOSTNAME, name.lower()))
+
+        return keys
+
+    def register(self, c, keys=None):
 # TODO(dustin): Connections are not being cleaned-up quick enough, and this 
 #               presents reliability problems in multiple different ways.
-        if c in self.__connections:
-            raise ValueError("Can not register already-registered connection. "
-                             "A previous connection from this client might "
-                             "not've been deregistered [properly]: %s" % 
-                             (c.ip))
+        if id(c) in self.__registered_keys:
+            raise ValueError("Can not register already-registered connection: "
+                             "%s" % (c.address,))
+
+        if keys is None:
+            keys = self.__get_keys(c)
 
-        _logger.debug("Registering client: [%s]", c.ip)
+        _logger.debug("Registering client: [%s] %s", c.identity, keys)
 
-        # These are actually indexed by address (so we can find it either 
-        # with a conneciton object -or- an address).
-        self.__connections[c] = c
+        for (index, key) in keys:
+            self.__indexes[index].setdefault(key, []).append(c)
+
+        self.__registered_keys[id(c)] = keys
+
+        if c.certificate_cn is not None:
+            self.__claim_name(c.certificate_cn.lower())
+
+        # Wake anybody waiting on this client.
+        for index_key in keys:
+            waiter = self.__waiters.pop(index_key, None)
+            if waiter is not None:
+                waiter[0].set()
+
+    def __claim_name(self, name):
+        """A certificate has this name. Unindex any client that only 
+        announced it.
+        """
+
+        self.__certificate_names[name] = \
+            self.__certificate_names.get(name, 0) + 1
+
+        squatters = [pipe
+                     for pipe
+                     in self.__indexes[IDX_HOSTNAME].get(name, [])
+                     if pipe.certificate_cn is None]
+
+        for pipe in squatters:
+            self.update(pipe)
 
     def deregister(self, c):
-        if c not in self.__connections:
+        try:
+            keys = self.__registered_keys.pop(id(c))
+        except KeyError:
             raise ValueError("Can not deregister unregistered connection: %s" %
-                             (c.ip))
+                             (c.address,))
+
+        _logger.debug("Deregistering client: [%s]", c.identity)
+
+        if c.certificate_cn is not None:
+            name = c.certificate_cn.lower()
+
+            self.__certificate_names[name] -= 1
+            if self.__certificate_names[name] == 0:
+                del self.__certificate_names[name]
+
+        for (index, key) in keys:
+            pipes = self.__indexes[index][key]
+
+            for i, pipe in enumerate(pipes):
+                if pipe is c:
+                    del pipes[i]
+                    break
 
-        _logger.debug("Deregistering client: [%s]", c.ip)
-        del self.__connections[c]
+            if not pipes:
+                del self.__indexes[index][key]
+
+    def update(self, c):
+        """Reindex the connection (e.g. it has announced its name)."""
+
+        registered_keys = self.__registered_keys.get(id(c))
+        if registered_keys is None:
+            return
+
+        keys = self.__get_keys(c)
+        if keys != registered_keys:
+            self.deregister(c)
+            self.register(c, keys=keys)
+
+    def get_connections(self, key, index=IDX_IDENTITY):
+        """Return all of the client's connections."""
+
+        return list(self.__indexes[index][key])
+
+    def get_connection(self, key, index=IDX_IDENTITY):
+        """Return the client's least-busy connection. Raise KeyError if it's 
+        not connected.
+        """
+
+        pipes = self.__indexes[index][key]
+        if len(pipes) == 1:
+            return pipes[0]
+
+        return min(pipes, key=lambda pipe: pipe.in_flight_count)
+
+    def get_connections_by_ip(self, ip):
+        return self.get_connections(ip, IDX_IP)
 
     def get_connection_by_ip(self, ip):
-        return self.__connections[ip]
+        return self.get_connection(ip, IDX_IP)
+
+    def get_connection_by_hostname(self, hostname):
+        return self.get_connection(hostname.lower(), IDX_HOSTNAME)
 
     def wait_for_connection(
             self, 
-            ip, 
-            timeout_s=rpipe.config.server.DEFAULT_CONNECTION_WAIT_TIMEOUT_S):
+            key, 
+            timeout_s=rpipe.config.server.DEFAULT_CONNECTION_WAIT_TIMEOUT_S,
+            index=IDX_IDENTITY):
         """A convenience function to wait for a client to connect (if not 
         immediately available). This is to be used when we might need to wait 
-        for a client to reconnect in order to fulfill a request.
+        for a client to reconnect in order to fulfill a request. We're woken 
+        as soon as it registers.
         """
 
+        if index == IDX_HOSTNAME:
+            key = key.lower()
+
         stop_at = time.time() + timeout_s
-        while time.time() <= stop_at:
+        while 1:
             try:
-                return self.__connections[ip]
+                return self.get_connection(key, index)
             except KeyError:
                 pass
 
-            gevent.sleep(1)
+            remaining_s = stop_at - time.time()
+            if remaining_s <= 0:
+                break
+
+            index_key = (index, key)
+            waiter = self.__waiters.get(index_key)
+            if waiter is None:
+                waiter = [gevent.event.Event(), 0]
+                self.__waiters[index_key] = waiter
 
-        raise rpipe.server.exceptions.RpNoConnectionException(ip)
+            waiter[1] += 1
+
+            try:
+                waiter[0].wait(timeout=remaining_s)
+            finally:
+                waiter[1] -= 1
+
+                # Nobody is waiting on it anymore (and it wasn't woken).
+                if waiter[1] == 0 and self.__waiters.get(index_key) is waiter:
+                    del self.__waiters[index_key]
+
+        raise rpipe.server.exceptions.RpNoConnectionException(key)
+
+    def __len__(self):
+        return len(self.__registered_keys)
 
 
 class ServerConnectionHandler(rpipe.connection.Connection):
@@ -98,18 +277,7 @@ class DefaultServerConnectionHandler(ServerConnectionHandler):
     def __init__(self):
         self.__ws = None
         self.__address = None
-
-    def __hash__(self):
-        if self.ip is None:
-            raise ValueError("Can not hash an unconnected connection object.")
-
-        return hash(self.ip)
-
-    def __eq__(self, o):
-        if o is None:
-            return False
-
-        return hash(self) == hash(o)
+        self.__certificate_cn = None
 
     def handle_new_connection(self, socket, address):
         """We've received a new connection."""
@@ -117,6 +285,7 @@ class DefaultServerConnectionHandler(ServerConnectionHandler):
         self.__ws = rpipe.protocol.SocketWrapper(socket, socket.makefile())
         self.__address = address
         self.__ctx = rpipe.message_loop.CONNECTION_CONTEXT_T(self.__address)
+        self.__certificate_cn = _get_certificate_cn(socket)
 
         get_connection_catalog().register(self)
 
@@ -137,17 +306,27 @@ class DefaultServerConnectionHandler(ServerConnectionHandler):
                 self.__ws, 
                 eh, 
                 self.__ctx, 
-                watch_heartbeats=True)
+                watch_heartbeats=True,
+                identity=rpipe.config.server.IDENTITY,
+                hello_cb=self.__hello_received)
 
         try:
             cml.handle(exit_on_unknown=True)
         finally:
             self.handle_close()
 
+    def __hello_received(self, capabilities):
+        # The client might have announced its name.
+        get_connection_catalog().update(self)
+
     def initiate_message(self, message_obj, **kwargs):
         # This only works because the CommonMessageLoop has already registered 
         # the other participant with the MessageExchange.
-        return rpipe.message_exchange.send_and_receive(self.__address, message_obj)
+        return rpipe.message_exchange.send_and_receive(
+                self.__address, 
+                message_obj, 
+                timeout=kwargs.get('timeout'),
+                priority=kwargs.get('priority'))
 
     @property
     def socket(self):
@@ -157,10 +336,59 @@ class DefaultServerConnectionHandler(ServerConnectionHandler):
     def address(self):
         return self.__address
 
+    @property
+    def peer_capabilities(self):
+        """What the client advertised in its hello (None if it didn't)."""
+
+        return rpipe.message_exchange.get_exchange(self.__address).\
+                peer_capabilities
+
+    @property
+    def in_flight_count(self):
+        """The number of replies that we're waiting on from the client."""
+
+        try:
+            exchange = rpipe.message_exchange.get_exchange(self.__address)
+        except KeyError:
+            return 0
+
+        return exchange.in_flight_count
+
     @property
     def ip(self):
         return self.__address[0]
 
+    @property
+    def announced_identity(self):
+        """The name that the client gave in its hello, or None."""
+
+        try:
+            capabilities = rpipe.message_exchange.get_exchange(
+                            self.__address).peer_capabilities
+        except KeyError:
+            return None
+
+        if capabilities is None:
+            return None
+
+        return capabilities['identity']
+
+    @property
+    def certificate_cn(self):
+        """The CN of the client's certificate, or None."""
+
+        return self.__certificate_cn
+
+    @property
+    def identity(self):
+        """The CN of the client's certificate, else the name that it 
+        announced, else its IP.
+        """
+
+        return self.__certificate_cn or \
+               self.announced_identity or \
+               self.ip
+
 
 class Server(rpipe.request_server.RequestServer):
     def __init__(self):
@@ -171,22 +399,96 @@ class Server(rpipe.request_server.RequestServer):
 
         assert issubclass(self.__connection_handler_cls, ServerConnectionHandler)
 
+        self.__ssl_context = _get_ssl_context()
+
+        # The connections accepted in the current storm window.
+        self.__storm_started_at = 0
+        self.__storm_size = 0
+
+    def __wrap_socket(self, raw_socket):
+        if self.__ssl_context is not None:
+            return self.__ssl_context.wrap_socket(raw_socket, server_side=True)
+
+        return gevent.ssl.wrap_socket(
+                raw_socket,
+                server_side=True,
+                cert_reqs=gevent.ssl.CERT_REQUIRED,
+                keyfile=rpipe.config.server.KEY_FILEPATH,
+                certfile=rpipe.config.server.CRT_FILEPATH,
+                ca_certs=rpipe.config.server.CA_CRT_FILEPATH)
+
+    def __count_new_connection(self):
+        """Track how many clients (re)connect at once (e.g. after a 
+        restart).
+        """
+
+        rpipe.stats.post_to_counter(
+            rpipe.config.statsd.EVENT_CONNECTION_SERVER_NEW_TICK)
+
+        now = time.time()
+        if now - self.__storm_started_at >= \
+                rpipe.config.server.RECONNECT_STORM_WINDOW_S:
+            self.__storm_started_at = now
+            self.__storm_size = 0
+
+        self.__storm_size += 1
+
+        rpipe.stats.post_to_gauge(
+            rpipe.config.statsd.EVENT_CONNECTION_SERVER_STORM_SIZE_GAUGE,
+            self.__storm_size)
+
+    def __handle_new_connection(self, raw_socket, address):
+        self.__count_new_connection()
+
+        # We do the handshake here (rather than letting the StreamServer do 
+        # it) so that we can time it.
+        start_epoch = time.time()
+
+        timeout = gevent.Timeout(
+                    rpipe.config.server.HANDSHAKE_TIMEOUT_S, 
+                    socket.timeout("Handshake timed-out."))
+
+        timeout.start()
+
+        try:
+            ss = self.__wrap_socket(raw_socket)
+        except (gevent.ssl.SSLError, socket.error):
+            _logger.exception("Handshake with [%s] failed.", address)
+
+            rpipe.stats.post_to_counter(
+                rpipe.config.statsd.EVENT_CONNECTION_SERVER_HANDSHAKE_FAIL_TICK)
+
+            raw_socket.close()
+            return
+        finally:
+            timeout.cancel()
+
+        rpipe.stats.post_timing(
+            rpipe.config.statsd.EVENT_CONNECTION_SERVER_HANDSHAKE_TIMING,
+            (time.time() - start_epoch) * 1000.0)
+
+        # Only reported where the SSL module can tell us.
+        if getattr(ss, 'session_reused', False) is True:
+            rpipe.stats.post_to_counter(
+                rpipe.config.statsd.\
+                    EVENT_CONNECTION_SERVER_HANDSHAKE_RESUMED_TICK)
+
+        # Each connection gets its own handler, since it holds the 
+        # connection's state (and a client may have several connections).
+        handler = self.__connection_handler_cls()
+        handler.handle_new_connection(ss, address)
+
     def process_requests(self):
         binding = (rpipe.config.server.BIND_IP, 
                    rpipe.config.server.BIND_PORT)
 
         _logger.info("Running server: %s", binding)
 
-        handler = self.__connection_handler_cls()
 # TODO(dustin): We need to have a watchdog process, to raise an error if nothing is connected.
 # TODO(dustin): We need to debug what is dying or blocking the flow. Is it StreamServer?
         server = gevent.server.StreamServer(
                     binding, 
-                    handler.handle_new_connection, 
-                    cert_reqs=gevent.ssl.CERT_REQUIRED,
-                    keyfile=rpipe.config.server.KEY_FILEPATH,
-                    certfile=rpipe.config.server.CRT_FILEPATH,
-                    ca_certs=rpipe.config.server.CA_CRT_FILEPATH)
+                    self.__handle_new_connection)
 
         # Wait until termination. Generally, we should already be running in 
         # its own gthread. 
@@ -195,6 +497,49 @@ class Server(rpipe.request_server.RequestServer):
         # default CTRL+BREAK and SIGTERM handling should be fine.
         server.serve_forever()
 
+def _get_certificate_cn(ss):
+    """Return the common-name from the client's certificate, or None."""
+
+    try:
+        certificate = ss.getpeercert()
+    except (AttributeError, ValueError):
+        return None
+
+    if not certificate:
+        return None
+
+    for rdn in certificate.get('subject', ()):
+        for (name, value) in rdn:
+            if name == 'commonName':
+                return value
+
+    return None
+
+def _get_ssl_context():
+    """Return a context that's shared by every connection, so that the 
+    certificates are only loaded once and sessions can be resumed for clients 
+    that offer one (from the context's session cache, or by ticket). Older versions of gevent don't 
+    have contexts, so we return None and wrap each socket from scratch.
+    """
+
+    ssl_context_cls = getattr(gevent.ssl, 'SSLContext', None)
+    if ssl_context_cls is None:
+        _logger.warning("SSL contexts are not supported. TLS sessions won't "
+                        "be resumed.")
+
+        return None
+
+    context = ssl_context_cls(gevent.ssl.PROTOCOL_SSLv23)
+    context.verify_mode = gevent.ssl.CERT_REQUIRED
+
+    context.load_cert_chain(
+        rpipe.config.server.CRT_FILEPATH, 
+        keyfile=rpipe.config.server.KEY_FILEPATH)
+
+    context.load_verify_locations(rpipe.config.server.CA_CRT_FILEPATH)
+
+    return context
+
 _cc = _ConnectionCatalog()
 
 def get_connection_catalog():
@@ -0,0 +1,187 @@
+"""A hierarchical timing wheel, so that the deadlines of every connection
+(heartbeat watchdogs, heartbeat schedules) are tracked by a single gthread
+rather than a sleeping gthread or timer each.
+
+Level 0 has one slot per tick. Each slot of a higher level spans a full
+rotation of the level below it. Timers are placed on the lowest level that
+can hold them, and cascade down as their deadline approaches, so scheduling
+and cancelling are O(1).
+"""
+
+import logging
+import math
+import time
+
+import gevent
+
+import rpipe.config.protocol
+import rpipe.config.statsd
+import rpipe.stats
+
+_logger = logging.getLogger(__name__)
+
+
+class Timer(object):
+    """A handle on a scheduled callback."""
+
+    def __init__(self, wheel, deadline_tick, callback, args):
+        self.__wheel = wheel
+        self.deadline_tick = deadline_tick
+        self.callback = callback
+        self.args = args
+        self.is_active = True
+
+    def cancel(self):
+        """Cancel the timer, if it hasn't already fired."""
+
+        if self.is_active is True:
+            self.is_active = False
+            self.__wheel.notify_cancelled()
+
+    def reset(self, delay_s):
+        """Cancel the timer and return a new one for the same callback."""
+
+        self.cancel()
+        return self.__wheel.schedule(delay_s, self.callback, *self.args)
+
+
+class TimerWheel(object):
+    def __init__(self, tick_s, slot_count, level_count):
+        self.__tick_s = tick_s
+        self.__slot_count = slot_count
+        self.__level_count = level_count
+
+        self.__levels = [[[] for j in range(slot_count)]
+                         for i in range(level_count)]
+
+        # The number of ticks that each slot spans, per level.
+        self.__spans = [slot_count ** i for i in range(level_count)]
+
+        self.__epoch = time.time()
+        self.__current_tick = 0
+        self.__active_count = 0
+        self.__g = None
+
+    def __len__(self):
+        """The number of timers that are waiting to fire."""
+
+        return self.__active_count
+
+    def start(self):
+        assert self.__g is None
+
+        self.__epoch = time.time()
+        self.__current_tick = 0
+        self.__g = gevent.spawn(self.__run)
+
+    def stop(self):
+        if self.__g is not None:
+            self.__g.kill()
+            self.__g = None
+
+    def schedule(self, delay_s, callback, *args):
+        """Invoke the callback (from the wheel's gthread) after the delay. The
+        callback must not block. Return a Timer.
+        """
+
+        elapsed_ticks = (time.time() - self.__epoch + delay_s) / self.__tick_s
+        deadline_tick = max(self.__current_tick + 1,
+                            int(math.ceil(elapsed_ticks)))
+
+        timer = Timer(self, deadline_tick, callback, args)
+
+        self.__place(timer)
+        self.__active_count += 1
+
+        return timer
+
+    def notify_cancelled(self):
+        # Cancelled timers are left in their slots, and discarded when they're
+        # reached.
+        self.__active_count -= 1
+
+    def __place(self, timer):
+        remaining_ticks = timer.deadline_tick - self.__current_tick
+
+        for level in range(self.__level_count):
+            if remaining_ticks < self.__spans[level] * self.__slot_count:
+                break
+
+        # Beyond the range of the top level, it'll just be placed again once
+        # it's reached.
+        slot = (timer.deadline_tick // self.__spans[level]) % self.__slot_count
+        self.__levels[level][slot].append(timer)
+
+    def __run(self):
+        while 1:
+            next_tick_epoch = self.__epoch + \
+                              (self.__current_tick + 1) * self.__tick_s
+
+            gevent.sleep(max(0, next_tick_epoch - time.time()))
+
+            # Catch up, if we fell behind.
+            now_tick = int((time.time() - self.__epoch) / self.__tick_s)
+            while self.__current_tick < now_tick:
+                self.__advance()
+
+    def __advance(self):
+        self.__current_tick += 1
+
+        # Bring down anything whose higher-level slot is now current.
+        for level in range(1, self.__level_count):
+            if self.__current_tick % self.__spans[level] != 0:
+                break
+
+            slot = (self.__current_tick // self.__spans[level]) % \
+                   self.__slot_count
+
+            timers = self.__levels[level][slot]
+            self.__levels[level][slot] = []
+
+            for timer in timers:
+                if timer.is_active is True:
+                    self.__place(timer)
+
+        if self.__current_tick % self.__slot_count == 0:
+            rpipe.stats.post_to_gauge(
+                rpipe.config.statsd.EVENT_TIMER_WHEEL_TIMERS_GAUGE,
+                self.__active_count)
+
+        slot = self.__current_tick % self.__slot_count
+
+        timers = self.__levels[0][slot]
+        self.__levels[0][slot] = []
+
+        for timer in timers:
+            if timer.is_active is False:
+                continue
+
+            if timer.deadline_tick > self.__current_tick:
+                self.__place(timer)
+                continue
+
+            timer.is_active = False
+            self.__active_count -= 1
+
+            try:
+                timer.callback(*timer.args)
+            except:
+                _logger.exception("Timer callback failed: [%s]",
+                                  timer.callback)
+
+_wheel = None
+
+def get_timer_wheel():
+    """Return the shared timer wheel, starting it if necessary."""
+
+    global _wheel
+
+    if _wheel is None:
+        _wheel = TimerWheel(
+                    rpipe.config.protocol.TIMER_WHEEL_TICK_S,
+                    rpipe.config.protocol.TIMER_WHEEL_SLOT_COUNT,
+                    rpipe.config.protocol.TIMER_WHEEL_LEVEL_COUNT)
+
+        _wheel.start()
+
+    return _wheel
@@ -1,9 +1,15 @@
 import logging
 import json
+import time
 import web
 
+import rpipe.config.client
+import rpipe.config.statsd
 import rpipe.config.web_server
 import rpipe.event
+import rpipe.exceptions
+import rpipe.stats
+import rpipe.views.headers
 import rpipe.client.connection
 
 _logger = logging.getLogger(__name__)
@@ -16,10 +22,70 @@ class EventClient(object):
         _logger.info("Client received request, to be sent to server: [%s] "
                      "[%s]", verb, noun)
 
-        c = rpipe.client.connection.get_connection()
         mimetype = web.ctx.env.get('CONTENT_TYPE')
+        timeout = rpipe.views.headers.get_timeout()
+        priority = rpipe.views.headers.get_priority()
+        accept = web.ctx.env.get('HTTP_ACCEPT')
+
+        # An idempotent request may be retried (on whichever server is then 
+        # chosen) if its pipe drops before the reply arrives.
+        if verb in rpipe.config.client.FAILOVER_RETRY_VERBS:
+            attempts = 2
+        else:
+            attempts = 1
+
+        for i in range(attempts):
+            # If we're reconnecting, the request waits for a pipe (within its 
+            # own timeout, if it has one).
+            start_epoch = time.time()
+
+            try:
+                c = rpipe.client.connection.get_connection(
+                        verb, 
+                        noun, 
+                        timeout=timeout)
+            except rpipe.exceptions.RpConnectionUnavailable:
+                raise web.HTTPError('503 No connection to server')
+            except rpipe.exceptions.RpBackpressure:
+                raise web.HTTPError('503 Too many requests waiting for a '
+                                    'connection')
+
+            if timeout is not None:
+                timeout = max(0, timeout - (time.time() - start_epoch))
+
+            try:
+                r = rpipe.event.emit(
+                        c, 
+                        verb, 
+                        noun, 
+                        web.data(), 
+                        mimetype, 
+                        timeout=timeout,
+                        priority=priority,
+                        accept=accept)
+            except rpipe.exceptions.RpConnectionClosed:
+                if i + 1 < attempts:
+                    _logger.warning("Pipe closed while waiting on [%s] [%s]. "
+                                    "Retrying.", verb, noun)
+
+                    rpipe.stats.post_to_counter(
+                        rpipe.config.statsd.\
+                            EVENT_CONNECTION_CLIENT_FAILOVER_RETRY_TICK)
+
+                    continue
+
+                raise web.HTTPError('503 Connection closed')
+            except rpipe.exceptions.RpMessageTooLarge:
+                raise web.HTTPError('413 Event too large')
+            except rpipe.exceptions.RpBinaryDataUnsupported:
+                raise web.HTTPError('415 Peer does not accept binary event data')
+            except rpipe.exceptions.RpBackpressure:
+                raise web.HTTPError('503 Connection is saturated')
+            except rpipe.exceptions.RpReplyTimeout:
+                raise web.HTTPError('504 Event reply timed out')
+
+            break
 
-        r = rpipe.event.emit(c, verb, noun, web.data(), mimetype)
         (code, mimetype, data) = r
 
         web.header(rpipe.config.web_server.HEADER_EVENT_RETURN_CODE, code)
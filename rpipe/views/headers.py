@@ -0,0 +1,42 @@
+"""Parsing of the event headers that both the client and server views 
+accept.
+"""
+
+import web
+
+import rpipe.config.exchange
+import rpipe.config.web_server
+
+def _get_header(header_name):
+    env_name = 'HTTP_' + header_name.upper().replace('-', '_')
+    return web.ctx.env.get(env_name)
+
+def get_timeout():
+    header_name = rpipe.config.web_server.HEADER_EVENT_TIMEOUT_S
+
+    timeout = _get_header(header_name)
+    if timeout is None:
+        return None
+
+    try:
+        timeout = float(timeout)
+    except ValueError:
+        raise web.HTTPError('400 Invalid %s header' % (header_name,))
+
+    # This also rejects NaN.
+    if not (timeout > 0):
+        raise web.HTTPError('400 Invalid %s header' % (header_name,))
+
+    return timeout
+
+def get_priority():
+    header_name = rpipe.config.web_server.HEADER_EVENT_PRIORITY
+
+    priority_name = _get_header(header_name)
+    if priority_name is None:
+        return None
+
+    try:
+        return rpipe.config.exchange.EVENT_PRIORITIES[priority_name.lower()]
+    except KeyError:
+        raise web.HTTPError('400 Invalid %s header' % (header_name,))
@@ -6,11 +6,14 @@ import web
 
 import rpipe.config.web_server
 import rpipe.config.general
+import rpipe.config.server
 import rpipe.server.exceptions
 import rpipe.event
+import rpipe.exceptions
 import rpipe.server.connection
-import rpipe.utility
 import rpipe.server.hostname_resolver
+import rpipe.utility
+import rpipe.views.headers
 
 _logger = logging.getLogger(__name__)
 
@@ -23,43 +26,91 @@ class EventServer(object):
 
         self.__cc = rpipe.server.connection.get_connection_catalog()
 
-        hostname_resolver_cls = rpipe.utility.load_cls_from_string(
-                                   rpipe.config.server.\
-                                        CLIENT_HOSTNAME_RESOLVER_CLS)
+        if rpipe.config.server.CLIENT_HOSTNAME_RESOLVER_CLS is None:
+            self.__resolver = None
+        else:
+            hostname_resolver_cls = rpipe.utility.load_cls_from_string(
+                                       rpipe.config.server.\
+                                            CLIENT_HOSTNAME_RESOLVER_CLS)
+
+            assert issubclass(
+                    hostname_resolver_cls, 
+                    rpipe.server.hostname_resolver.HostnameResolver)
+
+            self.__resolver = hostname_resolver_cls()
 
-        assert issubclass(
-                hostname_resolver_cls, 
-                rpipe.server.hostname_resolver.HostnameResolver)
+    def __resolve(self, hostname):
+        """Fallback for names that no client has identified itself with (only 
+        if a resolver is configured).
+        """
 
-        self.__resolver = hostname_resolver_cls()
+        try:
+            ip = self.__resolver.lookup(hostname)
+        except LookupError:
+            raise web.HTTPError('404 Hostname not resolvable')
+        except:
+            _logger.exception("Could not resolve hostname: [%s]", hostname)
+            raise web.HTTPError('500 Hostname resolution error')
+
+        _logger.debug("Resolved client hostname [%s]: [%s]", hostname, ip)
+        return ip
 
     def handle(self, verb, hostname, noun):
         _logger.info("Server received request, to be sent to client [%s]: "
                      "[%s] [%s]", hostname, verb, noun)
 
         if re.match(rpipe.config.general.IP_RX, hostname) is not None:
-            ip = hostname
-            _logger.debug("The client hostname is actually an IP: [%s]", ip)
+            _logger.debug("The client hostname is actually an IP: [%s]", 
+                          hostname)
+
+            (key, index) = (hostname, rpipe.server.connection.IDX_IP)
         else:
-            try:
-                ip = self.__resolver.lookup(hostname)
-            except LookupError:
-                raise web.HTTPError('404 Hostname not resolvable')
-            except:
-                _logger.exception("Could not resolve hostname: [%s]", 
-                                  hostname)
-                raise web.HTTPError('500 Hostname resolution error')
-            else:
-                _logger.debug("Resolved client hostname [%s]: [%s]", hostname, ip)
+            # Clients are looked-up by the names that they identified 
+            # themselves with (certificate or hello), even while they're 
+            # reconnecting. The name is only resolved to an IP if a resolver 
+            # is configured and no client has that name, since several 
+            # clients can share an IP (e.g. behind NAT).
+            (key, index) = (hostname, rpipe.server.connection.IDX_HOSTNAME)
+
+            if self.__resolver is not None:
+                try:
+                    self.__cc.get_connection_by_hostname(hostname)
+                except KeyError:
+                    (key, index) = (self.__resolve(hostname), 
+                                    rpipe.server.connection.IDX_IP)
 
         try:
-            c = self.__cc.wait_for_connection(ip)
+            c = self.__cc.wait_for_connection(key, index=index)
         except rpipe.server.exceptions.RpNoConnectionException:
             raise web.HTTPError('503 Client connection unavailable')            
 
         mimetype = web.ctx.env.get('CONTENT_TYPE')
+        timeout = rpipe.views.headers.get_timeout()
+        priority = rpipe.views.headers.get_priority()
+        accept = web.ctx.env.get('HTTP_ACCEPT')
+
+        try:
+            r = rpipe.event.emit(
+                    c, 
+                    verb, 
+                    noun, 
+                    web.data(), 
+                    mimetype, 
+                    timeout=timeout,
+                    priority=priority,
+                    accept=accept)
+        except rpipe.exceptions.RpConnectionRetry:
+            # The client disconnected before answering.
+            raise web.HTTPError('503 Connection closed')
+        except rpipe.exceptions.RpMessageTooLarge:
+            raise web.HTTPError('413 Event too large')
+        except rpipe.exceptions.RpBinaryDataUnsupported:
+            raise web.HTTPError('415 Peer does not accept binary event data')
+        except rpipe.exceptions.RpBackpressure:
+            raise web.HTTPError('503 Connection is saturated')
+        except rpipe.exceptions.RpReplyTimeout:
+            raise web.HTTPError('504 Event reply timed out')
 
-        r = rpipe.event.emit(c, verb, noun, web.data(), mimetype)
         (code, mimetype, data) = r
 
         web.header(rpipe.config.web_server.HEADER_EVENT_RETURN_CODE, code)
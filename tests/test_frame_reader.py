@@ -0,0 +1,118 @@
+import sys
+import os.path
+tests_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, tests_path)
+
+import unittest
+
+import rpipe.exceptions
+import rpipe.protocol
+import rpipe.protocols
+import rpipe.protocols.event_pb2
+
+_MESSAGE_ID = rpipe.protocol._MESSAGE_ID_MINIMUM
+
+
+class _FakeSocket(object):
+    """Serve the given bytes, a little at a time."""
+
+    def __init__(self, data, chunk_length=7):
+        self.__data = data
+        self.__chunk_length = chunk_length
+
+    def recv_into(self, view):
+        chunk = self.__data[:min(len(view), self.__chunk_length)]
+        if not chunk:
+            raise EOFError()
+
+        view[0:len(chunk)] = chunk
+        self.__data = self.__data[len(chunk):]
+
+        return len(chunk)
+
+
+def _get_event(length):
+    event = rpipe.protocols.event_pb2.Event()
+    event.version = 1
+    event.verb = 'post'
+    event.noun = 'data'
+    event.data = 'x' * length
+
+    return event
+
+def _get_partial_frame(message_id, body):
+    return rpipe.protocol._pack_frame(
+            rpipe.protocols.MT_EVENT,
+            rpipe.protocol.MF_HAS_MORE,
+            message_id,
+            body)
+
+def _get_reader(data, max_partial_count=4, max_partial_bytes=1024):
+    return rpipe.protocol.FrameReader(
+            _FakeSocket(data),
+            64,
+            1024 * 1024,
+            max_partial_count,
+            max_partial_bytes)
+
+
+class FrameReaderTest(unittest.TestCase):
+    def test_reassemble_interleaved(self):
+        frames = []
+        for i in range(3):
+            (fragments, message_id) = \
+                rpipe.protocol.serialize_message_obj_fragments(
+                    _get_event(100 + i),
+                    fragment_bytes=40)
+
+            frames.append(list(fragments))
+
+        # Send the first fragment of every message, then the second, etc..
+        data = ''
+        while any(frames):
+            for fragments in frames:
+                if fragments:
+                    data += fragments.pop(0)
+
+        reader = _get_reader(data, max_partial_count=3, max_partial_bytes=256)
+        lengths = [len(reader.read_message()[1].data) for i in range(3)]
+
+        self.assertEqual(sorted(lengths), [100, 101, 102])
+
+    def test_too_many_open(self):
+        data = ''.join(_get_partial_frame(_MESSAGE_ID + i, 'x')
+                       for i in range(5))
+
+        reader = _get_reader(data, max_partial_count=4)
+
+        self.assertRaises(
+            rpipe.exceptions.RpProtocolError,
+            reader.read_message)
+
+    def test_too_many_bytes_open(self):
+        data = ''.join(_get_partial_frame(_MESSAGE_ID + i, 'x' * 300)
+                       for i in range(4))
+
+        reader = _get_reader(data, max_partial_bytes=1024)
+
+        self.assertRaises(
+            rpipe.exceptions.RpProtocolError,
+            reader.read_message)
+
+    def test_completed_messages_free_their_bytes(self):
+        data = ''
+        for i in range(10):
+            (fragments, message_id) = \
+                rpipe.protocol.serialize_message_obj_fragments(
+                    _get_event(300),
+                    fragment_bytes=200)
+
+            data += ''.join(fragments)
+
+        reader = _get_reader(data, max_partial_count=1, max_partial_bytes=512)
+
+        for i in range(10):
+            self.assertEqual(len(reader.read_message()[1].data), 300)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+import sys
+import os.path
+tests_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, tests_path)
+
+import contextlib
+import random
+import unittest
+
+import rpipe.exceptions
+import rpipe.protocol
+
+_MINIMUM = rpipe.protocol._MESSAGE_ID_MINIMUM
+_MAXIMUM = rpipe.protocol._MESSAGE_ID_MAXIMUM
+
+
+class MessageIdAllocatorTest(unittest.TestCase):
+    def test_sequential(self):
+        allocator = rpipe.protocol.MessageIdAllocator({}, start=_MINIMUM)
+
+        self.assertEqual(
+            [allocator.allocate() for i in range(3)],
+            [_MINIMUM, _MINIMUM + 1, _MINIMUM + 2])
+
+    def test_wraparound(self):
+        allocator = rpipe.protocol.MessageIdAllocator(
+                        {},
+                        start=_MAXIMUM - 2)
+
+        self.assertEqual(
+            [allocator.allocate() for i in range(4)],
+            [_MAXIMUM - 2, _MAXIMUM - 1, _MINIMUM, _MINIMUM + 1])
+
+    def test_skips_in_flight_across_wraparound(self):
+        in_flight = {
+            _MAXIMUM - 1: None,
+            _MINIMUM: None,
+            _MINIMUM + 1: None,
+        }
+
+        allocator = rpipe.protocol.MessageIdAllocator(
+                        in_flight,
+                        start=_MAXIMUM - 2)
+
+        self.assertEqual(
+            [allocator.allocate() for i in range(2)],
+            [_MAXIMUM - 2, _MINIMUM + 2])
+
+    def test_exhausted(self):
+        class _Everything(object):
+            def __contains__(self, message_id):
+                return True
+
+        allocator = rpipe.protocol.MessageIdAllocator(
+                        _Everything(),
+                        start=_MINIMUM)
+
+        with _narrowed_range(100):
+            self.assertRaises(
+                rpipe.exceptions.RpException,
+                allocator.allocate)
+
+    def test_no_reuse_while_in_flight(self):
+        """Allocate millions of IDs, with thousands outstanding at any time 
+        (released in a random order, so that some stay in flight for a long 
+        time). The range is narrowed so that we wrap around it hundreds of 
+        times and have to skip over the outstanding IDs on every pass.
+        """
+
+        allocation_count = 2000000
+        outstanding_count = 5000
+        range_size = 10000
+
+        rng = random.Random(0)
+        in_flight = {}
+        outstanding = []
+
+        allocator = rpipe.protocol.MessageIdAllocator(
+                        in_flight,
+                        start=_MINIMUM + range_size // 2)
+
+        wrap_count = 0
+        previous_id = None
+
+        with _narrowed_range(range_size):
+            for i in range(allocation_count):
+                message_id = allocator.allocate()
+
+                self.assertTrue(
+                    _MINIMUM <= message_id < _MINIMUM + range_size)
+
+                self.assertNotIn(message_id, in_flight)
+
+                if previous_id is not None and message_id < previous_id:
+                    wrap_count += 1
+
+                previous_id = message_id
+                in_flight[message_id] = i
+                outstanding.append(message_id)
+
+                if len(outstanding) >= outstanding_count:
+                    j = rng.randrange(len(outstanding))
+                    outstanding[j], outstanding[-1] = \
+                        outstanding[-1], outstanding[j]
+
+                    del in_flight[outstanding.pop()]
+
+        self.assertTrue(wrap_count > 100)
+
+
+@contextlib.contextmanager
+def _narrowed_range(range_size):
+    """Allocate from only the bottom of the range."""
+
+    original_maximum = rpipe.protocol._MESSAGE_ID_MAXIMUM
+    rpipe.protocol._MESSAGE_ID_MAXIMUM = _MINIMUM + range_size
+
+    try:
+        yield
+    finally:
+        rpipe.protocol._MESSAGE_ID_MAXIMUM = original_maximum
+
+if __name__ == '__main__':
+    unittest.main()